@@ -0,0 +1,56 @@
+"""Take change sequence values from a Postgres sequence
+
+Revision ID: 3c8d2f6a9b17
+Revises: f37b0a9c4e12
+Create Date: 2026-10-20 09:12:05.318442
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+import sqlmodel
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "3c8d2f6a9b17"
+down_revision: Union[str, None] = "f37b0a9c4e12"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.batch_alter_table("syncsequence", schema=None) as batch_op:
+        batch_op.add_column(
+            sa.Column(
+                "pruned_through", sa.Integer(), nullable=False, server_default="0"
+            )
+        )
+    op.execute(
+        "INSERT INTO syncsequence (id, value, pruned_through) SELECT 1, 0, 0 "
+        "WHERE NOT EXISTS (SELECT 1 FROM syncsequence WHERE id = 1)"
+    )
+
+    # SQLite keeps counting in the syncsequence row
+    if op.get_bind().dialect.name != "postgresql":
+        return
+    op.execute("CREATE SEQUENCE change_seq")
+    # Continues after the last value handed out by the counter row
+    op.execute(
+        "SELECT setval('change_seq', GREATEST(value, 1), value > 0) "
+        "FROM syncsequence WHERE id = 1"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if op.get_bind().dialect.name == "postgresql":
+        op.execute(
+            "UPDATE syncsequence SET value = (SELECT CASE WHEN is_called "
+            "THEN last_value ELSE 0 END FROM change_seq) WHERE id = 1"
+        )
+        op.execute("DROP SEQUENCE change_seq")
+
+    with op.batch_alter_table("syncsequence", schema=None) as batch_op:
+        batch_op.drop_column("pruned_through")
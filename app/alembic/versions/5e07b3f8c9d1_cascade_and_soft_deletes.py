@@ -0,0 +1,59 @@
+"""Cascade user deletes in the database and add soft deletes
+
+Revision ID: 5e07b3f8c9d1
+Revises: d41c7e9b52a3
+Create Date: 2026-10-19 15:48:52.019374
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+import sqlmodel
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "5e07b3f8c9d1"
+down_revision: Union[str, None] = "d41c7e9b52a3"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Foreign keys to user that now cascade. SQLite doesn't enforce foreign keys
+# here and the handlers delete the rows explicitly anyway, so only Postgres
+# constraints are recreated.
+CASCADING_USER_FOREIGN_KEYS = [
+    ("meal", "meal_creator_id_fkey"),
+    ("mealshare", "mealshare_creator_id_fkey"),
+]
+
+
+def recreate_user_foreign_keys(ondelete: str | None) -> None:
+    if op.get_bind().dialect.name != "postgresql":
+        return
+    for table, constraint in CASCADING_USER_FOREIGN_KEYS:
+        op.drop_constraint(constraint, table, type_="foreignkey")
+        op.create_foreign_key(
+            constraint, table, "user", ["creator_id"], ["id"], ondelete=ondelete
+        )
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.batch_alter_table("user", schema=None) as batch_op:
+        batch_op.add_column(sa.Column("deleted_at", sa.DateTime(), nullable=True))
+
+    with op.batch_alter_table("fooditem", schema=None) as batch_op:
+        batch_op.add_column(sa.Column("deleted_at", sa.DateTime(), nullable=True))
+
+    recreate_user_foreign_keys(ondelete="CASCADE")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    recreate_user_foreign_keys(ondelete=None)
+
+    with op.batch_alter_table("fooditem", schema=None) as batch_op:
+        batch_op.drop_column("deleted_at")
+
+    with op.batch_alter_table("user", schema=None) as batch_op:
+        batch_op.drop_column("deleted_at")
@@ -0,0 +1,50 @@
+"""Keep food items of deleted users without a creator
+
+Revision ID: 7d4b9e2f1a60
+Revises: 3c8d2f6a9b17
+Create Date: 2026-10-20 14:26:41.902317
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+import sqlmodel
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "7d4b9e2f1a60"
+down_revision: Union[str, None] = "3c8d2f6a9b17"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+FOREIGN_KEY = "fooditem_creator_id_fkey"
+
+
+def recreate_foreign_key(ondelete: str | None) -> None:
+    # Like the cascading foreign keys to user, only Postgres constraints are
+    # recreated, the handlers clear creator_id explicitly anyway
+    if op.get_bind().dialect.name != "postgresql":
+        return
+    op.drop_constraint(FOREIGN_KEY, "fooditem", type_="foreignkey")
+    op.create_foreign_key(
+        FOREIGN_KEY, "fooditem", "user", ["creator_id"], ["id"], ondelete=ondelete
+    )
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.batch_alter_table("fooditem", schema=None) as batch_op:
+        batch_op.alter_column("creator_id", existing_type=sa.Integer(), nullable=True)
+
+    recreate_foreign_key(ondelete="SET NULL")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # Fails while food items of deleted users exist, they have nobody to
+    # belong to in the old schema
+    recreate_foreign_key(ondelete=None)
+
+    with op.batch_alter_table("fooditem", schema=None) as batch_op:
+        batch_op.alter_column("creator_id", existing_type=sa.Integer(), nullable=False)
@@ -0,0 +1,73 @@
+"""Store nutrition values as integer hundredths
+
+Revision ID: 8b2e4d61a0f7
+Revises: 3f9a1c2d7b4e
+Create Date: 2026-10-19 11:03:17.554092
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+import sqlmodel
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "8b2e4d61a0f7"
+down_revision: Union[str, None] = "3f9a1c2d7b4e"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# (table, column, nullable)
+NUTRITION_COLUMNS = [
+    ("fooditem", "calories", False),
+    ("fooditem", "fats", False),
+    ("fooditem", "carbs", False),
+    ("fooditem", "protein", False),
+    ("fooditem", "portion_weight", True),
+    ("meal", "calories", False),
+    ("meal", "food_amount", False),
+]
+
+# What `SQLModel.metadata.create_all` made of `Decimal(decimal_places=2)`
+# without max_digits: NUMERIC with no precision limit, values kept at scale 2
+PREVIOUS_TYPE = sa.Numeric(scale=2)
+
+
+def convert_columns(new_type, conversion: str) -> None:
+    # Copy every value into a temporary column, then swap it in place of the
+    # original one. The old columns have exactly two decimal places, so going
+    # through round(value * 100) is lossless in both directions.
+    for table in ("fooditem", "meal"):
+        columns = [
+            (column, nullable)
+            for column_table, column, nullable in NUTRITION_COLUMNS
+            if column_table == table
+        ]
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            for column, _ in columns:
+                batch_op.add_column(sa.Column(f"{column}_new", new_type, nullable=True))
+        for column, _ in columns:
+            op.execute(
+                f"UPDATE {table} SET {column}_new = " + conversion.format(column=column)
+            )
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            for column, nullable in columns:
+                batch_op.drop_column(column)
+                batch_op.alter_column(
+                    f"{column}_new",
+                    new_column_name=column,
+                    existing_type=new_type,
+                    nullable=nullable,
+                )
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    convert_columns(sa.BigInteger(), "CAST(ROUND({column} * 100) AS BIGINT)")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # Plain division would leave the result scale of numeric division behind
+    convert_columns(PREVIOUS_TYPE, "ROUND({column} / 100.0, 2)")
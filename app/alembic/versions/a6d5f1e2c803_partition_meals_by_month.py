@@ -0,0 +1,138 @@
+"""Partition meals by month on Postgres
+
+Revision ID: a6d5f1e2c803
+Revises: 5e07b3f8c9d1
+Create Date: 2026-10-19 17:35:10.412960
+
+"""
+
+from datetime import date
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+import sqlmodel
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "a6d5f1e2c803"
+down_revision: Union[str, None] = "5e07b3f8c9d1"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+MEAL_COLUMNS = (
+    "id, food_item_id, created_at, is_shared, mealtime_id, creator_id, "
+    "calories, food_amount"
+)
+MONTHS_AHEAD = 3
+
+
+def add_months(day: date, months: int) -> date:
+    month_index = day.year * 12 + day.month - 1 + months
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # SQLite keeps a single meal table
+    if op.get_bind().dialect.name != "postgresql":
+        return
+
+    op.execute("ALTER TABLE meal RENAME TO meal_unpartitioned")
+    op.execute(
+        "ALTER TABLE meal_unpartitioned RENAME CONSTRAINT meal_pkey "
+        "TO meal_unpartitioned_pkey"
+    )
+    op.execute(
+        "ALTER INDEX ix_meal_creator_id_created_at "
+        "RENAME TO ix_meal_unpartitioned_creator_id_created_at"
+    )
+    # The partition key has to be part of the primary key
+    op.execute(
+        """
+        CREATE TABLE meal (
+            id INTEGER NOT NULL DEFAULT nextval('meal_id_seq'),
+            food_item_id INTEGER,
+            created_at DATE NOT NULL,
+            is_shared BOOLEAN NOT NULL,
+            mealtime_id INTEGER NOT NULL,
+            creator_id INTEGER NOT NULL,
+            calories BIGINT NOT NULL,
+            food_amount BIGINT NOT NULL,
+            CONSTRAINT meal_pkey PRIMARY KEY (id, created_at),
+            CONSTRAINT meal_food_item_id_fkey FOREIGN KEY (food_item_id)
+                REFERENCES fooditem (id) ON DELETE CASCADE,
+            CONSTRAINT meal_creator_id_fkey FOREIGN KEY (creator_id)
+                REFERENCES "user" (id) ON DELETE CASCADE
+        ) PARTITION BY RANGE (created_at)
+        """
+    )
+    op.execute(
+        "CREATE INDEX ix_meal_creator_id_created_at ON meal (creator_id, created_at)"
+    )
+    op.execute("CREATE TABLE meal_default PARTITION OF meal DEFAULT")
+
+    first_day = (
+        op.get_bind()
+        .execute(sa.text("SELECT min(created_at) FROM meal_unpartitioned"))
+        .scalar()
+    )
+    current_month = date.today().replace(day=1)
+    month = (first_day or current_month).replace(day=1)
+    while month <= add_months(current_month, MONTHS_AHEAD):
+        op.execute(
+            f"CREATE TABLE meal_y{month.year:04d}m{month.month:02d} PARTITION OF meal "
+            f"FOR VALUES FROM ('{month}') TO ('{add_months(month, 1)}')"
+        )
+        month = add_months(month, 1)
+
+    op.execute(
+        f"INSERT INTO meal ({MEAL_COLUMNS}) "
+        f"SELECT {MEAL_COLUMNS} FROM meal_unpartitioned"
+    )
+    op.execute("ALTER SEQUENCE meal_id_seq OWNED BY meal.id")
+    op.execute("DROP TABLE meal_unpartitioned")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if op.get_bind().dialect.name != "postgresql":
+        return
+
+    # Archived partitions are not restored, only what is still attached
+    op.execute("ALTER TABLE meal RENAME TO meal_partitioned")
+    op.execute(
+        "ALTER TABLE meal_partitioned RENAME CONSTRAINT meal_pkey "
+        "TO meal_partitioned_pkey"
+    )
+    op.execute(
+        "ALTER INDEX ix_meal_creator_id_created_at "
+        "RENAME TO ix_meal_partitioned_creator_id_created_at"
+    )
+    op.execute(
+        """
+        CREATE TABLE meal (
+            id INTEGER NOT NULL DEFAULT nextval('meal_id_seq'),
+            food_item_id INTEGER,
+            created_at DATE NOT NULL,
+            is_shared BOOLEAN NOT NULL,
+            mealtime_id INTEGER NOT NULL,
+            creator_id INTEGER NOT NULL,
+            calories BIGINT NOT NULL,
+            food_amount BIGINT NOT NULL,
+            CONSTRAINT meal_pkey PRIMARY KEY (id),
+            CONSTRAINT meal_food_item_id_fkey FOREIGN KEY (food_item_id)
+                REFERENCES fooditem (id) ON DELETE CASCADE,
+            CONSTRAINT meal_creator_id_fkey FOREIGN KEY (creator_id)
+                REFERENCES "user" (id) ON DELETE CASCADE
+        )
+        """
+    )
+    op.execute(
+        "CREATE INDEX ix_meal_creator_id_created_at ON meal (creator_id, created_at)"
+    )
+    op.execute(
+        f"INSERT INTO meal ({MEAL_COLUMNS}) "
+        f"SELECT {MEAL_COLUMNS} FROM meal_partitioned"
+    )
+    op.execute("ALTER SEQUENCE meal_id_seq OWNED BY meal.id")
+    op.execute("DROP TABLE meal_partitioned")
@@ -0,0 +1,105 @@
+"""Add change tracking for delta sync
+
+Revision ID: b19e6a4d7f25
+Revises: a6d5f1e2c803
+Create Date: 2026-10-19 19:02:44.736518
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+import sqlmodel
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "b19e6a4d7f25"
+down_revision: Union[str, None] = "a6d5f1e2c803"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "syncsequence",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("value", sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_table(
+        "tombstone",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column(
+            "entity", sqlmodel.sql.sqltypes.AutoString(length=16), nullable=False
+        ),
+        sa.Column("entity_id", sa.Integer(), nullable=False),
+        sa.Column("creator_id", sa.Integer(), nullable=True),
+        sa.Column("change_seq", sa.Integer(), nullable=False),
+        sa.Column("deleted_at", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    with op.batch_alter_table("tombstone", schema=None) as batch_op:
+        batch_op.create_index(
+            batch_op.f("ix_tombstone_change_seq"), ["change_seq"], unique=False
+        )
+        batch_op.create_index(
+            batch_op.f("ix_tombstone_creator_id"), ["creator_id"], unique=False
+        )
+
+    for table in ("fooditem", "meal"):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.add_column(sa.Column("updated_at", sa.DateTime(), nullable=True))
+            batch_op.add_column(sa.Column("change_seq", sa.Integer(), nullable=True))
+
+    # Give every existing row its own sequence value so that a first sync with
+    # since=0 returns everything, then continue the counter after them.
+    op.execute("UPDATE fooditem SET updated_at = CURRENT_TIMESTAMP, change_seq = id")
+    op.execute(
+        "UPDATE meal SET updated_at = CURRENT_TIMESTAMP, change_seq = id + "
+        "(SELECT COALESCE(MAX(id), 0) FROM fooditem)"
+    )
+    op.execute(
+        "INSERT INTO syncsequence (id, value) SELECT 1, COALESCE(MAX(change_seq), 0) "
+        "FROM (SELECT change_seq FROM fooditem UNION ALL SELECT change_seq FROM meal) "
+        "AS changes"
+    )
+
+    for table in ("fooditem", "meal"):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.alter_column(
+                "updated_at", existing_type=sa.DateTime(), nullable=False
+            )
+            batch_op.alter_column(
+                "change_seq", existing_type=sa.Integer(), nullable=False
+            )
+
+    with op.batch_alter_table("fooditem", schema=None) as batch_op:
+        batch_op.create_index(
+            batch_op.f("ix_fooditem_change_seq"), ["change_seq"], unique=False
+        )
+
+    with op.batch_alter_table("meal", schema=None) as batch_op:
+        batch_op.create_index(
+            "ix_meal_creator_id_change_seq", ["creator_id", "change_seq"], unique=False
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table("meal", schema=None) as batch_op:
+        batch_op.drop_index("ix_meal_creator_id_change_seq")
+        batch_op.drop_column("change_seq")
+        batch_op.drop_column("updated_at")
+
+    with op.batch_alter_table("fooditem", schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f("ix_fooditem_change_seq"))
+        batch_op.drop_column("change_seq")
+        batch_op.drop_column("updated_at")
+
+    with op.batch_alter_table("tombstone", schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f("ix_tombstone_creator_id"))
+        batch_op.drop_index(batch_op.f("ix_tombstone_change_seq"))
+
+    op.drop_table("tombstone")
+    op.drop_table("syncsequence")
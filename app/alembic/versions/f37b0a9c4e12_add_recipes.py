@@ -0,0 +1,62 @@
+"""Add recipes
+
+Revision ID: f37b0a9c4e12
+Revises: e8a3c5b71d09
+Create Date: 2026-10-19 22:31:47.205361
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+import sqlmodel
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "f37b0a9c4e12"
+down_revision: Union[str, None] = "e8a3c5b71d09"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "recipeingredient",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("recipe_id", sa.Integer(), nullable=False),
+        sa.Column("ingredient_id", sa.Integer(), nullable=False),
+        sa.Column("amount", sa.BigInteger(), nullable=False),
+        sa.ForeignKeyConstraint(["ingredient_id"], ["fooditem.id"]),
+        sa.ForeignKeyConstraint(["recipe_id"], ["fooditem.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("recipe_id", "ingredient_id"),
+    )
+    with op.batch_alter_table("recipeingredient", schema=None) as batch_op:
+        batch_op.create_index(
+            batch_op.f("ix_recipeingredient_ingredient_id"),
+            ["ingredient_id"],
+            unique=False,
+        )
+        batch_op.create_index(
+            batch_op.f("ix_recipeingredient_recipe_id"), ["recipe_id"], unique=False
+        )
+
+    with op.batch_alter_table("fooditem", schema=None) as batch_op:
+        batch_op.add_column(
+            sa.Column(
+                "is_recipe", sa.Boolean(), nullable=False, server_default=sa.false()
+            )
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table("fooditem", schema=None) as batch_op:
+        batch_op.drop_column("is_recipe")
+
+    with op.batch_alter_table("recipeingredient", schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f("ix_recipeingredient_recipe_id"))
+        batch_op.drop_index(batch_op.f("ix_recipeingredient_ingredient_id"))
+
+    op.drop_table("recipeingredient")
@@ -0,0 +1,64 @@
+"""The schema as of the first release, where the migration chain picks up.
+
+The migrations only change tables that already exist, the oldest ones were
+generated against a database created by `SQLModel.metadata.create_all`. A
+new database gets these tables, is stamped with BASELINE_REVISION and is
+then upgraded like any other, so it ends up with exactly the schema the
+migrations produce, Postgres partitions included.
+"""
+
+import sqlalchemy as sa
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import Engine
+
+BASELINE_REVISION = "c5c26ed90662"
+
+metadata = sa.MetaData()
+
+sa.Table(
+    "user",
+    metadata,
+    sa.Column("username", sa.String(64), nullable=False, unique=True),
+    sa.Column("id", sa.Integer, primary_key=True),
+    sa.Column("is_active", sa.Boolean, nullable=False),
+    sa.Column("is_admin", sa.Boolean, nullable=False),
+    sa.Column("hashed_password", sa.String(255), nullable=False),
+)
+
+sa.Table(
+    "fooditem",
+    metadata,
+    sa.Column("name", sa.String(256), nullable=False),
+    sa.Column("brand", sa.String(64)),
+    sa.Column("calories", sa.Numeric(scale=2), nullable=False),
+    sa.Column("fats", sa.Numeric(scale=2), nullable=False),
+    sa.Column("carbs", sa.Numeric(scale=2), nullable=False),
+    sa.Column("protein", sa.Numeric(scale=2), nullable=False),
+    sa.Column("portion_weight", sa.Numeric(scale=2)),
+    sa.Column("barcode", sa.String(64), nullable=False),
+    sa.Column("id", sa.Integer, primary_key=True),
+    sa.Column("edit_locked", sa.Boolean, nullable=False),
+    sa.Column("creator_id", sa.Integer, sa.ForeignKey("user.id"), nullable=False),
+)
+
+sa.Table(
+    "meal",
+    metadata,
+    sa.Column("calories", sa.Numeric(scale=2), nullable=False),
+    sa.Column("food_amount", sa.Numeric(scale=2), nullable=False),
+    sa.Column(
+        "food_item_id", sa.Integer, sa.ForeignKey("fooditem.id", ondelete="CASCADE")
+    ),
+    sa.Column("created_at", sa.Date, nullable=False),
+    sa.Column("is_shared", sa.Boolean, nullable=False),
+    sa.Column("mealtime_id", sa.Integer, nullable=False),
+    sa.Column("id", sa.Integer, primary_key=True),
+    sa.Column("creator_id", sa.Integer, sa.ForeignKey("user.id"), nullable=False),
+)
+
+
+def create_baseline_schema(engine: Engine, config: Config) -> None:
+    """Create the baseline tables in an empty database and stamp them."""
+    metadata.create_all(engine)
+    command.stamp(config, BASELINE_REVISION)
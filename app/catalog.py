@@ -0,0 +1,390 @@
+"""Memory-mapped snapshot of the food catalog.
+
+With CATALOG_SNAPSHOT_PATH set, a job exports every food item into one
+columnar file: a header, fixed-width little-endian arrays and a heap holding
+the strings. Every worker maps that file read-only, so the pages are shared
+between processes and looking up a food item by id or barcode needs no
+database round trip. /meals/summary adds up the macros of the meals on the
+mapped arrays instead of joining the food items. Changed food items are tracked per worker and read from
+the database until a snapshot covering the change has been swapped in. A
+worker loading its first snapshot looks up the changes the snapshot misses,
+after that the invalidation bus tells it about every change.
+
+Layout, all arrays 8-byte aligned after a 64 byte header:
+
+    header       magic, generation, count, heap size
+    int columns  id (ascending), nutrition values in hundredths, ...  count each
+    offsets      start of each name, brand and barcode in the heap    count + 1
+    barcodes     hash of every barcode (ascending) and its row        count each
+    heap         UTF-8 names, then brands, then barcodes
+"""
+
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+
+import numpy as np
+from sqlalchemy import BigInteger, Engine, type_coerce
+from sqlmodel import Session, col, select
+
+from app.invalidation import CATALOG, FOOD_ITEM, bus
+from app.jobs import QUEUED, enqueue, job_handler
+from app.models import (
+    CentiUnits,
+    FoodItem,
+    FoodItemPublic,
+    Job,
+    Tombstone,
+)
+from app.statements import food_item_by_barcode
+from app.sync import FOOD_ITEM_ENTITY, settled_change_seq
+
+logger = logging.getLogger(__name__)
+
+EXPORT_JOB = "export_catalog"
+MAGIC = b"CTCATv01"
+HEADER = struct.Struct("<8sQQQ")
+HEADER_SIZE = 64
+INT_COLUMNS = (
+    "id",
+    "calories",
+    "fats",
+    "carbs",
+    "protein",
+    "portion_weight",
+    "creator_id",
+    "is_recipe",
+)
+STRING_COLUMNS = ("name", "brand", "barcode")
+MACRO_COLUMNS = ("fats", "carbs", "protein")
+# Stand for a missing portion weight and creator in the integer columns
+NO_PORTION_WEIGHT = -1
+NO_CREATOR = -1
+
+
+def barcode_hash(barcode: str) -> int:
+    digest = hashlib.blake2b(barcode.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+## Writing
+
+
+def export_catalog(session: Session, path: str) -> int:
+    # The change sequence counts every change, so a snapshot exported at
+    # generation G contains every food item change with change_seq <= G. Read
+    # it first: rows read afterwards can only be newer.
+    generation = settled_change_seq(session.connection())
+    columns = [
+        type_coerce(getattr(FoodItem, name), BigInteger)
+        for name in ("calories", "fats", "carbs", "protein", "portion_weight")
+    ]
+    rows = session.exec(
+        select(
+            col(FoodItem.id),
+            *columns,
+            col(FoodItem.creator_id),
+            col(FoodItem.is_recipe),
+            col(FoodItem.name),
+            col(FoodItem.brand),
+            col(FoodItem.barcode),
+        )
+        .where(col(FoodItem.deleted_at).is_(None))
+        .order_by(col(FoodItem.id))
+    ).all()
+    count = len(rows)
+
+    arrays = []
+    for index, name in enumerate(INT_COLUMNS):
+        values = [row[index] for row in rows]
+        if name == "portion_weight":
+            values = [NO_PORTION_WEIGHT if value is None else value for value in values]
+        elif name == "creator_id":
+            values = [NO_CREATOR if value is None else value for value in values]
+        arrays.append(np.array(values, dtype="<i8").reshape(count))
+
+    heap = bytearray()
+    for index, name in enumerate(STRING_COLUMNS, start=len(INT_COLUMNS)):
+        offsets = [len(heap)]
+        for row in rows:
+            heap += (row[index] or "").encode()
+            offsets.append(len(heap))
+        arrays.append(np.array(offsets, dtype="<u8"))
+
+    hashes = np.array([barcode_hash(row[-1] or "") for row in rows], dtype="<u8")
+    order = np.lexsort((np.arange(count), hashes))
+    arrays.append(hashes[order])
+    arrays.append(order.astype("<i8"))
+
+    # Written next to the target and renamed over it, so readers only ever
+    # see a complete file
+    directory = os.path.dirname(os.path.abspath(path))
+    descriptor, temporary = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(descriptor, "wb") as file:
+            header = HEADER.pack(MAGIC, generation, count, len(heap))
+            file.write(header.ljust(HEADER_SIZE, b"\0"))
+            for array in arrays:
+                file.write(array.tobytes())
+            file.write(heap)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+    return generation
+
+
+## Reading
+
+
+class CatalogSnapshot:
+    def __init__(self, path: str):
+        with open(path, "rb") as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.generation, self.count, heap_size = HEADER.unpack_from(self.map)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a food catalog snapshot")
+        offset = HEADER_SIZE
+
+        def take(dtype: str, length: int) -> np.ndarray:
+            nonlocal offset
+            array = np.frombuffer(self.map, dtype=dtype, count=length, offset=offset)
+            offset += array.nbytes
+            return array
+
+        self.columns = {name: take("<i8", self.count) for name in INT_COLUMNS}
+        self.offsets = {name: take("<u8", self.count + 1) for name in STRING_COLUMNS}
+        self.barcode_hashes = take("<u8", self.count)
+        self.barcode_rows = take("<i8", self.count)
+        self.heap = memoryview(self.map)[offset : offset + heap_size]
+
+    def row(self, food_item_id: int) -> int | None:
+        ids = self.columns["id"]
+        row = int(np.searchsorted(ids, food_item_id))
+        if row < self.count and ids[row] == food_item_id:
+            return row
+        return None
+
+    def rows(self, food_item_ids: np.ndarray) -> np.ndarray:
+        """Row of each of the food items, -1 for those not in the snapshot."""
+        ids = self.columns["id"]
+        rows = np.searchsorted(ids, food_item_ids)
+        found = rows < self.count
+        found[found] = ids[rows[found]] == food_item_ids[found]
+        return np.where(found, rows, -1)
+
+    def string(self, name: str, row: int) -> str:
+        offsets = self.offsets[name]
+        return bytes(self.heap[offsets[row] : offsets[row + 1]]).decode()
+
+    def barcode_row(self, barcode: str) -> int | None:
+        # Lowest id among the items with this barcode, like the SQL lookup
+        key = np.uint64(barcode_hash(barcode))
+        start = int(np.searchsorted(self.barcode_hashes, key, side="left"))
+        end = int(np.searchsorted(self.barcode_hashes, key, side="right"))
+        for row in self.barcode_rows[start:end]:
+            if self.string("barcode", int(row)) == barcode:
+                return int(row)
+        return None
+
+    def food_item(self, row: int) -> FoodItemPublic:
+        values = {name: int(self.columns[name][row]) for name in INT_COLUMNS}
+        portion_weight = values["portion_weight"]
+        creator_id = values["creator_id"]
+        return FoodItemPublic(
+            id=values["id"],
+            name=self.string("name", row),
+            brand=self.string("brand", row),
+            calories=CentiUnits.from_units(values["calories"]),
+            fats=CentiUnits.from_units(values["fats"]),
+            carbs=CentiUnits.from_units(values["carbs"]),
+            protein=CentiUnits.from_units(values["protein"]),
+            portion_weight=(
+                None
+                if portion_weight == NO_PORTION_WEIGHT
+                else CentiUnits.from_units(portion_weight)
+            ),
+            barcode=self.string("barcode", row),
+            creator_id=None if creator_id == NO_CREATOR else creator_id,
+            is_recipe=bool(values["is_recipe"]),
+        )
+
+    def close(self) -> None:
+        self.heap.release()
+        self.columns = self.offsets = {}
+        self.map.close()
+
+
+class Catalog:
+    """The snapshot this worker serves from and the food items it has outdated.
+
+    An outdated food item is kept with its change_seq, or None once it is
+    gone from the database, until a snapshot of a later generation covers it.
+    """
+
+    def __init__(self, path: str, engine: Engine):
+        self.path = path
+        self.engine = engine
+        self.snapshot: CatalogSnapshot | None = None
+        self.outdated: dict[int, int | None] = {}
+        self.lock = threading.Lock()
+
+    def current(self) -> CatalogSnapshot | None:
+        if self.snapshot is None and os.path.exists(self.path):
+            self.reload()
+        return self.snapshot
+
+    def reload(self) -> None:
+        try:
+            snapshot = CatalogSnapshot(self.path)
+        except (OSError, ValueError):
+            logger.exception("Could not load the food catalog snapshot")
+            return
+        if self.snapshot is None:
+            # Changes made before this worker subscribed to the bus
+            for food_item_id, change_seq in self.changes_after(snapshot.generation):
+                self.mark_outdated(food_item_id, change_seq)
+        with self.lock:
+            if (
+                self.snapshot is not None
+                and snapshot.generation < self.snapshot.generation
+            ):
+                return
+            # The old mapping stays valid for requests still reading it, it
+            # is unmapped once the last reference is gone
+            self.snapshot = snapshot
+            self.outdated = {
+                food_item_id: change_seq
+                for food_item_id, change_seq in self.outdated.items()
+                if (change_seq is None and snapshot.row(food_item_id) is not None)
+                or (change_seq is not None and change_seq > snapshot.generation)
+            }
+
+    def changes_after(self, generation: int) -> list[tuple[int, int | None]]:
+        with Session(self.engine) as session:
+            changed = session.exec(
+                select(FoodItem.id, FoodItem.change_seq).where(
+                    col(FoodItem.change_seq) > generation
+                )
+            ).all()
+            deleted = session.exec(
+                select(Tombstone.entity_id)
+                .where(col(Tombstone.entity) == FOOD_ITEM_ENTITY)
+                .where(col(Tombstone.change_seq) > generation)
+            ).all()
+        return list(changed) + [(food_item_id, None) for food_item_id in deleted]
+
+    def mark_outdated(self, food_item_id: int, change_seq: int | None) -> None:
+        """Serve the food item from the database until a snapshot covers it.
+
+        `change_seq` is None once the food item is gone from the database.
+        """
+        with self.lock:
+            known = self.outdated.get(food_item_id)
+            if change_seq is None or known is None:
+                self.outdated[food_item_id] = change_seq
+            else:
+                self.outdated[food_item_id] = max(known, change_seq)
+
+    def food_item(self, session: Session, food_item_id: int) -> FoodItemPublic | None:
+        snapshot = self.current()
+        if snapshot is not None and food_item_id not in self.outdated:
+            row = snapshot.row(food_item_id)
+            if row is not None:
+                return snapshot.food_item(row)
+        food_item = session.get(FoodItem, food_item_id)
+        if not food_item or food_item.deleted_at is not None:
+            return None
+        return FoodItemPublic.model_validate(food_item)
+
+    def consumed_macros(
+        self, session: Session, amounts: dict[int, int]
+    ) -> dict[str, int]:
+        """Macros in `amounts` hundredths of grams of each food item.
+
+        In millionths of a gram, like the meal summary query computes them.
+        Food items the snapshot can't answer for are read from the database.
+        """
+        food_item_ids = np.fromiter(amounts, dtype=np.int64, count=len(amounts))
+        centigrams = np.fromiter(amounts.values(), dtype=np.int64, count=len(amounts))
+        totals = dict.fromkeys(MACRO_COLUMNS, 0)
+        served = np.zeros(len(amounts), dtype=bool)
+        snapshot = self.current()
+        if snapshot is not None:
+            rows = snapshot.rows(food_item_ids)
+            served = (rows >= 0) & ~np.isin(food_item_ids, list(self.outdated))
+            for name in MACRO_COLUMNS:
+                values = snapshot.columns[name][rows[served]]
+                totals[name] += int(np.dot(values, centigrams[served]))
+        missing = food_item_ids[~served].tolist()
+        if missing:
+            for food_item_id, *values in session.exec(
+                select(
+                    col(FoodItem.id),
+                    *(
+                        type_coerce(getattr(FoodItem, name), BigInteger)
+                        for name in MACRO_COLUMNS
+                    ),
+                ).where(col(FoodItem.id).in_(missing))
+            ):
+                for name, value in zip(MACRO_COLUMNS, values):
+                    totals[name] += value * amounts[food_item_id]
+        return totals
+
+    def food_item_by_barcode(
+        self, session: Session, barcode: str
+    ) -> FoodItemPublic | None:
+        # Any outdated item might have gained this barcode, so the snapshot
+        # only answers while it is fully up to date
+        snapshot = self.current()
+        if snapshot is not None and not self.outdated:
+            row = snapshot.barcode_row(barcode)
+            if row is not None:
+                return snapshot.food_item(row)
+        food_item = session.scalars(food_item_by_barcode(barcode)).first()
+        return FoodItemPublic.model_validate(food_item) if food_item else None
+
+
+## Wiring
+
+CATALOG_SNAPSHOT_PATH = os.getenv("CATALOG_SNAPSHOT_PATH")
+
+catalog: Catalog | None = None
+
+
+def request_export(session: Session) -> None:
+    """Queue a new snapshot unless one is already waiting to be exported."""
+    if catalog is None:
+        return
+    pending = session.exec(
+        select(Job.id)
+        .where(col(Job.kind) == EXPORT_JOB)
+        .where(col(Job.status) == QUEUED)
+    ).first()
+    if pending is None:
+        enqueue(session, EXPORT_JOB)
+
+
+@job_handler(EXPORT_JOB)
+def run_export_job(session: Session, payload: dict) -> None:
+    if catalog is None:
+        return
+    generation = export_catalog(session, catalog.path)
+    bus.publish(CATALOG, generation)
+
+
+if CATALOG_SNAPSHOT_PATH:
+    from app.dependencies import engine
+
+    catalog = Catalog(CATALOG_SNAPSHOT_PATH, engine)
+    bus.subscribe(
+        FOOD_ITEM,
+        lambda change: catalog.mark_outdated(change["id"], change["change_seq"]),
+    )
+    bus.subscribe(CATALOG, lambda generation: catalog.reload())
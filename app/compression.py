@@ -0,0 +1,147 @@
+import asyncio
+import gzip
+import hashlib
+from collections import OrderedDict
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.negotiation import parse_quality_list
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Smaller bodies fit in a packet or two anyway and aren't worth the CPU
+MINIMUM_SIZE = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+# Compressed copies of recently sent bodies. Food item pages and share
+# snapshots are sent over and over with the same content.
+CACHE_SIZE = 256
+MAX_CACHED_BODY_SIZE = 1024 * 1024
+# Bigger bodies are compressed in a thread so the event loop stays responsive
+THREADED_COMPRESSION_SIZE = 256 * 1024
+
+COMPRESSIBLE_MEDIA_TYPES = (
+    "application/json",
+    "application/msgpack",
+    "application/x-ndjson",
+    "text/",
+)
+
+
+def available_encodings() -> list[str]:
+    # In order of preference when the client accepts several equally
+    return (["br"] if brotli is not None else []) + ["gzip"]
+
+
+def choose_encoding(accept_encoding: str) -> str | None:
+    qualities = parse_quality_list(accept_encoding)
+    best, best_quality = None, 0.0
+    for encoding in available_encodings():
+        quality = qualities.get(encoding, qualities.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress(encoding: str, body: bytes) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    # A fixed mtime keeps the output identical for identical bodies
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+class CompressedBodyCache:
+    def __init__(self, size: int = CACHE_SIZE):
+        self.size = size
+        self.entries: OrderedDict[tuple[str, bytes], bytes] = OrderedDict()
+
+    async def compress(self, encoding: str, body: bytes) -> bytes:
+        if len(body) > MAX_CACHED_BODY_SIZE:
+            return await asyncio.to_thread(compress, encoding, body)
+        key = (encoding, hashlib.blake2b(body, digest_size=16).digest())
+        compressed = self.entries.get(key)
+        if compressed is not None:
+            self.entries.move_to_end(key)
+            return compressed
+        if len(body) > THREADED_COMPRESSION_SIZE:
+            compressed = await asyncio.to_thread(compress, encoding, body)
+        else:
+            compressed = compress(encoding, body)
+        self.entries[key] = compressed
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+        return compressed
+
+
+class CompressionMiddleware:
+    """gzip or brotli for complete responses, as negotiated by Accept-Encoding.
+
+    Streamed responses (NDJSON, server-sent events) are passed through as
+    they are, so their chunks still reach the client without delay.
+    """
+
+    def __init__(
+        self, app: ASGIApp, minimum_size: int = MINIMUM_SIZE, cache_size=CACHE_SIZE
+    ):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.cache = CompressedBodyCache(cache_size)
+
+    def is_compressible(self, start: Message, headers: MutableHeaders) -> bool:
+        content_type = headers.get("content-type", "")
+        return (
+            start["status"] not in (204, 304)
+            and "content-encoding" not in headers
+            and content_type.startswith(COMPRESSIBLE_MEDIA_TYPES)
+        )
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start: Message | None = None
+
+        async def send_compressed(message: Message) -> None:
+            nonlocal start
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if start is None or message["type"] != "http.response.body":
+                await send(message)
+                return
+            headers = MutableHeaders(raw=start["headers"])
+            body = message.get("body", b"")
+            compressible = self.is_compressible(start, headers)
+            if compressible:
+                headers.add_vary_header("Accept-Encoding")
+            if (
+                not compressible
+                or message.get("more_body", False)
+                or len(body) < self.minimum_size
+            ):
+                await send(start)
+                await send(message)
+                start = None
+                return
+            compressed = await self.cache.compress(encoding, body)
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(compressed))
+            etag = headers.get("etag")
+            if etag is not None and not etag.startswith("W/"):
+                # The bytes on the wire are no longer those the strong ETag
+                # was computed over
+                headers["ETag"] = f"W/{etag}"
+            await send(start)
+            await send({"type": "http.response.body", "body": compressed})
+            start = None
+
+        await self.app(scope, receive, send_compressed)
@@ -1,4 +1,5 @@
 import os
+from contextvars import ContextVar
 from datetime import datetime, timedelta, timezone
 from typing import Annotated
 
@@ -8,10 +9,12 @@ from dotenv import load_dotenv
 from fastapi import Depends, HTTPException, Path, status
 from fastapi.security import OAuth2PasswordBearer
 from jwt.exceptions import InvalidTokenError
+from sqlalchemy import make_url
 from sqlalchemy.exc import NoResultFound
-from sqlmodel import Session, SQLModel, create_engine, select
+from sqlmodel import Session, SQLModel, create_engine
 
 from app.models import User
+from app.statements import user_by_username
 
 load_dotenv()
 
@@ -19,14 +22,37 @@ load_dotenv()
 
 DATABASE_URL = os.environ["DATABASE_URL"]
 
-engine = create_engine(DATABASE_URL, echo=True)
+# psycopg 3 (postgresql+psycopg://) turns a statement into a server side
+# prepared statement once a connection has run it this many times. psycopg2
+# (postgresql://) has no such thing.
+PREPARE_THRESHOLD = int(os.getenv("PREPARE_THRESHOLD", "2"))
 
+connect_args = {}
+if make_url(DATABASE_URL).drivername == "postgresql+psycopg":
+    connect_args["prepare_threshold"] = PREPARE_THRESHOLD
 
-def create_db_and_tables():
-    SQLModel.metadata.create_all(engine)
+engine = create_engine(DATABASE_URL, echo=True, connect_args=connect_args)
+
+# A worker forked from a process that already used the engine must not reuse
+# the parent's pooled connections, it starts with an empty pool of its own.
+os.register_at_fork(after_in_child=lambda: engine.dispose(close=False))
+
+# With soft deletes enabled, deleting a food item or a user only marks it as
+# deleted and the actual rows are purged in the background after responding.
+SOFT_DELETE = os.getenv("SOFT_DELETE", "false").lower() == "true"
+
+
+# Set by POST /batch while it runs its sub-requests, so that they share its
+# session and don't resolve the same user over and over
+batch_session: ContextVar[Session | None] = ContextVar("batch_session", default=None)
+batch_user: ContextVar[User | None] = ContextVar("batch_user", default=None)
 
 
 def get_session():
+    session = batch_session.get()
+    if session is not None:
+        yield session
+        return
     with Session(engine) as session:
         yield session
 
@@ -64,8 +90,8 @@ def get_password_hash(password: str):
 
 
 def authenticate_user(username: str, password: str, session: SessionDep) -> User | None:
-    user = session.exec(select(User).where(User.username == username)).first()
-    if not user:
+    user = session.scalars(user_by_username(username)).first()
+    if not user or user.deleted_at is not None:
         return None
     if not verify_password(password, user.hashed_password):
         return None
@@ -86,6 +112,9 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
 def decode_user_from_token(
     token: Annotated[str, Depends(oauth2_scheme)], session: SessionDep
 ):
+    user = batch_user.get()
+    if user is not None:
+        return user
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -100,12 +129,10 @@ def decode_user_from_token(
     except InvalidTokenError:
         raise credentials_exception
     try:
-        user = session.exec(
-            select(User).where(User.username == token_data.username)
-        ).one()
+        user = session.scalars(user_by_username(token_data.username)).one()
     except NoResultFound:
         raise credentials_exception
-    if user is None:
+    if user is None or user.deleted_at is not None:
         raise credentials_exception
     return user
 
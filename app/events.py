@@ -0,0 +1,136 @@
+import asyncio
+import json
+import threading
+from abc import ABC, abstractmethod
+from collections import defaultdict
+
+from app.invalidation import MEAL_EVENT, bus
+from app.models import Meal, MealPublic
+
+# Per subscriber buffer. A client that lets this many events pile up is
+# considered stuck and gets disconnected instead of slowing everybody down.
+SUBSCRIPTION_QUEUE_SIZE = 100
+MAX_SUBSCRIPTIONS_PER_USER = 10
+HEARTBEAT_SECONDS = 15
+
+
+class Subscription:
+    def __init__(self, user_id: int, queue_size: int):
+        self.user_id = user_id
+        self.loop = asyncio.get_running_loop()
+        self.queue: asyncio.Queue[dict | None] = asyncio.Queue(maxsize=queue_size)
+        self.evicted = False
+
+    def deliver(self, event: dict) -> None:
+        if self.evicted:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.evict()
+
+    def evict(self) -> None:
+        # Make room for the sentinel that tells the consumer to stop
+        self.evicted = True
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+    async def get(self, timeout: float | None = None) -> dict | None:
+        """Next event, None once evicted. Raises TimeoutError after `timeout`."""
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+
+class EventSource(ABC):
+    """Where per-user events are published to and subscribed from.
+
+    The in-process hub below only reaches subscribers of the same worker,
+    meal events get to the other workers' hubs over the invalidation bus.
+    """
+
+    @abstractmethod
+    async def subscribe(self, user_id: int) -> Subscription: ...
+
+    @abstractmethod
+    def unsubscribe(self, subscription: Subscription) -> None: ...
+
+    @abstractmethod
+    def publish(self, user_id: int, event: dict) -> None: ...
+
+
+class LocalEventHub(EventSource):
+    def __init__(
+        self,
+        queue_size: int = SUBSCRIPTION_QUEUE_SIZE,
+        max_subscriptions_per_user: int = MAX_SUBSCRIPTIONS_PER_USER,
+    ):
+        self.queue_size = queue_size
+        self.max_subscriptions_per_user = max_subscriptions_per_user
+        self.subscriptions: dict[int, list[Subscription]] = defaultdict(list)
+        self.lock = threading.Lock()
+
+    async def subscribe(self, user_id: int) -> Subscription:
+        subscription = Subscription(user_id, self.queue_size)
+        with self.lock:
+            user_subscriptions = self.subscriptions[user_id]
+            user_subscriptions.append(subscription)
+            if len(user_subscriptions) > self.max_subscriptions_per_user:
+                oldest = user_subscriptions.pop(0)
+                oldest.loop.call_soon_threadsafe(oldest.evict)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self.lock:
+            user_subscriptions = self.subscriptions.get(subscription.user_id, [])
+            if subscription in user_subscriptions:
+                user_subscriptions.remove(subscription)
+            if not user_subscriptions:
+                self.subscriptions.pop(subscription.user_id, None)
+
+    def publish(self, user_id: int, event: dict) -> None:
+        # Handlers publish from the threadpool, so every delivery is handed
+        # over to the event loop that owns the subscriber's queue.
+        with self.lock:
+            subscriptions = list(self.subscriptions.get(user_id, []))
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.deliver, event)
+            except RuntimeError:
+                # The subscriber's event loop is gone
+                self.unsubscribe(subscription)
+
+
+event_source: EventSource = LocalEventHub()
+
+
+def get_event_source() -> EventSource:
+    return event_source
+
+
+def set_event_source(source: EventSource) -> None:
+    global event_source
+    event_source = source
+
+
+def publish_meal_event(action: str, meal: Meal) -> None:
+    # The sequence of a deletion lives on its tombstone, which clients pick up
+    # through /sync/changes
+    if action == "deleted":
+        change_seq, data = None, {"id": meal.id}
+    else:
+        change_seq = meal.change_seq
+        data = MealPublic.model_validate(meal).model_dump(mode="json")
+    event = {"type": f"meal.{action}", "change_seq": change_seq, "data": data}
+    bus.publish(MEAL_EVENT, {"user_id": meal.creator_id, "event": event})
+
+
+def deliver_meal_event(message: dict) -> None:
+    event_source.publish(message["user_id"], message["event"])
+
+
+# Runs in the publishing worker and in every other one that got the message
+bus.subscribe(MEAL_EVENT, deliver_meal_event)
+
+
+def format_server_sent_event(event: dict) -> str:
+    return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
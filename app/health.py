@@ -0,0 +1,95 @@
+"""Startup and readiness checks.
+
+Workers no longer create or inspect tables on startup, the schema belongs to
+Alembic (see initialize_database.py). A worker starts serving right away and
+checks in the background that the database is at the Alembic head revision
+this code was written for, then opens a few pooled connections so the first
+requests don't pay for connecting. /health/ready reports 503 until both are
+done, so a load balancer only sends traffic once the worker can handle it.
+"""
+
+import logging
+import os
+import threading
+from functools import cache
+
+from alembic.runtime.migration import MigrationContext
+from alembic.script import ScriptDirectory
+from sqlalchemy import Engine, text
+from sqlalchemy.exc import SQLAlchemyError
+
+logger = logging.getLogger(__name__)
+
+ALEMBIC_DIRECTORY = os.path.join(os.path.dirname(__file__), "alembic")
+# Connections each worker opens before reporting ready, capped by the pool size
+POOL_WARMUP_CONNECTIONS = int(os.getenv("POOL_WARMUP_CONNECTIONS", "2"))
+
+
+@cache
+def expected_revisions() -> frozenset[str]:
+    return frozenset(ScriptDirectory(ALEMBIC_DIRECTORY).get_heads())
+
+
+def database_revisions(engine: Engine) -> frozenset[str]:
+    with engine.connect() as connection:
+        return frozenset(MigrationContext.configure(connection).get_current_heads())
+
+
+def warm_up_pool(engine: Engine, connections: int) -> None:
+    size = getattr(engine.pool, "size", None)
+    if callable(size):
+        connections = min(connections, size())
+    # Checked out together, otherwise the pool hands out the same one again
+    opened = []
+    try:
+        for _ in range(connections):
+            opened.append(engine.connect())
+    finally:
+        for connection in opened:
+            connection.close()
+
+
+class Readiness:
+    def __init__(self, engine: Engine, warmup_connections: int):
+        self.engine = engine
+        self.warmup_connections = warmup_connections
+        self.problem: str | None = "Starting up"
+        self.checked = False
+        self.lock = threading.Lock()
+
+    def start(self) -> None:
+        threading.Thread(target=self.check, daemon=True).start()
+
+    def check(self) -> None:
+        with self.lock:
+            if self.checked:
+                return
+            try:
+                current = database_revisions(self.engine)
+            except SQLAlchemyError as error:
+                self.problem = f"Database unreachable: {error.__class__.__name__}"
+                logger.exception("Could not read the database schema revision")
+                return
+            expected = expected_revisions()
+            if current != expected:
+                at = ", ".join(sorted(current)) or "no revision"
+                head = ", ".join(sorted(expected))
+                self.problem = f"Database schema is at {at}, expected {head}"
+                logger.error("%s. Run `alembic upgrade head`.", self.problem)
+                return
+            warm_up_pool(self.engine, self.warmup_connections)
+            self.problem = None
+            self.checked = True
+
+    def status(self) -> str | None:
+        """None when ready to serve, otherwise what is missing."""
+        if not self.checked:
+            # Retried on every probe until the database has been migrated
+            self.check()
+            return self.problem
+        try:
+            with self.engine.connect() as connection:
+                connection.execute(text("SELECT 1"))
+        except SQLAlchemyError as error:
+            return f"Database unreachable: {error.__class__.__name__}"
+        return None
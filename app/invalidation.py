@@ -0,0 +1,232 @@
+import glob
+import hashlib
+import json
+import logging
+import os
+import select
+import socket
+import tempfile
+import threading
+import uuid
+from collections import defaultdict
+from typing import Any, Callable
+
+from sqlalchemy import Engine, text
+
+logger = logging.getLogger(__name__)
+
+# Topics and the key that comes with them
+FOOD_ITEM = "food_item"  # {"id", "change_seq"}, change_seq None once it is gone
+USER = "user"  # user id
+MEALS = "meals"  # id of the user whose meals changed
+CATALOG = "catalog"  # generation of the new food catalog snapshot
+MEAL_EVENT = "meal_event"  # {"user_id", "event"} for live event subscribers
+
+POSTGRES_CHANNEL = "cache_invalidation"
+RECEIVE_TIMEOUT_SECONDS = 0.5
+
+
+## Transports
+
+
+class PostgresNotifyTransport:
+    """LISTEN/NOTIFY on a dedicated connection, reaches workers on any host."""
+
+    def __init__(self, engine: Engine, channel: str = POSTGRES_CHANNEL):
+        self.engine = engine
+        self.channel = channel
+        self.stopped = threading.Event()
+        self.thread: threading.Thread | None = None
+
+    def start(self, on_message: Callable[[bytes], None]) -> None:
+        # Taken out of the pool for good, it spends its life waiting for
+        # notifications
+        pooled = self.engine.raw_connection()
+        pooled.detach()
+        self.connection = pooled.driver_connection
+        self.connection.autocommit = True
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"LISTEN {self.channel}")
+        self.thread = threading.Thread(
+            target=self.listen, args=(on_message,), daemon=True
+        )
+        self.thread.start()
+
+    def listen(self, on_message: Callable[[bytes], None]) -> None:
+        if self.engine.dialect.driver == "psycopg":
+            receive = self.receive_psycopg
+        else:
+            receive = self.receive_psycopg2
+        while not self.stopped.is_set():
+            for payload in receive():
+                on_message(payload.encode())
+
+    def receive_psycopg(self) -> list[str]:
+        # psycopg 3 waits for notifications itself, up to the timeout
+        notifies = self.connection.notifies(timeout=RECEIVE_TIMEOUT_SECONDS)
+        return [notify.payload for notify in notifies]
+
+    def receive_psycopg2(self) -> list[str]:
+        ready, _, _ = select.select([self.connection], [], [], RECEIVE_TIMEOUT_SECONDS)
+        if not ready:
+            return []
+        self.connection.poll()
+        payloads = [notify.payload for notify in self.connection.notifies]
+        self.connection.notifies.clear()
+        return payloads
+
+    def send(self, message: bytes) -> None:
+        with self.engine.connect() as connection:
+            connection.execute(
+                text("SELECT pg_notify(:channel, :payload)"),
+                {"channel": self.channel, "payload": message.decode()},
+            )
+            connection.commit()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.connection.close()
+
+
+class UnixSocketTransport:
+    """Datagram sockets in a shared directory, one per process on this host."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.stopped = threading.Event()
+        self.thread: threading.Thread | None = None
+
+    def start(self, on_message: Callable[[bytes], None]) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        self.path = os.path.join(
+            self.directory, f"{os.getpid()}-{uuid.uuid4().hex[:8]}.sock"
+        )
+        self.receiver = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.receiver.bind(self.path)
+        self.receiver.settimeout(RECEIVE_TIMEOUT_SECONDS)
+        # Never block a request because some other worker is busy
+        self.sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sender.setblocking(False)
+        self.thread = threading.Thread(
+            target=self.listen, args=(on_message,), daemon=True
+        )
+        self.thread.start()
+
+    def listen(self, on_message: Callable[[bytes], None]) -> None:
+        while not self.stopped.is_set():
+            try:
+                message = self.receiver.recv(65536)
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            on_message(message)
+
+    def send(self, message: bytes) -> None:
+        for path in glob.glob(os.path.join(self.directory, "*.sock")):
+            if path == self.path:
+                continue
+            try:
+                self.sender.sendto(message, path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Left behind by a worker that didn't shut down cleanly
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+            except BlockingIOError:
+                logger.warning("Dropped invalidation message for %s", path)
+
+    def stop(self) -> None:
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.receiver.close()
+            self.sender.close()
+            os.unlink(self.path)
+
+
+def default_socket_dir(engine: Engine) -> str:
+    # Workers of one deployment share a database, other deployments on the
+    # same machine get a directory of their own
+    url = engine.url.render_as_string(hide_password=False)
+    digest = hashlib.blake2b(url.encode(), digest_size=6).hexdigest()
+    return os.path.join(tempfile.gettempdir(), f"calorie-tracker-invalidation-{digest}")
+
+
+def make_transport(engine: Engine):
+    kind = os.getenv("INVALIDATION_TRANSPORT", "auto")
+    if kind == "auto":
+        kind = "postgres" if engine.dialect.name == "postgresql" else "unix"
+    if kind == "postgres":
+        return PostgresNotifyTransport(engine)
+    if kind == "unix":
+        return UnixSocketTransport(
+            os.getenv("INVALIDATION_SOCKET_DIR") or default_socket_dir(engine)
+        )
+    return None
+
+
+## Bus
+
+
+class InvalidationBus:
+    """Tells every worker's in-process caches that some data has changed.
+
+    Handlers run right away in the publishing worker and, through the
+    transport, shortly after in every other one.
+    """
+
+    def __init__(self):
+        self.origin = uuid.uuid4().hex
+        self.handlers: dict[str, list[Callable[[Any], None]]] = defaultdict(list)
+        self.transport = None
+
+    def subscribe(self, topic: str, handler: Callable[[Any], None]) -> None:
+        self.handlers[topic].append(handler)
+
+    def dispatch(self, topic: str, key: Any) -> None:
+        for handler in self.handlers[topic]:
+            try:
+                handler(key)
+            except Exception:
+                logger.exception("Invalidation handler failed for %s %s", topic, key)
+
+    def publish(self, topic: str, key: Any = None) -> None:
+        self.dispatch(topic, key)
+        if self.transport is None:
+            return
+        message = json.dumps({"origin": self.origin, "topic": topic, "key": key})
+        try:
+            self.transport.send(message.encode())
+        except Exception:
+            logger.exception("Could not broadcast invalidation of %s %s", topic, key)
+
+    def receive(self, message: bytes) -> None:
+        try:
+            payload = json.loads(message)
+        except ValueError:
+            return
+        if payload.get("origin") == self.origin:
+            return
+        self.dispatch(payload["topic"], payload["key"])
+
+    def start(self, transport) -> None:
+        if transport is None:
+            return
+        transport.start(self.receive)
+        self.transport = transport
+
+    def stop(self) -> None:
+        if self.transport is not None:
+            self.transport.stop()
+            self.transport = None
+
+
+bus = InvalidationBus()
+
+# Forked workers must not share the parent's origin, or they would ignore
+# each other's messages
+os.register_at_fork(after_in_child=lambda: setattr(bus, "origin", uuid.uuid4().hex))
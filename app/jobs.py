@@ -0,0 +1,309 @@
+"""Persistent job queue.
+
+Requests put work on the queue with enqueue() and answer 202 right away.
+Workers started with `python -m app.jobs` claim jobs by priority, run the
+handler registered for their kind and retry failures with a growing delay.
+"""
+
+import argparse
+import asyncio
+import importlib
+import json
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+from typing import Callable
+
+from sqlalchemy import Engine, and_, or_, update
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlmodel import Session, col, select
+
+from app.models import Job
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+DEFAULT_MAX_ATTEMPTS = 5
+RETRY_BASE_SECONDS = 5
+MAX_RETRY_DELAY_SECONDS = 3600
+# A job whose worker hasn't renewed its lease for this long is assumed lost
+# along with the worker and handed out again
+JOB_LEASE_SECONDS = 600
+# How often a worker renews the lease of the job it is running
+JOB_HEARTBEAT_SECONDS = JOB_LEASE_SECONDS / 4
+POLL_INTERVAL_SECONDS = 1.0
+
+# Modules registering job handlers, imported by the worker on startup
+HANDLER_MODULES = ["app.purge", "app.catalog"]
+
+handlers: dict[str, Callable[[Session, dict], None]] = {}
+
+
+def job_handler(kind: str):
+    def register(handler: Callable[[Session, dict], None]):
+        handlers[kind] = handler
+        return handler
+
+    return register
+
+
+## Producing
+
+
+def enqueue(
+    session: Session,
+    kind: str,
+    payload: dict | None = None,
+    priority: int = 0,
+    idempotency_key: str | None = None,
+    creator_id: int | None = None,
+    max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+) -> Job:
+    """Commit a new job, or return the existing one with the same key."""
+    by_key = select(Job).where(col(Job.idempotency_key) == idempotency_key)
+    if idempotency_key is not None:
+        existing = session.exec(by_key).first()
+        if existing is not None:
+            return existing
+    job = Job(
+        kind=kind,
+        payload=json.dumps(payload or {}),
+        priority=priority,
+        idempotency_key=idempotency_key,
+        creator_id=creator_id,
+        max_attempts=max_attempts,
+    )
+    session.add(job)
+    try:
+        session.commit()
+    except IntegrityError:
+        if idempotency_key is None:
+            raise
+        # Enqueued by a concurrent request in the meantime
+        session.rollback()
+        return session.exec(by_key).one()
+    session.refresh(job)
+    return job
+
+
+## Consuming
+
+
+def retry_delay(attempts: int) -> timedelta:
+    return timedelta(
+        seconds=min(RETRY_BASE_SECONDS * 2 ** (attempts - 1), MAX_RETRY_DELAY_SECONDS)
+    )
+
+
+def claim_job(session: Session) -> Job | None:
+    now = datetime.now()
+    claimable = or_(
+        and_(col(Job.status) == QUEUED, col(Job.run_after) <= now),
+        and_(
+            col(Job.status) == RUNNING,
+            col(Job.updated_at) < now - timedelta(seconds=JOB_LEASE_SECONDS),
+        ),
+    )
+    # SKIP LOCKED lets concurrent workers on Postgres pass over each other's
+    # candidates. Other databases ignore it, there the conditional UPDATE
+    # below decides which worker gets the job.
+    job_id = session.exec(
+        select(Job.id)
+        .where(claimable)
+        .order_by(col(Job.priority).desc(), col(Job.id))
+        .limit(1)
+        .with_for_update(skip_locked=True)
+    ).first()
+    if job_id is None:
+        session.commit()
+        return None
+    result = session.exec(
+        update(Job)
+        .where(col(Job.id) == job_id)
+        .where(claimable)
+        .values(status=RUNNING, attempts=col(Job.attempts) + 1, updated_at=now)
+    )
+    session.commit()
+    if result.rowcount != 1:
+        return None
+    return session.get(Job, job_id)
+
+
+class LeaseHeartbeat:
+    """Renews the lease of a running job until the handler returns.
+
+    Runs in its own thread and transaction, so a long handler keeps its job
+    no matter how long it holds its own transaction open.
+    """
+
+    def __init__(self, engine: Engine, job: Job, interval: float):
+        self.engine = engine
+        self.job_id = job.id
+        self.attempts = job.attempts
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.beat, daemon=True)
+
+    def __enter__(self) -> "LeaseHeartbeat":
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.stopped.set()
+        self.thread.join()
+
+    def beat(self) -> None:
+        while not self.stopped.wait(self.interval):
+            try:
+                with Session(self.engine) as session:
+                    # Only while this attempt still owns the job
+                    session.exec(
+                        update(Job)
+                        .where(col(Job.id) == self.job_id)
+                        .where(col(Job.status) == RUNNING)
+                        .where(col(Job.attempts) == self.attempts)
+                        .values(updated_at=datetime.now())
+                    )
+                    session.commit()
+            except SQLAlchemyError:
+                logger.exception("Could not renew the lease of job %s", self.job_id)
+
+
+def run_job(session: Session, job: Job) -> None:
+    handler = handlers.get(job.kind)
+    try:
+        if handler is None:
+            raise LookupError(f"No handler for job kind {job.kind!r}")
+        with LeaseHeartbeat(session.get_bind(), job, JOB_HEARTBEAT_SECONDS):
+            handler(session, json.loads(job.payload))
+    except Exception:
+        logger.exception("Job %s (%s) failed", job.id, job.kind)
+        session.rollback()
+        job.last_error = traceback.format_exc(limit=5)
+        if handler is None or job.attempts >= job.max_attempts:
+            job.status = FAILED
+        else:
+            job.status = QUEUED
+            job.run_after = datetime.now() + retry_delay(job.attempts)
+    else:
+        job.status = SUCCEEDED
+        job.last_error = None
+    job.updated_at = datetime.now()
+    session.add(job)
+    session.commit()
+
+
+def run_next_job(session: Session) -> bool:
+    job = claim_job(session)
+    if job is None:
+        return False
+    run_job(session, job)
+    return True
+
+
+def run_next_job_with_engine(engine: Engine) -> bool:
+    with Session(engine) as session:
+        return run_next_job(session)
+
+
+## Worker
+
+
+class RateLimiter:
+    """Spaces job starts at least 1/rate seconds apart across all tasks."""
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate if rate > 0 else 0
+        self.next_start = 0.0
+        self.lock = asyncio.Lock()
+
+    async def wait(self) -> None:
+        if not self.interval:
+            return
+        async with self.lock:
+            delay = self.next_start - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.next_start = time.monotonic() + self.interval
+
+
+async def work(
+    engine: Engine,
+    stopping: asyncio.Event,
+    limiter: RateLimiter,
+    poll_interval: float,
+) -> None:
+    while not stopping.is_set():
+        await limiter.wait()
+        # Handlers are plain blocking database code
+        ran = await asyncio.to_thread(run_next_job_with_engine, engine)
+        if ran:
+            continue
+        try:
+            await asyncio.wait_for(stopping.wait(), poll_interval)
+        except TimeoutError:
+            pass
+
+
+async def run_worker(
+    engine: Engine,
+    concurrency: int,
+    rate: float = 0,
+    poll_interval: float = POLL_INTERVAL_SECONDS,
+) -> None:
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stopping.set)
+    limiter = RateLimiter(rate)
+    await asyncio.gather(
+        *(work(engine, stopping, limiter, poll_interval) for _ in range(concurrency))
+    )
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.jobs")
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=int(os.getenv("JOB_CONCURRENCY", "2")),
+        help="jobs processed at the same time",
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=float(os.getenv("JOB_RATE", "0")),
+        help="maximum jobs started per second, 0 for no limit",
+    )
+    parser.add_argument("--poll-interval", type=float, default=POLL_INTERVAL_SECONDS)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    from app.dependencies import engine
+    from app.invalidation import bus, make_transport
+
+    for module in HANDLER_MODULES:
+        importlib.import_module(module)
+    # Handlers change data that the web workers cache
+    bus.start(make_transport(engine))
+    try:
+        asyncio.run(run_worker(engine, args.concurrency, args.rate, args.poll_interval))
+    finally:
+        bus.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    # Handler modules register with app.jobs, not with this __main__ copy
+    from app.jobs import main as jobs_main
+
+    sys.exit(jobs_main())
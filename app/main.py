@@ -4,18 +4,35 @@ from dotenv import load_dotenv
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
-from app.dependencies import create_db_and_tables
-from app.routers import auth, fooditems, meals, users
+from app.compression import CompressionMiddleware
+from app.dependencies import engine
+from app.invalidation import bus, make_transport
+from app.routers import (
+    auth,
+    batch,
+    events,
+    fooditems,
+    health,
+    jobs,
+    meals,
+    recipes,
+    shares,
+    sync,
+    users,
+)
 
 load_dotenv()
 
 
 @asynccontextmanager
 async def my_lifespan(app: FastAPI):
-    # Startup
-    create_db_and_tables()
+    # Startup, the schema is managed by Alembic and only checked in the
+    # background
+    health.readiness.start()
+    bus.start(make_transport(engine))
     yield
     # Shutdown
+    bus.stop()
 
 
 app = FastAPI(lifespan=my_lifespan)
@@ -27,8 +44,16 @@ app.add_middleware(
     allow_headers=["*"],
     allow_credentials=True,
 )
+app.add_middleware(CompressionMiddleware)
 
+app.include_router(health.router)
 app.include_router(auth.router)
 app.include_router(users.router)
 app.include_router(fooditems.router)
 app.include_router(meals.router)
+app.include_router(recipes.router)
+app.include_router(shares.router)
+app.include_router(sync.router)
+app.include_router(events.router)
+app.include_router(jobs.router)
+app.include_router(batch.router)
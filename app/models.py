@@ -1,10 +1,48 @@
 import enum
 from datetime import date, datetime
-from decimal import Decimal
-from typing import Optional
-
+from decimal import ROUND_HALF_UP, Decimal
+from typing import Any, Literal, Optional
+
+from sqlalchemy import (
+    DDL,
+    BigInteger,
+    Index,
+    Sequence,
+    Text,
+    TypeDecorator,
+    UniqueConstraint,
+    event,
+)
 from sqlmodel import Field, Relationship, SQLModel
 
+# Nutrition values are stored as integer hundredths so that the database can
+# sum them exactly and cheaply. They are still exposed as Decimal everywhere
+# in Python and in the API.
+
+
+class CentiUnits(TypeDecorator):
+    impl = BigInteger
+    cache_ok = True
+
+    @staticmethod
+    def to_units(value: Decimal | float | int) -> int:
+        return int((Decimal(value) * 100).to_integral_value(rounding=ROUND_HALF_UP))
+
+    @staticmethod
+    def from_units(value: int, exponent: int = 2) -> Decimal:
+        return Decimal(value).scaleb(-exponent)
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return self.to_units(value)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return self.from_units(value)
+
+
 # User model
 
 
@@ -17,6 +55,7 @@ class User(UserBase, table=True):
     is_active: bool = Field(default=True)
     is_admin: bool = Field(default=False)
     hashed_password: str = Field(default="", max_length=255)
+    deleted_at: Optional[datetime] = Field(default=None)
 
 
 class UserPublic(SQLModel):
@@ -41,19 +80,34 @@ class UserUpdate(SQLModel):
 class FoodItemBase(SQLModel):
     name: str = Field(max_length=256)
     brand: Optional[str] = Field(default="", max_length=64)
-    calories: Decimal = Field(default=0.0, ge=0, decimal_places=2)
-    fats: Decimal = Field(default=0.0, ge=0, decimal_places=2)
-    carbs: Decimal = Field(default=0.0, ge=0, decimal_places=2)
-    protein: Decimal = Field(default=0.0, ge=0, decimal_places=2)
-    portion_weight: Optional[Decimal] = Field(default=None, ge=0, decimal_places=2)
+    calories: Decimal = Field(default=0.0, ge=0, decimal_places=2, sa_type=CentiUnits)
+    fats: Decimal = Field(default=0.0, ge=0, decimal_places=2, sa_type=CentiUnits)
+    carbs: Decimal = Field(default=0.0, ge=0, decimal_places=2, sa_type=CentiUnits)
+    protein: Decimal = Field(default=0.0, ge=0, decimal_places=2, sa_type=CentiUnits)
+    portion_weight: Optional[Decimal] = Field(
+        default=None, ge=0, decimal_places=2, sa_type=CentiUnits
+    )
     barcode: str = Field(default="", max_length=64)
 
 
 class FoodItem(FoodItemBase, table=True):
     id: int | None = Field(default=None, primary_key=True)
     edit_locked: bool = Field(default=True)
-    creator_id: int = Field(foreign_key="user.id")
-    meals: "Meal" = Relationship(cascade_delete=True)
+    # Food items outlive their creator, other users' meals and recipes use them
+    creator_id: int | None = Field(
+        default=None, foreign_key="user.id", ondelete="SET NULL"
+    )
+    deleted_at: Optional[datetime] = Field(default=None)
+    updated_at: datetime = Field(default_factory=datetime.now)
+    change_seq: int = Field(default=0, index=True)
+    # Nutrition values of a recipe are computed from its ingredients
+    is_recipe: bool = Field(default=False)
+    # Meals are removed by the database (ON DELETE CASCADE) or by bulk deletes,
+    # never by loading them into the session first.
+    meals: list["Meal"] = Relationship(
+        back_populates="food_item", cascade_delete=True, passive_deletes=True
+    )
+
 
 class FoodItemPublic(SQLModel):
     id: int
@@ -65,7 +119,8 @@ class FoodItemPublic(SQLModel):
     protein: Decimal
     portion_weight: Optional[Decimal]
     barcode: Optional[str]
-    creator_id: int
+    creator_id: Optional[int]
+    is_recipe: bool = False
 
 
 class FoodItemCreate(FoodItemBase):
@@ -84,25 +139,72 @@ class FoodItemUpdate(SQLModel):
     edit_locked: bool = True
 
 
+## Recipe models
+
+# A recipe is a FoodItem whose per 100 g values are the weighted average of
+# its ingredients, kept up to date whenever an ingredient changes.
+
+
+class RecipeIngredient(SQLModel, table=True):
+    __table_args__ = (UniqueConstraint("recipe_id", "ingredient_id"),)
+
+    id: int | None = Field(default=None, primary_key=True)
+    recipe_id: int = Field(foreign_key="fooditem.id", ondelete="CASCADE", index=True)
+    # Indexed to find the recipes to update when an ingredient changes
+    ingredient_id: int = Field(foreign_key="fooditem.id", index=True)
+    amount: Decimal = Field(gt=0, decimal_places=2, sa_type=CentiUnits)
+
+
+class RecipeIngredientIn(SQLModel):
+    ingredient_id: int
+    amount: Decimal = Field(gt=0, decimal_places=2)
+
+
+class RecipeCreate(SQLModel):
+    name: str = Field(max_length=256)
+    brand: Optional[str] = Field(default="", max_length=64)
+    portion_weight: Optional[Decimal] = Field(default=None, ge=0, decimal_places=2)
+    barcode: str = Field(default="", max_length=64)
+    ingredients: list[RecipeIngredientIn] = Field(min_length=1, max_length=100)
+
+
+class RecipePublic(FoodItemPublic):
+    ingredients: list[RecipeIngredientIn]
+
+
 ## Meal model
 
+
+# Mealtimes are numbered from 1 to MAX_MEALTIME_ID
+MAX_MEALTIME_ID = 5
+
+
 class MealBase(SQLModel):
-    calories: Decimal = Field(default=0.0, ge=0, decimal_places=2)
-    food_amount: Decimal = Field(default=0.0, ge=0, decimal_places=2)
+    calories: Decimal = Field(default=0.0, ge=0, decimal_places=2, sa_type=CentiUnits)
+    food_amount: Decimal = Field(
+        default=0.0, ge=0, decimal_places=2, sa_type=CentiUnits
+    )
     food_item_id: Optional[int] = Field(
         default=None, foreign_key="fooditem.id", ondelete="CASCADE"
     )
     created_at: date = Field(default_factory=datetime.now().date)
     is_shared: bool = Field(default=False)
     mealtime_id: int = Field(
-        default=1, le=5
+        default=1, ge=1, le=MAX_MEALTIME_ID
     )  # This could later on be exchanged for a foreign key to a custom mealtime model
 
 
 class Meal(MealBase, table=True):
+    __table_args__ = (
+        Index("ix_meal_creator_id_created_at", "creator_id", "created_at"),
+        Index("ix_meal_creator_id_change_seq", "creator_id", "change_seq"),
+    )
+
     id: int | None = Field(default=None, primary_key=True)
     food_item: "FoodItem" = Relationship(back_populates="meals")
-    creator_id: int = Field(foreign_key="user.id")
+    creator_id: int = Field(foreign_key="user.id", ondelete="CASCADE")
+    updated_at: datetime = Field(default_factory=datetime.now)
+    change_seq: int = Field(default=0)
 
 
 class MealCreate(MealBase):
@@ -114,6 +216,52 @@ class MealPublic(MealBase):
     food_item: Optional["FoodItemPublic"]
 
 
+class MealSummary(SQLModel):
+    date_from: date
+    date_to: date
+    meal_count: int
+    calories: Decimal
+    fats: Decimal
+    carbs: Decimal
+    protein: Decimal
+
+
+class DailyMealStats(SQLModel):
+    dates: list[date]
+    calories: list[float]
+    rolling_7_day_calories: list[float]
+    rolling_30_day_calories: list[float]
+
+
+class WeeklyMealStats(SQLModel):
+    week_starts: list[date]
+    calories: list[float]
+    fats: list[float]
+    carbs: list[float]
+    protein: list[float]
+    fats_share: list[float]
+    carbs_share: list[float]
+    protein_share: list[float]
+
+
+class MealtimeStats(SQLModel):
+    mealtime_id: int
+    meal_count: int
+    calories: float
+    calories_share: float
+
+
+class MealStats(SQLModel):
+    first_date: Optional[date]
+    last_date: Optional[date]
+    days_logged: int
+    current_streak: int
+    longest_streak: int
+    daily: DailyMealStats
+    weekly: WeeklyMealStats
+    mealtimes: list[MealtimeStats]
+
+
 class MealUpdate(SQLModel):
     id: Optional[int] = None
     calories: Optional[Decimal] = None
@@ -123,4 +271,132 @@ class MealUpdate(SQLModel):
     )
     created_at: Optional[date] = Field(default_factory=datetime.now().date)
     is_shared: Optional[bool] = Field(default=False)
-    mealtime_id: Optional[int] = Field(default=1, le=5)
+    mealtime_id: Optional[int] = Field(default=1, ge=1, le=MAX_MEALTIME_ID)
+
+
+## MealShare model
+
+
+class MealShare(SQLModel, table=True):
+    id: int | None = Field(default=None, primary_key=True)
+    token: str = Field(unique=True, index=True, max_length=64)
+    creator_id: int = Field(foreign_key="user.id", ondelete="CASCADE")
+    created_at: datetime = Field(default_factory=datetime.now)
+    etag: str = Field(max_length=66)
+    snapshot: str = Field(sa_type=Text)
+
+
+class MealShareCreate(SQLModel):
+    meal_ids: list[int] = Field(min_length=1, max_length=100)
+
+
+class MealSharePublic(SQLModel):
+    token: str
+    created_at: datetime
+
+
+class MealShareSnapshot(SQLModel):
+    created_at: datetime
+    meals: list[MealPublic]
+
+
+## Sync models
+
+# Every change to a meal or a food item takes the next value of a single
+# global counter, which clients use as their sync cursor. On Postgres that is
+# the change_seq sequence, elsewhere the value column of the SyncSequence row.
+
+CHANGE_SEQUENCE = Sequence("change_seq", metadata=SQLModel.metadata)
+
+
+class SyncSequence(SQLModel, table=True):
+    id: int = Field(default=1, primary_key=True)
+    value: int = Field(default=0)
+    # Tombstones up to this change_seq have been pruned
+    pruned_through: int = Field(default=0)
+
+
+# The single row is there from the start, writers only ever update it
+event.listen(
+    SyncSequence.__table__,
+    "after_create",
+    DDL("INSERT INTO syncsequence (id, value, pruned_through) VALUES (1, 0, 0)"),
+)
+
+
+class Tombstone(SQLModel, table=True):
+    id: int | None = Field(default=None, primary_key=True)
+    entity: str = Field(max_length=16)
+    entity_id: int
+    creator_id: Optional[int] = Field(default=None, index=True)
+    change_seq: int = Field(index=True)
+    deleted_at: datetime = Field(default_factory=datetime.now)
+
+
+class TombstonePublic(SQLModel):
+    entity: str
+    entity_id: int
+    deleted_at: datetime
+
+
+class SyncChanges(SQLModel):
+    meals: list[MealPublic]
+    food_items: list[FoodItemPublic]
+    deleted: list[TombstonePublic]
+    next_cursor: int
+    has_more: bool
+
+
+## Job model
+
+# Work that doesn't have to finish inside the request is queued here and
+# processed by `python -m app.jobs`.
+
+
+class Job(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_job_status_priority_run_after", "status", "priority", "run_after"),
+    )
+
+    id: int | None = Field(default=None, primary_key=True)
+    kind: str = Field(max_length=64)
+    payload: str = Field(default="{}", sa_type=Text)
+    status: str = Field(default="queued", max_length=16)
+    priority: int = Field(default=0)
+    attempts: int = Field(default=0)
+    max_attempts: int = Field(default=5)
+    idempotency_key: Optional[str] = Field(default=None, unique=True, max_length=128)
+    creator_id: Optional[int] = Field(default=None, index=True)
+    run_after: datetime = Field(default_factory=datetime.now)
+    created_at: datetime = Field(default_factory=datetime.now)
+    updated_at: datetime = Field(default_factory=datetime.now)
+    last_error: Optional[str] = Field(default=None, sa_type=Text)
+
+
+class JobPublic(SQLModel):
+    id: int
+    kind: str
+    status: str
+    attempts: int
+    max_attempts: int
+    created_at: datetime
+    updated_at: datetime
+    last_error: Optional[str]
+
+
+## Batch models
+
+
+class BatchRequestItem(SQLModel):
+    method: Literal["GET", "POST", "PATCH", "DELETE"] = "GET"
+    path: str = Field(regex=r"^/", max_length=2048)
+    body: Optional[Any] = None
+
+
+class BatchRequest(SQLModel):
+    requests: list[BatchRequestItem] = Field(min_length=1)
+
+
+class BatchResponseItem(SQLModel):
+    status: int
+    body: Optional[Any]
@@ -0,0 +1,83 @@
+from contextvars import ContextVar
+from typing import Any, Callable
+
+from fastapi import Request
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON_MEDIA_TYPE = "application/json"
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+MSGPACK_MEDIA_TYPES = (MSGPACK_MEDIA_TYPE, "application/x-msgpack")
+
+response_media_type: ContextVar[str] = ContextVar(
+    "response_media_type", default=JSON_MEDIA_TYPE
+)
+
+
+def parse_quality_list(header: str) -> dict[str, float]:
+    """Values of an Accept style header mapped to their q weight."""
+    qualities = {}
+    for item in header.split(","):
+        value, *params = item.split(";")
+        value = value.strip().lower()
+        if not value:
+            continue
+        quality = 1.0
+        for param in params:
+            key, _, number = param.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(number)
+                except ValueError:
+                    quality = 0.0
+        qualities[value] = quality
+    return qualities
+
+
+def preferred_media_type(accept: str) -> str:
+    # JSON unless the client asks for MessagePack at least as much
+    if msgpack is None or not accept:
+        return JSON_MEDIA_TYPE
+    qualities = parse_quality_list(accept)
+    msgpack_quality = max(qualities.get(value, 0.0) for value in MSGPACK_MEDIA_TYPES)
+    json_quality = max(
+        qualities.get(value, 0.0) for value in (JSON_MEDIA_TYPE, "application/*", "*/*")
+    )
+    if msgpack_quality > 0 and msgpack_quality >= json_quality:
+        return MSGPACK_MEDIA_TYPE
+    return JSON_MEDIA_TYPE
+
+
+class NegotiatedResponse(JSONResponse):
+    """JSON, or MessagePack when the request's Accept header prefers it."""
+
+    def __init__(self, content: Any, *args, **kwargs):
+        self.media_type = response_media_type.get()
+        super().__init__(content, *args, **kwargs)
+        self.headers.add_vary_header("Accept")
+
+    def render(self, content: Any) -> bytes:
+        if self.media_type == MSGPACK_MEDIA_TYPE:
+            return msgpack.packb(content)
+        return super().render(content)
+
+
+class NegotiatedRoute(APIRoute):
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+
+        async def negotiated_handler(request: Request):
+            token = response_media_type.set(
+                preferred_media_type(request.headers.get("accept", ""))
+            )
+            try:
+                return await handler(request)
+            finally:
+                response_media_type.reset(token)
+
+        return negotiated_handler
@@ -0,0 +1,190 @@
+"""Maintenance of the monthly meal partitions on Postgres.
+
+Run `python -m app.partitions ensure` regularly (e.g. daily from cron) to
+create partitions ahead of time, and `python -m app.partitions archive` to
+move old months out of the database into compressed CSV files.
+"""
+
+import argparse
+import gzip
+import os
+import re
+import sys
+from datetime import date
+from typing import BinaryIO
+
+from sqlalchemy import Connection, Engine, text
+
+PARTITIONED_TABLE = "meal"
+DEFAULT_PARTITION = "meal_default"
+PARTITION_NAME = re.compile(r"^meal_y(\d{4})m(\d{2})$")
+
+
+def month_start(day: date) -> date:
+    return day.replace(day=1)
+
+
+def add_months(day: date, months: int) -> date:
+    month_index = day.year * 12 + day.month - 1 + months
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"meal_y{month.year:04d}m{month.month:02d}"
+
+
+def partition_month(name: str) -> date | None:
+    match = PARTITION_NAME.match(name)
+    if not match:
+        return None
+    return date(int(match[1]), int(match[2]), 1)
+
+
+def is_partitioned(connection: Connection) -> bool:
+    return connection.dialect.name == "postgresql" and bool(
+        connection.execute(
+            text(
+                "SELECT 1 FROM pg_partitioned_table "
+                "WHERE partrelid = to_regclass(:table)"
+            ),
+            {"table": PARTITIONED_TABLE},
+        ).scalar()
+    )
+
+
+def list_partitions(connection: Connection) -> dict[date, str]:
+    names = connection.execute(
+        text(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "WHERE pg_inherits.inhparent = to_regclass(:table)"
+        ),
+        {"table": PARTITIONED_TABLE},
+    ).scalars()
+    return {
+        month: name for name in names if (month := partition_month(name)) is not None
+    }
+
+
+def create_partition(connection: Connection, month: date) -> str:
+    # Meals logged for a month without a partition end up in the default
+    # partition. They have to be moved out before the month can be attached.
+    name = partition_name(month)
+    bounds = {"start": month, "end": add_months(month, 1)}
+    connection.execute(
+        text(
+            f"CREATE TABLE {name} "
+            f"(LIKE {PARTITIONED_TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+        )
+    )
+    connection.execute(
+        text(
+            f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} "
+            "WHERE created_at >= :start AND created_at < :end RETURNING *) "
+            f"INSERT INTO {name} SELECT * FROM moved"
+        ),
+        bounds,
+    )
+    connection.execute(
+        text(
+            f"ALTER TABLE {PARTITIONED_TABLE} ATTACH PARTITION {name} "
+            f"FOR VALUES FROM ('{bounds['start']}') TO ('{bounds['end']}')"
+        )
+    )
+    return name
+
+
+def ensure_partitions(engine: Engine, months_ahead: int, today: date) -> list[str]:
+    created = []
+    with engine.begin() as connection:
+        if not is_partitioned(connection):
+            return created
+        existing = list_partitions(connection)
+        first_month = min(existing, default=month_start(today))
+        last_month = add_months(month_start(today), months_ahead)
+        month = first_month
+        while month <= last_month:
+            if month not in existing:
+                created.append(create_partition(connection, month))
+            month = add_months(month, 1)
+    return created
+
+
+def copy_to_file(connection: Connection, statement: str, file: BinaryIO) -> None:
+    cursor = connection.connection.cursor()
+    try:
+        if connection.dialect.driver == "psycopg":
+            with cursor.copy(statement) as copy:
+                for data in copy:
+                    file.write(data)
+        else:
+            cursor.copy_expert(statement, file)
+    finally:
+        cursor.close()
+
+
+def archive_partitions(
+    engine: Engine,
+    keep_months: int,
+    today: date,
+    archive_dir: str | None,
+) -> list[str]:
+    # Partitions entirely older than the cutoff are detached. With an archive
+    # directory they are also dumped to gzipped CSV and dropped, otherwise they
+    # stay around as plain tables that queries on meal no longer touch.
+    cutoff = add_months(month_start(today), -keep_months)
+    archived = []
+    with engine.begin() as connection:
+        if not is_partitioned(connection):
+            return archived
+        for month, name in sorted(list_partitions(connection).items()):
+            if add_months(month, 1) > cutoff:
+                continue
+            connection.execute(
+                text(f"ALTER TABLE {PARTITIONED_TABLE} DETACH PARTITION {name}")
+            )
+            if archive_dir is not None:
+                os.makedirs(archive_dir, exist_ok=True)
+                path = os.path.join(archive_dir, f"{name}.csv.gz")
+                with gzip.open(path, "wb") as archive:
+                    copy_to_file(
+                        connection,
+                        f"COPY {name} TO STDOUT WITH (FORMAT csv, HEADER)",
+                        archive,
+                    )
+                connection.execute(text(f"DROP TABLE {name}"))
+            archived.append(name)
+    return archived
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.partitions")
+    commands = parser.add_subparsers(dest="command", required=True)
+    ensure = commands.add_parser("ensure", help="create upcoming monthly partitions")
+    ensure.add_argument("--months-ahead", type=int, default=3)
+    archive = commands.add_parser("archive", help="detach or archive old partitions")
+    archive.add_argument("--keep-months", type=int, default=24)
+    archive.add_argument(
+        "--archive-dir",
+        help="dump detached partitions to gzipped CSV files here and drop them",
+    )
+    args = parser.parse_args(argv)
+
+    from app.dependencies import engine
+
+    if engine.dialect.name != "postgresql":
+        print("Meal partitioning is only used on PostgreSQL, nothing to do.")
+        return 0
+    today = date.today()
+    if args.command == "ensure":
+        names = ensure_partitions(engine, args.months_ahead, today)
+        print(f"Created {len(names)} partition(s): {', '.join(names) or '-'}")
+    else:
+        names = archive_partitions(engine, args.keep_months, today, args.archive_dir)
+        action = "Archived" if args.archive_dir else "Detached"
+        print(f"{action} {len(names)} partition(s): {', '.join(names) or '-'}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,137 @@
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import Engine, func
+from sqlmodel import Session, col, delete, select, update
+
+from app.invalidation import FOOD_ITEM, USER, bus
+from app.jobs import job_handler
+from app.models import FoodItem, Meal, MealShare, RecipeIngredient, Tombstone, User
+from app.sync import (
+    change_seqs,
+    food_item_change_seqs,
+    pruned_change_seq,
+    record_food_item_tombstone,
+    record_meal_tombstones,
+    update_sync_row,
+)
+
+# Meals are deleted in chunks, each in its own short transaction, so that
+# purging a popular food item or a long history never holds a big lock.
+PURGE_BATCH_SIZE = 1000
+PURGE_JOB = "purge_soft_deleted"
+# Clients that haven't synced for longer than this have to sync from scratch
+TOMBSTONE_RETENTION_DAYS = int(os.getenv("TOMBSTONE_RETENTION_DAYS", "90"))
+
+
+def delete_meals_in_batches(session: Session, condition, with_tombstones: bool) -> None:
+    while True:
+        meal_ids = session.exec(
+            select(Meal.id).where(condition).limit(PURGE_BATCH_SIZE)
+        ).all()
+        if not meal_ids:
+            return
+        batch = col(Meal.id).in_(meal_ids)
+        if with_tombstones:
+            record_meal_tombstones(session, batch)
+        session.exec(delete(Meal).where(batch))
+        session.commit()
+
+
+def delete_food_item_rows(session: Session, food_item_id: int) -> None:
+    used_by_meals = col(Meal.food_item_id) == food_item_id
+    record_meal_tombstones(session, used_by_meals)
+    record_food_item_tombstone(session, food_item_id)
+    session.exec(delete(Meal).where(used_by_meals))
+    session.exec(
+        delete(RecipeIngredient).where(col(RecipeIngredient.recipe_id) == food_item_id)
+    )
+    session.exec(delete(FoodItem).where(col(FoodItem.id) == food_item_id))
+
+
+def delete_user_rows(session: Session, user_id: int) -> dict[int, int]:
+    """Delete a user with their meals and shares.
+
+    Their food items stay for the meals and recipes of other users, without
+    a creator. Returns the change_seq each of them got.
+    """
+    # A deleted user's devices are logged out, so their meals get no tombstones
+    session.exec(delete(Meal).where(col(Meal.creator_id) == user_id))
+    session.exec(delete(MealShare).where(col(MealShare.creator_id) == user_id))
+    food_item_ids = session.exec(
+        select(FoodItem.id).where(col(FoodItem.creator_id) == user_id)
+    ).all()
+    if food_item_ids:
+        session.exec(
+            update(FoodItem)
+            .where(col(FoodItem.id).in_(food_item_ids))
+            .values(
+                creator_id=None,
+                change_seq=food_item_change_seqs(session, food_item_ids),
+                updated_at=datetime.now(),
+            )
+        )
+    session.exec(delete(User).where(col(User.id) == user_id))
+    return change_seqs(session, food_item_ids) if food_item_ids else {}
+
+
+def prune_tombstones(session: Session, older_than: datetime) -> None:
+    expired = col(Tombstone.deleted_at) < older_than
+    pruned_through = session.exec(
+        select(func.max(Tombstone.change_seq)).where(expired)
+    ).one()
+    if pruned_through is None:
+        return
+    # Recorded in the same transaction, so /sync/changes turns away every
+    # cursor that could miss one of them
+    connection = session.connection()
+    update_sync_row(
+        connection,
+        pruned_through=max(pruned_change_seq(connection), pruned_through),
+    )
+    session.exec(delete(Tombstone).where(expired))
+    session.commit()
+
+
+def purge_soft_deleted(bind: Engine) -> None:
+    with Session(bind) as session:
+        food_item_ids = session.exec(
+            select(FoodItem.id).where(col(FoodItem.deleted_at).is_not(None))
+        ).all()
+        for food_item_id in food_item_ids:
+            delete_meals_in_batches(
+                session, col(Meal.food_item_id) == food_item_id, with_tombstones=True
+            )
+            delete_food_item_rows(session, food_item_id)
+            session.commit()
+            bus.publish(FOOD_ITEM, {"id": food_item_id, "change_seq": None})
+
+        user_ids = session.exec(
+            select(User.id).where(col(User.deleted_at).is_not(None))
+        ).all()
+        for user_id in user_ids:
+            delete_meals_in_batches(
+                session, col(Meal.creator_id) == user_id, with_tombstones=False
+            )
+            changed_seqs = delete_user_rows(session, user_id)
+            session.commit()
+            bus.publish(USER, user_id)
+            for food_item_id, change_seq in changed_seqs.items():
+                bus.publish(FOOD_ITEM, {"id": food_item_id, "change_seq": change_seq})
+
+        prune_tombstones(
+            session, datetime.now() - timedelta(days=TOMBSTONE_RETENTION_DAYS)
+        )
+
+
+@job_handler(PURGE_JOB)
+def run_purge_job(session: Session, payload: dict) -> None:
+    purge_soft_deleted(session.get_bind())
+
+
+def mark_deleted(session: Session, row: FoodItem | User) -> None:
+    row.deleted_at = datetime.now()
+    if isinstance(row, User):
+        row.is_active = False
+    session.add(row)
+    session.commit()
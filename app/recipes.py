@@ -0,0 +1,90 @@
+from collections import defaultdict
+from decimal import ROUND_HALF_UP, Decimal
+
+from sqlmodel import Session, col, select
+
+from app.models import FoodItem, RecipeIngredient
+
+NUTRIENTS = ("calories", "fats", "carbs", "protein")
+CENT = Decimal("0.01")
+
+
+def collect_dependents(
+    session: Session, food_item_ids: list[int]
+) -> tuple[set[int], list[tuple[int, int]]]:
+    """Recipes using any of the food items, directly or through other recipes.
+
+    Also returns the (ingredient, recipe) edges that lead to them.
+    """
+    dependents: set[int] = set()
+    edges: list[tuple[int, int]] = []
+    frontier = set(food_item_ids)
+    while frontier:
+        rows = session.exec(
+            select(RecipeIngredient.ingredient_id, RecipeIngredient.recipe_id).where(
+                col(RecipeIngredient.ingredient_id).in_(frontier)
+            )
+        ).all()
+        edges.extend(rows)
+        frontier = {recipe_id for _, recipe_id in rows} - dependents
+        dependents |= frontier
+    return dependents, edges
+
+
+def topological_order(recipe_ids: set[int], edges: list[tuple[int, int]]) -> list[int]:
+    # A recipe comes after every affected recipe it uses as an ingredient
+    waiting_on: dict[int, int] = {recipe_id: 0 for recipe_id in recipe_ids}
+    used_by: dict[int, list[int]] = defaultdict(list)
+    for ingredient_id, recipe_id in set(edges):
+        if ingredient_id in recipe_ids:
+            waiting_on[recipe_id] += 1
+            used_by[ingredient_id].append(recipe_id)
+    ready = sorted(recipe_id for recipe_id, count in waiting_on.items() if not count)
+    order = []
+    while ready:
+        recipe_id = ready.pop()
+        order.append(recipe_id)
+        for dependent_id in used_by[recipe_id]:
+            waiting_on[dependent_id] -= 1
+            if not waiting_on[dependent_id]:
+                ready.append(dependent_id)
+    return order
+
+
+def creates_cycle(session: Session, recipe_id: int, ingredient_ids: list[int]) -> bool:
+    # An ingredient that already (indirectly) uses the recipe would make the
+    # recipe part of itself
+    dependents, _ = collect_dependents(session, [recipe_id])
+    return bool(set(ingredient_ids) & (dependents | {recipe_id}))
+
+
+def recompute_recipe(session: Session, recipe: FoodItem) -> None:
+    rows = session.exec(
+        select(RecipeIngredient.amount, FoodItem)
+        .join(FoodItem, col(FoodItem.id) == col(RecipeIngredient.ingredient_id))
+        .where(col(RecipeIngredient.recipe_id) == recipe.id)
+    ).all()
+    total_amount = sum((amount for amount, _ in rows), Decimal(0))
+    for nutrient in NUTRIENTS:
+        value = Decimal(0)
+        if total_amount:
+            weighted = sum(
+                (getattr(ingredient, nutrient) * amount for amount, ingredient in rows),
+                Decimal(0),
+            )
+            value = (weighted / total_amount).quantize(CENT, rounding=ROUND_HALF_UP)
+        setattr(recipe, nutrient, value)
+    session.add(recipe)
+
+
+def update_dependent_recipes(session: Session, food_item_ids: list[int]) -> list[int]:
+    """Recompute every recipe depending on the food items, nested ones included.
+
+    Runs in the caller's transaction and returns the ids of the recipes.
+    """
+    dependents, edges = collect_dependents(session, food_item_ids)
+    order = topological_order(dependents, edges)
+    for recipe_id in order:
+        # Pending changes to the ingredients are flushed by the recompute query
+        recompute_recipe(session, session.get(FoodItem, recipe_id))
+    return order
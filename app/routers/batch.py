@@ -0,0 +1,174 @@
+import asyncio
+import json
+import logging
+from typing import Annotated
+from urllib.parse import urlsplit
+
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+
+from app.dependencies import (
+    SessionDep,
+    batch_session,
+    batch_user,
+    get_current_active_user,
+)
+from app.models import BatchRequest, BatchRequestItem, BatchResponseItem, User
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/batch", tags=["batch"])
+
+MAX_BATCH_REQUESTS = 20
+MAX_BATCH_COST = 40
+# Reads count 1 unless listed here, writes always count WRITE_COST
+READ_COSTS = {"/meals/range": 5, "/meals/stats": 5, "/sync/changes": 5}
+WRITE_COST = 3
+# Consecutive reads run this many at a time, each with its own session
+BATCH_READ_CONCURRENCY = 4
+# Paths that make no sense inside a batch
+EXCLUDED_PATHS = ("/batch", "/events", "/auth/token")
+
+
+def request_cost(item: BatchRequestItem) -> int:
+    if item.method != "GET":
+        return WRITE_COST
+    return READ_COSTS.get(urlsplit(item.path).path.rstrip("/"), 1)
+
+
+def read_runs(items: list[BatchRequestItem]) -> list[list[int]]:
+    # Indices of the sub-requests grouped so that consecutive reads share a
+    # group and every write gets one of its own
+    runs: list[list[int]] = []
+    for index, item in enumerate(items):
+        if item.method == "GET" and runs and items[runs[-1][0]].method == "GET":
+            runs[-1].append(index)
+        else:
+            runs.append([index])
+    return runs
+
+
+async def dispatch(request: Request, item: BatchRequestItem) -> BatchResponseItem:
+    url = urlsplit(item.path)
+    headers = [(b"accept", b"application/json")]
+    authorization = request.headers.get("authorization")
+    if authorization is not None:
+        headers.append((b"authorization", authorization.encode()))
+    body = b""
+    if item.body is not None:
+        body = json.dumps(item.body).encode()
+        headers.append((b"content-type", b"application/json"))
+    scope = {
+        "type": "http",
+        "asgi": request.scope.get("asgi", {"version": "3.0"}),
+        "http_version": request.scope.get("http_version", "1.1"),
+        "method": item.method,
+        "scheme": request.scope.get("scheme", "http"),
+        "server": request.scope.get("server"),
+        "client": request.scope.get("client"),
+        "root_path": request.scope.get("root_path", ""),
+        "path": url.path,
+        "raw_path": url.path.encode(),
+        "query_string": url.query.encode(),
+        "headers": headers,
+        "state": dict(request.scope.get("state", {})),
+    }
+
+    received = False
+
+    async def receive():
+        nonlocal received
+        if not received:
+            received = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        # The client stays connected until the whole batch is answered
+        await asyncio.Event().wait()
+
+    status = 500
+    chunks: list[bytes] = []
+    content_type = ""
+
+    async def send(message):
+        nonlocal status, content_type
+        if message["type"] == "http.response.start":
+            status = message["status"]
+            for name, value in message["headers"]:
+                if name.lower() == b"content-type":
+                    content_type = value.decode()
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+
+    try:
+        await request.app(scope, receive, send)
+    except Exception:
+        logger.exception("Batched %s %s failed", item.method, item.path)
+        return BatchResponseItem(status=500, body={"detail": "Internal Server Error"})
+    content = b"".join(chunks)
+    if content_type.startswith("application/json") and content:
+        return BatchResponseItem(status=status, body=json.loads(content))
+    return BatchResponseItem(status=status, body=content.decode() or None)
+
+
+async def dispatch_with_own_session(
+    request: Request, item: BatchRequestItem, limit: asyncio.Semaphore
+) -> BatchResponseItem:
+    # Runs in its own task, so this only affects this sub-request
+    batch_session.set(None)
+    async with limit:
+        return await dispatch(request, item)
+
+
+@router.post(
+    "/",
+    response_model=list[BatchResponseItem],
+    dependencies=[Depends(get_current_active_user)],
+)
+async def run_batch(
+    request: Request,
+    batch: BatchRequest,
+    session: SessionDep,
+    current_user: Annotated[User, Depends(get_current_active_user)],
+) -> list[BatchResponseItem]:
+    items = batch.requests
+    if len(items) > MAX_BATCH_REQUESTS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"A batch can hold at most {MAX_BATCH_REQUESTS} requests",
+        )
+    if sum(request_cost(item) for item in items) > MAX_BATCH_COST:
+        raise HTTPException(status_code=400, detail="The batch is too expensive")
+    for item in items:
+        if urlsplit(item.path).path.startswith(EXCLUDED_PATHS):
+            raise HTTPException(
+                status_code=400, detail=f"{item.path} can't be part of a batch"
+            )
+
+    # Sub-requests don't commit or refresh the user, it only has to stay
+    # readable after the shared session commits their writes
+    session.expunge(current_user)
+    user_token = batch_user.set(current_user)
+    session_token = batch_session.set(session)
+    responses: list[BatchResponseItem | None] = [None] * len(items)
+    try:
+        limit = asyncio.Semaphore(BATCH_READ_CONCURRENCY)
+        for run in read_runs(items):
+            if len(run) == 1 or BATCH_READ_CONCURRENCY == 1:
+                for index in run:
+                    responses[index] = await dispatch(request, items[index])
+                    # A failed sub-request may leave changes behind in the
+                    # shared session, the next one must not commit them
+                    if responses[index].status >= 400:
+                        await run_in_threadpool(session.rollback)
+                continue
+            results = await asyncio.gather(
+                *(
+                    dispatch_with_own_session(request, items[index], limit)
+                    for index in run
+                )
+            )
+            for index, response in zip(run, results):
+                responses[index] = response
+    finally:
+        batch_session.reset(session_token)
+        batch_user.reset(user_token)
+    return responses
@@ -0,0 +1,105 @@
+import asyncio
+from typing import Annotated
+
+from fastapi import (
+    APIRouter,
+    Depends,
+    HTTPException,
+    Query,
+    Request,
+    WebSocket,
+    WebSocketDisconnect,
+    status,
+)
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+
+from app.dependencies import SessionDep, decode_user_from_token, get_current_active_user
+from app.events import HEARTBEAT_SECONDS, format_server_sent_event, get_event_source
+from app.models import User
+
+router = APIRouter(prefix="/events", tags=["events"])
+
+
+@router.get("/stream", dependencies=[Depends(get_current_active_user)])
+async def stream_events(
+    request: Request,
+    current_user: Annotated[User, Depends(get_current_active_user)],
+):
+    event_source = get_event_source()
+    subscription = await event_source.subscribe(current_user.id)
+
+    async def server_sent_events():
+        try:
+            yield ": connected\n\n"
+            while not await request.is_disconnected():
+                try:
+                    event = await subscription.get(timeout=HEARTBEAT_SECONDS)
+                except TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if event is None:
+                    yield "event: evicted\ndata: {}\n\n"
+                    return
+                yield format_server_sent_event(event)
+        finally:
+            event_source.unsubscribe(subscription)
+
+    return StreamingResponse(
+        server_sent_events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.websocket("/ws")
+async def websocket_events(
+    websocket: WebSocket, session: SessionDep, token: str = Query()
+):
+    # Browsers can't set an Authorization header on websockets, so the token
+    # comes in the query string. Looking the user up blocks on the database,
+    # which must not hold up the event loop.
+    try:
+        current_user = await run_in_threadpool(decode_user_from_token, token, session)
+    except HTTPException:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    finally:
+        await run_in_threadpool(session.close)
+    if current_user.is_active is False:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    event_source = get_event_source()
+    subscription = await event_source.subscribe(current_user.id)
+    await websocket.accept()
+
+    async def forward_events():
+        while True:
+            try:
+                event = await subscription.get(timeout=HEARTBEAT_SECONDS)
+            except TimeoutError:
+                await websocket.send_json({"type": "keepalive"})
+                continue
+            if event is None:
+                await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+                return
+            await websocket.send_json(event)
+
+    async def wait_for_disconnect():
+        try:
+            while True:
+                await websocket.receive_text()
+        except WebSocketDisconnect:
+            pass
+
+    tasks = [
+        asyncio.create_task(forward_events()),
+        asyncio.create_task(wait_for_disconnect()),
+    ]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        event_source.unsubscribe(subscription)
@@ -1,12 +1,32 @@
 from typing import Annotated
 
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from sqlmodel import col, select
 
-from app.dependencies import SessionDep, get_current_active_user
-from app.models import FoodItem, FoodItemCreate, FoodItemPublic, FoodItemUpdate, User
+from app.catalog import catalog, request_export
+from app.dependencies import SOFT_DELETE, SessionDep, get_current_active_user
+from app.invalidation import FOOD_ITEM, bus
+from app.jobs import enqueue
+from app.models import (
+    FoodItem,
+    FoodItemCreate,
+    FoodItemPublic,
+    FoodItemUpdate,
+    RecipeIngredient,
+    User,
+)
+from app.negotiation import NegotiatedResponse, NegotiatedRoute
+from app.purge import PURGE_JOB, delete_food_item_rows, mark_deleted
+from app.recipes import NUTRIENTS, update_dependent_recipes
+from app.statements import food_item_by_barcode
+from app.sync import change_seqs
 
-router = APIRouter(prefix="/fooditems", tags=["fooditem"])
+router = APIRouter(
+    prefix="/fooditems",
+    tags=["fooditem"],
+    route_class=NegotiatedRoute,
+    default_response_class=NegotiatedResponse,
+)
 
 
 @router.get(
@@ -23,6 +43,7 @@ def read_food_items(
 ) -> list[FoodItemPublic]:
     food_items = session.exec(
         select(FoodItem)
+        .where(col(FoodItem.deleted_at).is_(None))
         .where(col(FoodItem.name).ilike(f"%{name}%"))
         .where(col(FoodItem.barcode).ilike(f"%{barcode}%"))
         .offset(offset)
@@ -37,7 +58,30 @@ def read_food_items(
     dependencies=[Depends(get_current_active_user)],
 )
 def read_food_item(food_item_id: int, session: SessionDep) -> FoodItemPublic:
+    if catalog is not None:
+        food_item = catalog.food_item(session, food_item_id)
+        if not food_item:
+            raise HTTPException(status_code=404, detail="Food item not found")
+        return food_item
+    # By primary key, answered from the session's identity map when loaded
     food_item = session.get(FoodItem, food_item_id)
+    if not food_item or food_item.deleted_at is not None:
+        raise HTTPException(status_code=404, detail="Food item not found")
+    return FoodItemPublic.model_validate(food_item)
+
+
+@router.get(
+    "/barcode/{barcode}",
+    response_model=FoodItemPublic,
+    dependencies=[Depends(get_current_active_user)],
+)
+def read_food_item_by_barcode(barcode: str, session: SessionDep) -> FoodItemPublic:
+    if catalog is not None:
+        food_item = catalog.food_item_by_barcode(session, barcode)
+        if not food_item:
+            raise HTTPException(status_code=404, detail="Food item not found")
+        return food_item
+    food_item = session.scalars(food_item_by_barcode(barcode)).first()
     if not food_item:
         raise HTTPException(status_code=404, detail="Food item not found")
     return FoodItemPublic.model_validate(food_item)
@@ -65,6 +109,7 @@ def create_food_item(
     session.add(new_food_item)
     session.commit()
     session.refresh(new_food_item)
+    request_export(session)
     return FoodItemPublic.model_validate(new_food_item)
 
 
@@ -73,23 +118,41 @@ def delete_food_item(
     current_user: Annotated[User, Depends(get_current_active_user)],
     food_item_id: int,
     session: SessionDep,
+    response: Response,
 ):
     food_item = session.get(FoodItem, food_item_id)
-    if not food_item:
+    if not food_item or food_item.deleted_at is not None:
         raise HTTPException(status_code=404, detail="Food item not found")
     if current_user.is_admin == False:
         if current_user.id != food_item.creator_id:
             raise HTTPException(
                 status_code=403, detail="Only creator or admin can delete food item"
             )
-    try:
-        session.delete(food_item)
-        session.commit()
-    except AssertionError:
+    if session.exec(
+        select(RecipeIngredient.id).where(
+            col(RecipeIngredient.ingredient_id) == food_item_id
+        )
+    ).first():
         raise HTTPException(
             status_code=400,
             detail="This food item is part of a recipe. You can't delete it.",
         )
+    if SOFT_DELETE:
+        mark_deleted(session, food_item)
+        job = enqueue(
+            session,
+            PURGE_JOB,
+            idempotency_key=f"purge:fooditem:{food_item_id}",
+            creator_id=current_user.id,
+        )
+        request_export(session)
+        bus.publish(FOOD_ITEM, {"id": food_item_id, "change_seq": None})
+        response.status_code = 202
+        return {"ok": True, "job_id": job.id}
+    delete_food_item_rows(session, food_item_id)
+    session.commit()
+    request_export(session)
+    bus.publish(FOOD_ITEM, {"id": food_item_id, "change_seq": None})
     return {"ok": True}
 
 
@@ -105,18 +168,26 @@ def update_food_item(
     session: SessionDep,
 ):
     food_item_in_db = session.get(FoodItem, food_item_id)
-    if not food_item_in_db:
+    if not food_item_in_db or food_item_in_db.deleted_at is not None:
         raise HTTPException(status_code=404, detail="Food item not found")
     if current_user.is_admin == False:
         if current_user.id != food_item_in_db.creator_id:
             raise HTTPException(
                 status_code=403, detail="Only creator or admin can update food item"
             )
-    food_item_data = FoodItemUpdate.model_validate(
-        food_item_data.model_dump(exclude_unset=True)
-    )
-    food_item_in_db.sqlmodel_update(food_item_data)
+    changes = food_item_data.model_dump(exclude_unset=True)
+    if food_item_in_db.is_recipe and set(changes) & set(NUTRIENTS):
+        raise HTTPException(
+            status_code=400,
+            detail="Nutrition values of a recipe are computed from its ingredients",
+        )
+    food_item_in_db.sqlmodel_update(changes)
     session.add(food_item_in_db)
+    recipe_ids = update_dependent_recipes(session, [food_item_id])
+    changed_seqs = change_seqs(session, [food_item_id] + recipe_ids)
     session.commit()
     session.refresh(food_item_in_db)
+    request_export(session)
+    for changed_id, change_seq in changed_seqs.items():
+        bus.publish(FOOD_ITEM, {"id": changed_id, "change_seq": change_seq})
     return food_item_in_db
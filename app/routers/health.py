@@ -0,0 +1,23 @@
+from fastapi import APIRouter, Response
+
+from app.dependencies import engine
+from app.health import POOL_WARMUP_CONNECTIONS, Readiness
+
+router = APIRouter(prefix="/health", tags=["health"])
+
+readiness = Readiness(engine, POOL_WARMUP_CONNECTIONS)
+
+
+@router.get("/live")
+async def read_liveness() -> dict:
+    # Only says the worker is running, it never touches the database
+    return {"status": "ok"}
+
+
+@router.get("/ready")
+def read_readiness(response: Response) -> dict:
+    problem = readiness.status()
+    if problem is not None:
+        response.status_code = 503
+        return {"status": "unavailable", "detail": problem}
+    return {"status": "ok"}
@@ -0,0 +1,29 @@
+from typing import Annotated
+
+from fastapi import APIRouter, Depends, HTTPException
+
+from app.dependencies import SessionDep, get_current_active_user
+from app.models import Job, JobPublic, User
+
+router = APIRouter(prefix="/jobs", tags=["jobs"])
+
+
+@router.get(
+    "/{job_id}",
+    response_model=JobPublic,
+    dependencies=[Depends(get_current_active_user)],
+)
+def read_job(
+    current_user: Annotated[User, Depends(get_current_active_user)],
+    job_id: int,
+    session: SessionDep,
+) -> JobPublic:
+    job = session.get(Job, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if current_user.is_admin == False:
+        if current_user.id != job.creator_id:
+            raise HTTPException(
+                status_code=403, detail="Only creator or admin can read the job"
+            )
+    return JobPublic.model_validate(job)
@@ -1,13 +1,44 @@
-from datetime import date
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from itertools import groupby
 from typing import Annotated
 
 from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlmodel import col, select
+from fastapi.responses import StreamingResponse
+from sqlalchemy import BigInteger, Connection, Engine, func, type_coerce
+from sqlalchemy.orm import joinedload
+from sqlmodel import Session, col, select
 
+from app.catalog import MACRO_COLUMNS, catalog
 from app.dependencies import SessionDep, get_current_active_user
-from app.models import Meal, MealCreate, MealPublic, MealUpdate, User
+from app.events import publish_meal_event
+from app.invalidation import MEALS, bus
+from app.models import (
+    CentiUnits,
+    FoodItem,
+    Meal,
+    MealCreate,
+    MealPublic,
+    MealStats,
+    MealSummary,
+    MealUpdate,
+    User,
+)
+from app.negotiation import NegotiatedResponse, NegotiatedRoute
+from app.statements import meals_by_creator_and_date
+from app.stats import get_meal_stats
+
+router = APIRouter(
+    prefix="/meals",
+    tags=["meals"],
+    route_class=NegotiatedRoute,
+    default_response_class=NegotiatedResponse,
+)
 
-router = APIRouter(prefix="/meals", tags=["meals"])
+MAX_MEAL_RANGE_DAYS = 92
+MAX_STREAMED_MEAL_RANGE_DAYS = 3660
+MEAL_RANGE_STREAM_BATCH = 500
 
 
 @router.get(
@@ -23,21 +54,191 @@ def read_my_meals(
 ) -> list[MealPublic]:
     if ids:
         meals = session.exec(
-            select(Meal).where(col(Meal.is_shared) == True).where(col(Meal.id).in_(ids))
+            select(Meal)
+            .options(joinedload(Meal.food_item))
+            .where(col(Meal.is_shared) == True)
+            .where(col(Meal.id).in_(ids))
         ).all()
         return [MealPublic.model_validate(meal) for meal in meals]
     if selected_date is None:
         raise HTTPException(
             status_code=400, detail="You must provide the selected date query"
         )
-    meals = session.exec(
-        select(Meal)
-        .where(col(Meal.creator_id) == current_user.id)
-        .where(col(Meal.created_at) == selected_date)
+    meals = session.scalars(
+        meals_by_creator_and_date(current_user.id, selected_date)
     ).all()
     return [MealPublic.model_validate(meal) for meal in meals]
 
 
+def meals_in_range_query(user_id: int, date_from: date, date_to: date):
+    return (
+        select(Meal)
+        .options(joinedload(Meal.food_item))
+        .where(col(Meal.creator_id) == user_id)
+        .where(col(Meal.created_at) >= date_from)
+        .where(col(Meal.created_at) <= date_to)
+        .order_by(col(Meal.created_at), col(Meal.id))
+    )
+
+
+def stream_meals_by_date(bind: Engine | Connection, query):
+    # The request scoped session is already closed once the response body
+    # starts streaming, and inside POST /batch it belongs to the whole batch,
+    # so the generator reads through a session of its own.
+    with Session(bind) as session:
+        meals = session.exec(query.execution_options(yield_per=MEAL_RANGE_STREAM_BATCH))
+        for selected_date, day_meals in groupby(
+            meals, key=lambda meal: meal.created_at
+        ):
+            day = {
+                "date": selected_date.isoformat(),
+                "meals": [
+                    MealPublic.model_validate(meal).model_dump(mode="json")
+                    for meal in day_meals
+                ],
+            }
+            yield json.dumps(day) + "\n"
+
+
+@router.get(
+    "/range",
+    response_model=dict[date, list[MealPublic]],
+    dependencies=[Depends(get_current_active_user)],
+)
+def read_my_meals_in_range(
+    session: SessionDep,
+    current_user: Annotated[User, Depends(get_current_active_user)],
+    date_from: date = Query(alias="from"),
+    date_to: date = Query(alias="to"),
+    stream: bool = Query(
+        False, description="Stream one JSON line per day instead of a single object"
+    ),
+) -> dict[date, list[MealPublic]]:
+    if date_to < date_from:
+        raise HTTPException(
+            status_code=400, detail="The 'to' date must not be before the 'from' date"
+        )
+    max_days = MAX_STREAMED_MEAL_RANGE_DAYS if stream else MAX_MEAL_RANGE_DAYS
+    if (date_to - date_from).days >= max_days:
+        raise HTTPException(
+            status_code=400,
+            detail=f"The date range can span at most {max_days} days",
+        )
+    query = meals_in_range_query(current_user.id, date_from, date_to)
+    if stream:
+        return StreamingResponse(
+            stream_meals_by_date(session.get_bind(), query),
+            media_type="application/x-ndjson",
+        )
+    meals = session.exec(query).all()
+    return {
+        selected_date: [MealPublic.model_validate(meal) for meal in day_meals]
+        for selected_date, day_meals in groupby(meals, key=lambda meal: meal.created_at)
+    }
+
+
+def meal_summary_query(user_id: int, date_from: date, date_to: date):
+    # Works on the raw integer hundredths: the product of a per 100g value and
+    # an amount in grams is in millionths of the final unit.
+    def centi(column):
+        return type_coerce(column, BigInteger)
+
+    def consumed(column):
+        return func.coalesce(func.sum(centi(column) * centi(Meal.food_amount)), 0)
+
+    return (
+        select(
+            func.count(col(Meal.id)),
+            func.coalesce(func.sum(centi(Meal.calories)), 0),
+            consumed(FoodItem.fats),
+            consumed(FoodItem.carbs),
+            consumed(FoodItem.protein),
+        )
+        .select_from(Meal)
+        .outerjoin(FoodItem, col(FoodItem.id) == col(Meal.food_item_id))
+        .where(col(Meal.creator_id) == user_id)
+        .where(col(Meal.created_at) >= date_from)
+        .where(col(Meal.created_at) <= date_to)
+    )
+
+
+def meal_amounts_query(user_id: int, date_from: date, date_to: date):
+    # Per food item, so that the macros can come from the catalog snapshot
+    def centi(column):
+        return type_coerce(column, BigInteger)
+
+    return (
+        select(
+            col(Meal.food_item_id),
+            func.count(col(Meal.id)),
+            func.sum(centi(Meal.calories)),
+            func.sum(centi(Meal.food_amount)),
+        )
+        .where(col(Meal.creator_id) == user_id)
+        .where(col(Meal.created_at) >= date_from)
+        .where(col(Meal.created_at) <= date_to)
+        .group_by(col(Meal.food_item_id))
+    )
+
+
+@router.get(
+    "/summary",
+    response_model=MealSummary,
+    dependencies=[Depends(get_current_active_user)],
+)
+def read_my_meals_summary(
+    session: SessionDep,
+    current_user: Annotated[User, Depends(get_current_active_user)],
+    date_from: date = Query(alias="from"),
+    date_to: date = Query(alias="to"),
+) -> MealSummary:
+    if date_to < date_from:
+        raise HTTPException(
+            status_code=400, detail="The 'to' date must not be before the 'from' date"
+        )
+    if catalog is not None:
+        rows = session.exec(
+            meal_amounts_query(current_user.id, date_from, date_to)
+        ).all()
+        meal_count = sum(row[1] for row in rows)
+        calories = sum(row[2] for row in rows)
+        macros = catalog.consumed_macros(
+            session,
+            {
+                food_item_id: amount
+                for food_item_id, _, _, amount in rows
+                if food_item_id is not None
+            },
+        )
+        fats, carbs, protein = (macros[name] for name in MACRO_COLUMNS)
+    else:
+        meal_count, calories, fats, carbs, protein = session.exec(
+            meal_summary_query(current_user.id, date_from, date_to)
+        ).one()
+    cent = Decimal("0.01")
+    return MealSummary(
+        date_from=date_from,
+        date_to=date_to,
+        meal_count=meal_count,
+        calories=CentiUnits.from_units(calories),
+        fats=CentiUnits.from_units(fats, exponent=6).quantize(cent),
+        carbs=CentiUnits.from_units(carbs, exponent=6).quantize(cent),
+        protein=CentiUnits.from_units(protein, exponent=6).quantize(cent),
+    )
+
+
+@router.get(
+    "/stats",
+    response_model=MealStats,
+    dependencies=[Depends(get_current_active_user)],
+)
+def read_my_meals_stats(
+    session: SessionDep,
+    current_user: Annotated[User, Depends(get_current_active_user)],
+) -> MealStats:
+    return get_meal_stats(session, current_user.id, today=datetime.now().date())
+
+
 @router.get(
     "/{meal_id}",
     response_model=MealPublic,
@@ -62,6 +263,18 @@ def read_meal(
     return MealPublic.model_validate(meal)
 
 
+def load_meals(session: SessionDep, meal_ids: list[int]) -> list[Meal]:
+    # Reloads the meals and their food items in one query, in the given order.
+    # Meals deleted in the meantime are left out.
+    meals = session.exec(
+        select(Meal)
+        .options(joinedload(Meal.food_item))
+        .where(col(Meal.id).in_(meal_ids))
+    ).all()
+    meals_by_id = {meal.id: meal for meal in meals}
+    return [meals_by_id[meal_id] for meal_id in meal_ids if meal_id in meals_by_id]
+
+
 @router.post(
     "/create-many",
     response_model=list[MealPublic],
@@ -72,14 +285,19 @@ def create_meals(
     meals_in: list[MealCreate],
     session: SessionDep,
 ) -> list[MealPublic]:
-    new_meals = []
-    for meal in meals_in:
-        new_meal = Meal.model_validate(meal, update={"creator_id": current_user.id})
-        session.add(new_meal)
-        session.commit()
-        session.refresh(new_meal)
-        new_meals.append(MealPublic.model_validate(new_meal))
-    return new_meals
+    new_meals = [
+        Meal.model_validate(meal, update={"creator_id": current_user.id})
+        for meal in meals_in
+    ]
+    session.add_all(new_meals)
+    session.flush()
+    new_meal_ids = [new_meal.id for new_meal in new_meals]
+    session.commit()
+    new_meals = load_meals(session, new_meal_ids)
+    for new_meal in new_meals:
+        publish_meal_event("created", new_meal)
+    bus.publish(MEALS, current_user.id)
+    return [MealPublic.model_validate(new_meal) for new_meal in new_meals]
 
 
 @router.post(
@@ -96,6 +314,8 @@ def create_meal(
     session.add(new_meal)
     session.commit()
     session.refresh(new_meal)
+    bus.publish(MEALS, current_user.id)
+    publish_meal_event("created", new_meal)
     return MealPublic.model_validate(new_meal)
 
 
@@ -115,6 +335,8 @@ def delete_meal(
             )
     session.delete(meal)
     session.commit()
+    bus.publish(MEALS, meal.creator_id)
+    publish_meal_event("deleted", meal)
     return {"ok": True}
 
 
@@ -128,9 +350,15 @@ def update_meals(
     meal_data: list[MealUpdate],
     session: SessionDep,
 ):
+    meals_by_id = {
+        meal_db.id: meal_db
+        for meal_db in session.exec(
+            select(Meal).where(col(Meal.id).in_([meal.id for meal in meal_data]))
+        )
+    }
     updated_meals = []
     for meal in meal_data:
-        meal_db = session.get(Meal, meal.id)
+        meal_db = meals_by_id.get(meal.id)
         if not meal_db:
             raise HTTPException(
                 status_code=404, detail=f"Meal with id {meal.id} not found."
@@ -143,9 +371,14 @@ def update_meals(
         meal_data = meal.model_dump(exclude_unset=True)
         meal_db.sqlmodel_update(meal_data)
         session.add(meal_db)
-        session.commit()
-        session.refresh(meal_db)
         updated_meals.append(meal_db)
+    updated_meal_ids = [meal_db.id for meal_db in updated_meals]
+    session.commit()
+    updated_meals = load_meals(session, updated_meal_ids)
+    for meal_db in updated_meals:
+        publish_meal_event("updated", meal_db)
+    for creator_id in {meal_db.creator_id for meal_db in updated_meals}:
+        bus.publish(MEALS, creator_id)
     return updated_meals
 
 
@@ -175,4 +408,6 @@ def update_meal(
     session.add(meal_db)
     session.commit()
     session.refresh(meal_db)
+    bus.publish(MEALS, meal_db.creator_id)
+    publish_meal_event("updated", meal_db)
     return meal_db
@@ -0,0 +1,150 @@
+from typing import Annotated
+
+from fastapi import APIRouter, Depends, HTTPException
+from sqlmodel import Session, col, delete, select
+
+from app.catalog import request_export
+from app.dependencies import SessionDep, get_current_active_user
+from app.invalidation import FOOD_ITEM, bus
+from app.models import (
+    FoodItem,
+    RecipeCreate,
+    RecipeIngredient,
+    RecipeIngredientIn,
+    RecipePublic,
+    User,
+)
+from app.recipes import creates_cycle, recompute_recipe, update_dependent_recipes
+from app.sync import change_seqs
+
+router = APIRouter(prefix="/recipes", tags=["recipes"])
+
+
+def recipe_public(session: Session, recipe: FoodItem) -> RecipePublic:
+    ingredients = session.exec(
+        select(RecipeIngredient)
+        .where(col(RecipeIngredient.recipe_id) == recipe.id)
+        .order_by(col(RecipeIngredient.id))
+    ).all()
+    return RecipePublic.model_validate(
+        recipe,
+        update={
+            "ingredients": [
+                RecipeIngredientIn.model_validate(ingredient)
+                for ingredient in ingredients
+            ]
+        },
+    )
+
+
+def check_ingredients(
+    session: Session, recipe_id: int | None, ingredients: list[RecipeIngredientIn]
+) -> None:
+    ingredient_ids = [ingredient.ingredient_id for ingredient in ingredients]
+    if len(set(ingredient_ids)) != len(ingredient_ids):
+        raise HTTPException(
+            status_code=400, detail="Each ingredient can only be listed once"
+        )
+    found = session.exec(
+        select(FoodItem.id)
+        .where(col(FoodItem.id).in_(ingredient_ids))
+        .where(col(FoodItem.deleted_at).is_(None))
+    ).all()
+    missing = sorted(set(ingredient_ids) - set(found))
+    if missing:
+        raise HTTPException(
+            status_code=404, detail=f"Ingredient with id {missing[0]} not found."
+        )
+    # A new recipe isn't used anywhere yet, so it can't close a cycle
+    if recipe_id is not None and creates_cycle(session, recipe_id, ingredient_ids):
+        raise HTTPException(
+            status_code=400, detail="A recipe can't contain itself, not even nested"
+        )
+
+
+def replace_ingredients(
+    session: Session, recipe: FoodItem, ingredients: list[RecipeIngredientIn]
+) -> None:
+    session.exec(
+        delete(RecipeIngredient).where(col(RecipeIngredient.recipe_id) == recipe.id)
+    )
+    session.add_all(
+        RecipeIngredient(
+            recipe_id=recipe.id,
+            ingredient_id=ingredient.ingredient_id,
+            amount=ingredient.amount,
+        )
+        for ingredient in ingredients
+    )
+    recompute_recipe(session, recipe)
+
+
+@router.get(
+    "/{recipe_id}",
+    response_model=RecipePublic,
+    dependencies=[Depends(get_current_active_user)],
+)
+def read_recipe(recipe_id: int, session: SessionDep) -> RecipePublic:
+    recipe = session.get(FoodItem, recipe_id)
+    if not recipe or not recipe.is_recipe or recipe.deleted_at is not None:
+        raise HTTPException(status_code=404, detail="Recipe not found")
+    return recipe_public(session, recipe)
+
+
+@router.post(
+    "/",
+    response_model=RecipePublic,
+    dependencies=[Depends(get_current_active_user)],
+)
+def create_recipe(
+    current_user: Annotated[User, Depends(get_current_active_user)],
+    recipe_in: RecipeCreate,
+    session: SessionDep,
+) -> RecipePublic:
+    recipe = FoodItem.model_validate(
+        recipe_in.model_dump(exclude={"ingredients"}),
+        update={"creator_id": current_user.id, "is_recipe": True},
+    )
+    check_ingredients(session, None, recipe_in.ingredients)
+    session.add(recipe)
+    session.flush()
+    replace_ingredients(session, recipe, recipe_in.ingredients)
+    session.commit()
+    session.refresh(recipe)
+    request_export(session)
+    return recipe_public(session, recipe)
+
+
+@router.put(
+    "/{recipe_id}/ingredients",
+    response_model=RecipePublic,
+    dependencies=[Depends(get_current_active_user)],
+)
+def update_recipe_ingredients(
+    current_user: Annotated[User, Depends(get_current_active_user)],
+    recipe_id: int,
+    ingredients: list[RecipeIngredientIn],
+    session: SessionDep,
+) -> RecipePublic:
+    recipe = session.get(FoodItem, recipe_id)
+    if not recipe or not recipe.is_recipe or recipe.deleted_at is not None:
+        raise HTTPException(status_code=404, detail="Recipe not found")
+    if current_user.is_admin == False:
+        if current_user.id != recipe.creator_id:
+            raise HTTPException(
+                status_code=403, detail="Only creator or admin can update the recipe"
+            )
+    if not ingredients:
+        raise HTTPException(
+            status_code=400, detail="A recipe needs at least one ingredient"
+        )
+    check_ingredients(session, recipe_id, ingredients)
+    replace_ingredients(session, recipe, ingredients)
+    changed = [recipe_id] + update_dependent_recipes(session, [recipe_id])
+    changed_seqs = change_seqs(session, changed)
+    session.commit()
+    session.refresh(recipe)
+    request_export(session)
+    for food_item_id, change_seq in changed_seqs.items():
+        bus.publish(FOOD_ITEM, {"id": food_item_id, "change_seq": change_seq})
+    return recipe_public(session, recipe)
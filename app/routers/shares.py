@@ -0,0 +1,111 @@
+import hashlib
+import re
+import secrets
+from typing import Annotated
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Response
+from sqlalchemy.orm import joinedload
+from sqlmodel import col, select
+
+from app.dependencies import SessionDep, get_current_active_user
+from app.models import (
+    Meal,
+    MealPublic,
+    MealShare,
+    MealShareCreate,
+    MealSharePublic,
+    MealShareSnapshot,
+    User,
+)
+
+router = APIRouter(prefix="/shares", tags=["shares"])
+
+# Snapshots never change, but a share can be revoked, so caches keep it for a
+# few minutes and then check back
+SNAPSHOT_CACHE_CONTROL = "public, max-age=300, must-revalidate"
+# An entity-tag in an If-None-Match list, weak or strong
+ENTITY_TAG = re.compile(r'(?:W/)?("[^"]*")')
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """Weak comparison of If-None-Match against the current ETag (RFC 9110)."""
+    if if_none_match.strip() == "*":
+        return True
+    return etag in ENTITY_TAG.findall(if_none_match)
+
+
+@router.post(
+    "/",
+    response_model=MealSharePublic,
+    dependencies=[Depends(get_current_active_user)],
+)
+def create_share(
+    current_user: Annotated[User, Depends(get_current_active_user)],
+    share_in: MealShareCreate,
+    session: SessionDep,
+) -> MealSharePublic:
+    meal_ids = set(share_in.meal_ids)
+    meals = session.exec(
+        select(Meal)
+        .options(joinedload(Meal.food_item))
+        .where(col(Meal.id).in_(meal_ids))
+        .order_by(col(Meal.created_at), col(Meal.mealtime_id), col(Meal.id))
+    ).all()
+    if len(meals) != len(meal_ids):
+        raise HTTPException(status_code=404, detail="Meal not found")
+    if current_user.is_admin == False:
+        if any(meal.creator_id != current_user.id for meal in meals):
+            raise HTTPException(
+                status_code=403, detail="Only creator or admin can share the meal."
+            )
+
+    new_share = MealShare(token=secrets.token_urlsafe(32), creator_id=current_user.id)
+    new_share.snapshot = MealShareSnapshot(
+        created_at=new_share.created_at,
+        meals=[MealPublic.model_validate(meal) for meal in meals],
+    ).model_dump_json()
+    new_share.etag = '"' + hashlib.sha256(new_share.snapshot.encode()).hexdigest() + '"'
+    session.add(new_share)
+    session.commit()
+    session.refresh(new_share)
+    return MealSharePublic.model_validate(new_share)
+
+
+@router.get(
+    "/{token}",
+    response_model=MealShareSnapshot,
+    responses={304: {"description": "Snapshot not modified"}},
+)
+def read_share(
+    token: str,
+    session: SessionDep,
+    if_none_match: Annotated[str | None, Header()] = None,
+):
+    share = session.exec(select(MealShare).where(col(MealShare.token) == token)).first()
+    if not share:
+        raise HTTPException(status_code=404, detail="Share not found")
+    headers = {"ETag": share.etag, "Cache-Control": SNAPSHOT_CACHE_CONTROL}
+    if if_none_match is not None and etag_matches(if_none_match, share.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(
+        content=share.snapshot, media_type="application/json", headers=headers
+    )
+
+
+@router.delete("/{token}", dependencies=[Depends(get_current_active_user)])
+def delete_share(
+    current_user: Annotated[User, Depends(get_current_active_user)],
+    token: str,
+    session: SessionDep,
+):
+    share = session.exec(select(MealShare).where(col(MealShare.token) == token)).first()
+    if not share:
+        raise HTTPException(status_code=404, detail="Share not found")
+    if current_user.is_admin == False:
+        if current_user.id != share.creator_id:
+            raise HTTPException(
+                status_code=403, detail="Only creator or admin can delete the share."
+            )
+    session.delete(share)
+    session.commit()
+    return {"ok": True}
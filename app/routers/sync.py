@@ -0,0 +1,102 @@
+from typing import Annotated
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.orm import joinedload
+from sqlmodel import col, or_, select
+
+from app.dependencies import SessionDep, get_current_active_user
+from app.models import (
+    FoodItem,
+    FoodItemPublic,
+    Meal,
+    MealPublic,
+    SyncChanges,
+    Tombstone,
+    TombstonePublic,
+    User,
+)
+from app.sync import FOOD_ITEM_ENTITY, pruned_change_seq, settled_change_seq
+
+router = APIRouter(prefix="/sync", tags=["sync"])
+
+
+@router.get(
+    "/changes",
+    response_model=SyncChanges,
+    dependencies=[Depends(get_current_active_user)],
+)
+def read_changes(
+    session: SessionDep,
+    current_user: Annotated[User, Depends(get_current_active_user)],
+    since: int = Query(0, ge=0, description="next_cursor of the previous page"),
+    limit: Annotated[int, Query(ge=1, le=1000)] = 500,
+) -> SyncChanges:
+    connection = session.connection()
+    if 0 < since < pruned_change_seq(connection):
+        raise HTTPException(
+            status_code=410,
+            detail="Deletions since this cursor were pruned, sync again from 0",
+        )
+    # Changes above it may still be joined by ones committed later with a
+    # lower change_seq, they are left for the next call
+    settled = settled_change_seq(connection)
+    # Each source is read one row past the page size; merged by sequence they
+    # tell whether anything is left for the next page.
+    meals = session.exec(
+        select(Meal)
+        .options(joinedload(Meal.food_item))
+        .where(col(Meal.creator_id) == current_user.id)
+        .where(col(Meal.change_seq) > since)
+        .where(col(Meal.change_seq) <= settled)
+        .order_by(col(Meal.change_seq))
+        .limit(limit + 1)
+    ).all()
+    food_items = session.exec(
+        select(FoodItem)
+        .where(col(FoodItem.change_seq) > since)
+        .where(col(FoodItem.change_seq) <= settled)
+        .order_by(col(FoodItem.change_seq))
+        .limit(limit + 1)
+    ).all()
+    tombstones = session.exec(
+        select(Tombstone)
+        .where(col(Tombstone.change_seq) > since)
+        .where(col(Tombstone.change_seq) <= settled)
+        .where(
+            or_(
+                col(Tombstone.creator_id) == current_user.id,
+                col(Tombstone.entity) == FOOD_ITEM_ENTITY,
+            )
+        )
+        .order_by(col(Tombstone.change_seq))
+        .limit(limit + 1)
+    ).all()
+
+    changes = sorted(
+        [*meals, *food_items, *tombstones], key=lambda change: change.change_seq
+    )
+    page = changes[:limit]
+    changes_page = SyncChanges(
+        meals=[],
+        food_items=[],
+        deleted=[],
+        next_cursor=page[-1].change_seq if page else since,
+        has_more=len(changes) > limit,
+    )
+    for change in page:
+        if isinstance(change, Meal):
+            changes_page.meals.append(MealPublic.model_validate(change))
+        elif isinstance(change, Tombstone):
+            changes_page.deleted.append(TombstonePublic.model_validate(change))
+        elif change.deleted_at is not None:
+            # Soft deleted food items are reported as deleted right away
+            changes_page.deleted.append(
+                TombstonePublic(
+                    entity=FOOD_ITEM_ENTITY,
+                    entity_id=change.id,
+                    deleted_at=change.deleted_at,
+                )
+            )
+        else:
+            changes_page.food_items.append(FoodItemPublic.model_validate(change))
+    return changes_page
@@ -1,16 +1,20 @@
 from typing import Annotated
 
-from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlmodel import select
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from sqlmodel import col, select
 
 from app.dependencies import (
+    SOFT_DELETE,
     SessionDep,
     allow_admin_or_self,
     allow_self,
     get_current_active_admin_user,
     get_password_hash,
 )
+from app.invalidation import FOOD_ITEM, USER, bus
+from app.jobs import enqueue
 from app.models import User, UserCreate, UserPublic, UserUpdate
+from app.purge import PURGE_JOB, delete_user_rows, mark_deleted
 
 router = APIRouter(prefix="/users", tags=["users"])
 
@@ -23,7 +27,9 @@ router = APIRouter(prefix="/users", tags=["users"])
 def read_users(
     session: SessionDep, offset: int = 0, limit: Annotated[int, Query(le=100)] = 100
 ) -> list[UserPublic]:
-    users = session.exec(select(User).offset(offset).limit(limit)).all()
+    users = session.exec(
+        select(User).where(col(User.deleted_at).is_(None)).offset(offset).limit(limit)
+    ).all()
     return [UserPublic.model_validate(user) for user in users]
 
 
@@ -34,7 +40,7 @@ def read_users(
 )
 def read_user(user_id: int, session: SessionDep) -> UserPublic:
     user = session.get(User, user_id)
-    if not user:
+    if not user or user.deleted_at is not None:
         raise HTTPException(status_code=404, detail="User not found")
     return UserPublic.model_validate(user)
 
@@ -78,12 +84,20 @@ def create_admin(
 
 
 @router.delete("/{user_id}", dependencies=[Depends(allow_admin_or_self)])
-def delete_user(user_id: int, session: SessionDep):
+def delete_user(user_id: int, session: SessionDep, response: Response):
     user = session.get(User, user_id)
-    if not user:
+    if not user or user.deleted_at is not None:
         raise HTTPException(status_code=404, detail="User not found")
-    session.delete(user)
+    if SOFT_DELETE:
+        mark_deleted(session, user)
+        job = enqueue(session, PURGE_JOB, idempotency_key=f"purge:user:{user_id}")
+        response.status_code = 202
+        return {"ok": True, "job_id": job.id}
+    changed_seqs = delete_user_rows(session, user_id)
     session.commit()
+    bus.publish(USER, user_id)
+    for food_item_id, change_seq in changed_seqs.items():
+        bus.publish(FOOD_ITEM, {"id": food_item_id, "change_seq": change_seq})
     return {"ok": True}
 
 
@@ -94,7 +108,7 @@ def delete_user(user_id: int, session: SessionDep):
 )
 def update_user(user_id: int, user: UserUpdate, session: SessionDep):
     user_db = session.get(User, user_id)
-    if not user_db:
+    if not user_db or user_db.deleted_at is not None:
         raise HTTPException(status_code=404, detail="User not found")
     user_data = user.model_dump(exclude_unset=True)
     user_db.sqlmodel_update(user_data)
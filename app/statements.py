@@ -0,0 +1,39 @@
+"""Pre-built statements for the queries run on almost every request.
+
+lambda_stmt() caches a statement and its compiled SQL under the code of its
+lambda. Later calls only pick up the new values of the variables the lambda
+closes over and send them as bound parameters, instead of building a new
+select() and working out its cache key every time. Run them with
+session.scalars().
+"""
+
+from datetime import date
+
+from sqlalchemy import lambda_stmt
+from sqlalchemy.orm import joinedload
+from sqlmodel import col, select
+
+from app.models import FoodItem, Meal, User
+
+
+def user_by_username(username: str):
+    return lambda_stmt(lambda: select(User).where(col(User.username) == username))
+
+
+def meals_by_creator_and_date(creator_id: int, created_at: date):
+    return lambda_stmt(
+        lambda: select(Meal)
+        .options(joinedload(Meal.food_item))
+        .where(col(Meal.creator_id) == creator_id)
+        .where(col(Meal.created_at) == created_at)
+    )
+
+
+def food_item_by_barcode(barcode: str):
+    return lambda_stmt(
+        lambda: select(FoodItem)
+        .where(col(FoodItem.barcode) == barcode)
+        .where(col(FoodItem.deleted_at).is_(None))
+        .order_by(col(FoodItem.id))
+        .limit(1)
+    )
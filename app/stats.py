@@ -0,0 +1,274 @@
+import threading
+from collections import OrderedDict
+from datetime import date, timedelta
+
+import numpy as np
+from sqlalchemy import BigInteger, func, type_coerce
+from sqlmodel import Session, col, select
+
+from app.invalidation import FOOD_ITEM, MEALS, USER, bus
+from app.models import (
+    MAX_MEALTIME_ID,
+    DailyMealStats,
+    FoodItem,
+    Meal,
+    MealStats,
+    MealtimeStats,
+    WeeklyMealStats,
+)
+
+MEAL_STATS_CACHE_SIZE = 256
+# Days covered by the daily and weekly series. Meal dates come from the
+# client, so the series must not span whatever range they happen to cover.
+MEAL_STATS_DAYS = 366
+ROLLING_WINDOWS = (7, 30)
+
+# Energy per gram of each macronutrient, used for the weekly macro split
+KCAL_PER_GRAM = {"fats": 9, "carbs": 4, "protein": 4}
+
+## Loading
+
+# Values come straight from the integer columns: calories are in hundredths,
+# macros are per 100g hundredths multiplied by hundredths of grams eaten.
+CALORIES_SCALE = 100
+MACROS_SCALE = 1_000_000
+
+
+def meal_stats_columns_query(user_id: int):
+    def centi(column):
+        return type_coerce(column, BigInteger)
+
+    def consumed(column):
+        return func.coalesce(centi(column) * centi(Meal.food_amount), 0)
+
+    return (
+        select(
+            col(Meal.created_at),
+            col(Meal.mealtime_id),
+            centi(Meal.calories),
+            consumed(FoodItem.fats),
+            consumed(FoodItem.carbs),
+            consumed(FoodItem.protein),
+        )
+        .select_from(Meal)
+        .outerjoin(FoodItem, col(FoodItem.id) == col(Meal.food_item_id))
+        .where(col(Meal.creator_id) == user_id)
+    )
+
+
+def load_meal_stats_columns(session: Session, user_id: int) -> dict[str, np.ndarray]:
+    rows = session.exec(meal_stats_columns_query(user_id)).all()
+    created_at, mealtime_id, calories, fats, carbs, protein = (
+        zip(*rows) if rows else ([],) * 6
+    )
+    return {
+        "created_at": np.array(created_at, dtype="datetime64[D]"),
+        "mealtime_id": np.array(mealtime_id, dtype=np.int64),
+        "calories": np.array(calories, dtype=np.float64) / CALORIES_SCALE,
+        "fats": np.array(fats, dtype=np.float64) / MACROS_SCALE,
+        "carbs": np.array(carbs, dtype=np.float64) / MACROS_SCALE,
+        "protein": np.array(protein, dtype=np.float64) / MACROS_SCALE,
+    }
+
+
+## Computing
+
+
+def rounded(values: np.ndarray) -> list[float]:
+    return np.round(values, 2).tolist()
+
+
+def rolling_mean_of_logged_days(
+    values: np.ndarray, logged: np.ndarray, window: int
+) -> np.ndarray:
+    # Days without any meal are skipped rather than counted as zero, so that a
+    # forgotten day doesn't drag the average down.
+    value_sums = np.concatenate(([0.0], np.cumsum(values)))
+    logged_sums = np.concatenate(([0], np.cumsum(logged)))
+    end = np.arange(1, len(values) + 1)
+    start = np.maximum(end - window, 0)
+    totals = value_sums[end] - value_sums[start]
+    counts = logged_sums[end] - logged_sums[start]
+    return np.divide(totals, counts, out=np.zeros_like(totals), where=counts > 0)
+
+
+def streak_lengths(logged_days: np.ndarray) -> np.ndarray:
+    # Runs of consecutive days in the ascending, distinct logged days
+    breaks = np.flatnonzero(np.diff(logged_days.astype(np.int64)) != 1) + 1
+    return np.diff(np.concatenate(([0], breaks, [len(logged_days)])))
+
+
+def week_number(days: np.ndarray) -> np.ndarray:
+    # Weeks start on Monday; 1970-01-01 (day zero of datetime64) was a Thursday
+    return (days.astype(np.int64) + 3) // 7
+
+
+def compute_meal_stats(columns: dict[str, np.ndarray], today: date) -> MealStats:
+    days = columns["created_at"]
+    calories = columns["calories"]
+    if len(days) == 0:
+        return MealStats(
+            first_date=None,
+            last_date=None,
+            days_logged=0,
+            current_streak=0,
+            longest_streak=0,
+            daily=DailyMealStats(
+                dates=[],
+                calories=[],
+                rolling_7_day_calories=[],
+                rolling_30_day_calories=[],
+            ),
+            weekly=WeeklyMealStats(
+                week_starts=[],
+                calories=[],
+                fats=[],
+                carbs=[],
+                protein=[],
+                fats_share=[],
+                carbs_share=[],
+                protein_share=[],
+            ),
+            mealtimes=[],
+        )
+
+    logged_days = np.unique(days)
+    first_day, last_day = logged_days[0], logged_days[-1]
+    streaks = streak_lengths(logged_days)
+    last_date = last_day.item()
+    current_streak = int(streaks[-1]) if last_date >= today - timedelta(days=1) else 0
+
+    # Daily series over every calendar day of the last MEAL_STATS_DAYS up to
+    # the last meal, leaving out meals dated after today. It is computed from
+    # the longest rolling window earlier, so the first averages are complete.
+    series_end = min(last_day, np.datetime64(today, "D"))
+    series_start = max(first_day, series_end - (MEAL_STATS_DAYS - 1))
+    day_count = max(int((series_end - series_start).astype(np.int64)) + 1, 0)
+    lead = max(ROLLING_WINDOWS) - 1
+    in_window = (days >= series_start - lead) & (days <= series_end)
+    day_index = (days[in_window] - (series_start - lead)).astype(np.int64)
+    padded_calories = np.bincount(
+        day_index, weights=calories[in_window], minlength=lead + day_count
+    )
+    padded_logged = np.bincount(day_index, minlength=lead + day_count) > 0
+    rolling = {
+        window: rolling_mean_of_logged_days(padded_calories, padded_logged, window)
+        for window in ROLLING_WINDOWS
+    }
+
+    in_series = (days >= series_start) & (days <= series_end)
+    first_week = week_number(series_start)
+    week_count = int(week_number(series_end) - first_week) + 1 if day_count else 0
+    week_index = week_number(days[in_series]) - first_week
+    weekly = {
+        name: np.bincount(
+            week_index, weights=columns[name][in_series], minlength=week_count
+        )
+        for name in ("calories", "fats", "carbs", "protein")
+    }
+    energy = {name: weekly[name] * KCAL_PER_GRAM[name] for name in KCAL_PER_GRAM}
+    total_energy = sum(energy.values())
+    shares = {
+        name: np.divide(
+            energy[name],
+            total_energy,
+            out=np.zeros_like(total_energy),
+            where=total_energy > 0,
+        )
+        for name in energy
+    }
+    week_starts = ((np.arange(week_count) + first_week) * 7 - 3).astype("datetime64[D]")
+
+    # Rows stored before mealtime ids were validated may be out of range
+    mealtime_ids = columns["mealtime_id"]
+    known = (mealtime_ids >= 1) & (mealtime_ids <= MAX_MEALTIME_ID)
+    mealtime_counts = np.bincount(mealtime_ids[known], minlength=MAX_MEALTIME_ID + 1)
+    mealtime_calories = np.bincount(
+        mealtime_ids[known], weights=calories[known], minlength=MAX_MEALTIME_ID + 1
+    )
+    total_calories = mealtime_calories.sum()
+    mealtimes = [
+        MealtimeStats(
+            mealtime_id=mealtime_id,
+            meal_count=int(mealtime_counts[mealtime_id]),
+            calories=round(float(mealtime_calories[mealtime_id]), 2),
+            calories_share=(
+                round(float(mealtime_calories[mealtime_id] / total_calories), 4)
+                if total_calories > 0
+                else 0.0
+            ),
+        )
+        for mealtime_id in np.flatnonzero(mealtime_counts).tolist()
+    ]
+
+    return MealStats(
+        first_date=first_day.item(),
+        last_date=last_date,
+        days_logged=len(logged_days),
+        current_streak=current_streak,
+        longest_streak=int(streaks.max()),
+        daily=DailyMealStats(
+            dates=np.arange(series_start, series_start + day_count).tolist(),
+            calories=rounded(padded_calories[lead:]),
+            rolling_7_day_calories=rounded(rolling[7][lead:]),
+            rolling_30_day_calories=rounded(rolling[30][lead:]),
+        ),
+        weekly=WeeklyMealStats(
+            week_starts=week_starts.tolist(),
+            calories=rounded(weekly["calories"]),
+            fats=rounded(weekly["fats"]),
+            carbs=rounded(weekly["carbs"]),
+            protein=rounded(weekly["protein"]),
+            fats_share=np.round(shares["fats"], 4).tolist(),
+            carbs_share=np.round(shares["carbs"], 4).tolist(),
+            protein_share=np.round(shares["protein"], 4).tolist(),
+        ),
+        mealtimes=mealtimes,
+    )
+
+
+## Caching
+
+_meal_stats_cache: OrderedDict[int, tuple[date, MealStats]] = OrderedDict()
+_meal_stats_versions: dict[int, int] = {}
+_meal_stats_generation = 0
+_meal_stats_lock = threading.Lock()
+
+
+def invalidate_meal_stats(user_id: int | None = None) -> None:
+    """Drop cached stats of one user, or of everyone when no user is given."""
+    global _meal_stats_generation
+    with _meal_stats_lock:
+        if user_id is None:
+            _meal_stats_generation += 1
+            _meal_stats_cache.clear()
+        else:
+            _meal_stats_versions[user_id] = _meal_stats_versions.get(user_id, 0) + 1
+            _meal_stats_cache.pop(user_id, None)
+
+
+def get_meal_stats(session: Session, user_id: int, today: date) -> MealStats:
+    with _meal_stats_lock:
+        cached = _meal_stats_cache.get(user_id)
+        # The current streak depends on today's date, so a cached result is
+        # only good for the day it was computed on.
+        if cached is not None and cached[0] == today:
+            _meal_stats_cache.move_to_end(user_id)
+            return cached[1]
+        version = (_meal_stats_generation, _meal_stats_versions.get(user_id, 0))
+
+    stats = compute_meal_stats(load_meal_stats_columns(session, user_id), today)
+
+    with _meal_stats_lock:
+        # Meals might have changed while computing, don't cache stale results
+        if version == (_meal_stats_generation, _meal_stats_versions.get(user_id, 0)):
+            _meal_stats_cache[user_id] = (today, stats)
+            _meal_stats_cache.move_to_end(user_id)
+            while len(_meal_stats_cache) > MEAL_STATS_CACHE_SIZE:
+                _meal_stats_cache.popitem(last=False)
+    return stats
+
+
+bus.subscribe(MEALS, invalidate_meal_stats)
+bus.subscribe(USER, invalidate_meal_stats)
+bus.subscribe(FOOD_ITEM, lambda change: invalidate_meal_stats())
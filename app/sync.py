@@ -0,0 +1,195 @@
+from datetime import datetime
+
+from sqlalchemy import Connection, event, func, insert, literal, text, update
+from sqlalchemy.orm import Session as OrmSession
+from sqlalchemy.orm import aliased
+from sqlmodel import Session, col, select
+
+from app.models import CHANGE_SEQUENCE, FoodItem, Meal, SyncSequence, Tombstone
+
+SYNCED_MODELS = (Meal, FoodItem)
+MEAL_ENTITY = "meal"
+FOOD_ITEM_ENTITY = "fooditem"
+# Postgres advisory lock that writers hold shared from taking change sequence
+# values until they commit
+CHANGE_SEQ_LOCK = 7_264_931
+
+
+def uses_sequence(connection: Connection) -> bool:
+    return connection.dialect.name == "postgresql"
+
+
+def update_sync_row(connection: Connection, **values) -> None:
+    connection.execute(
+        update(SyncSequence).where(col(SyncSequence.id) == 1).values(**values)
+    )
+
+
+def hold_change_seq_lock(connection: Connection) -> None:
+    connection.execute(
+        text("SELECT pg_advisory_xact_lock_shared(:key)"), {"key": CHANGE_SEQ_LOCK}
+    )
+
+
+def reserve_change_seqs(connection: Connection, count: int) -> list[int]:
+    """Reserve `count` ascending change sequence values.
+
+    On Postgres they come from a sequence, so concurrent writers don't wait
+    for each other, see settled_change_seq() for how readers cope with
+    values committed out of order. Other databases let one writer at a time
+    update the counter row anyway.
+    """
+    if uses_sequence(connection):
+        hold_change_seq_lock(connection)
+        return list(
+            connection.execute(
+                select(CHANGE_SEQUENCE.next_value()).select_from(
+                    func.generate_series(1, count)
+                )
+            ).scalars()
+        )
+    update_sync_row(connection, value=col(SyncSequence.value) + count)
+    last = connection.execute(
+        select(SyncSequence.value).where(col(SyncSequence.id) == 1)
+    ).scalar_one()
+    return list(range(last - count + 1, last + 1))
+
+
+def settled_change_seq(connection: Connection) -> int:
+    """Highest change_seq below which no change can be committed any more.
+
+    Changes up to it are all visible to the statements run afterwards, so a
+    cursor moved up to it never skips a change committed late.
+    """
+    if not uses_sequence(connection):
+        value = connection.execute(
+            select(SyncSequence.value).where(col(SyncSequence.id) == 1)
+        ).scalar()
+        return value or 0
+    last = connection.execute(
+        text("SELECT CASE WHEN is_called THEN last_value ELSE 0 END FROM change_seq")
+    ).scalar_one()
+    # Every writer that took a value up to `last` holds the lock shared until
+    # it commits or rolls back, so getting it exclusively waits for them
+    connection.execute(text("SELECT pg_advisory_lock(:key)"), {"key": CHANGE_SEQ_LOCK})
+    connection.execute(
+        text("SELECT pg_advisory_unlock(:key)"), {"key": CHANGE_SEQ_LOCK}
+    )
+    return last
+
+
+def pruned_change_seq(connection: Connection) -> int:
+    value = connection.execute(
+        select(SyncSequence.pruned_through).where(col(SyncSequence.id) == 1)
+    ).scalar()
+    return value or 0
+
+
+def entity_name(row: Meal | FoodItem) -> str:
+    return MEAL_ENTITY if isinstance(row, Meal) else FOOD_ITEM_ENTITY
+
+
+@event.listens_for(OrmSession, "before_flush")
+def stamp_changes(session: OrmSession, flush_context, instances) -> None:
+    changed = [row for row in session.new if isinstance(row, SYNCED_MODELS)] + [
+        row
+        for row in session.dirty
+        if isinstance(row, SYNCED_MODELS) and session.is_modified(row)
+    ]
+    deleted = [row for row in session.deleted if isinstance(row, SYNCED_MODELS)]
+    if not changed and not deleted:
+        return
+    now = datetime.now()
+    next_seqs = iter(
+        reserve_change_seqs(session.connection(), len(changed) + len(deleted))
+    )
+    for row in changed:
+        row.change_seq = next(next_seqs)
+        row.updated_at = now
+    for row in deleted:
+        session.add(
+            Tombstone(
+                entity=entity_name(row),
+                entity_id=row.id,
+                creator_id=row.creator_id if isinstance(row, Meal) else None,
+                change_seq=next(next_seqs),
+                deleted_at=now,
+            )
+        )
+
+
+def record_meal_tombstones(session: Session, condition) -> None:
+    # Tombstones for meals removed by a bulk DELETE, which bypasses the
+    # before_flush hook above. Must run before the DELETE itself.
+    connection = session.connection()
+    if uses_sequence(connection):
+        hold_change_seq_lock(connection)
+        change_seq = CHANGE_SEQUENCE.next_value()
+    else:
+        count = session.exec(
+            select(func.count()).select_from(Meal).where(condition)
+        ).one()
+        if not count:
+            return
+        first_seq = reserve_change_seqs(connection, count)[0]
+        change_seq = first_seq - 1 + func.row_number().over(order_by=col(Meal.id))
+    session.exec(
+        insert(Tombstone).from_select(
+            ["entity", "entity_id", "creator_id", "change_seq", "deleted_at"],
+            select(
+                literal(MEAL_ENTITY),
+                col(Meal.id),
+                col(Meal.creator_id),
+                change_seq,
+                literal(datetime.now()),
+            )
+            .where(condition)
+            .order_by(col(Meal.id)),
+        )
+    )
+
+
+def record_food_item_tombstone(session: Session, food_item_id: int) -> None:
+    session.add(
+        Tombstone(
+            entity=FOOD_ITEM_ENTITY,
+            entity_id=food_item_id,
+            change_seq=reserve_change_seqs(session.connection(), 1)[0],
+        )
+    )
+    session.flush()
+
+
+def food_item_change_seqs(session: Session, food_item_ids: list[int]):
+    """Expression giving each of the food items its own new change_seq.
+
+    For a bulk UPDATE, which bypasses the before_flush hook above.
+    """
+    connection = session.connection()
+    if uses_sequence(connection):
+        hold_change_seq_lock(connection)
+        return CHANGE_SEQUENCE.next_value()
+    first_seq = reserve_change_seqs(connection, len(food_item_ids))[0]
+    earlier = aliased(FoodItem)
+    return (
+        first_seq
+        - 1
+        + (
+            select(func.count())
+            .select_from(earlier)
+            .where(col(earlier.id).in_(food_item_ids))
+            .where(col(earlier.id) <= col(FoodItem.id))
+            .scalar_subquery()
+        )
+    )
+
+
+def change_seqs(session: Session, food_item_ids: list[int]) -> dict[int, int]:
+    """Flush and return the change_seq each of the food items got."""
+    session.flush()
+    rows = session.exec(
+        select(FoodItem.id, FoodItem.change_seq).where(
+            col(FoodItem.id).in_(food_item_ids)
+        )
+    ).all()
+    return dict(rows)
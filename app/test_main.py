@@ -1,13 +1,34 @@
+import asyncio
+import json
 import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from datetime import date, datetime, timedelta
+from decimal import Decimal
 
+import msgpack
+import numpy as np
 import pytest
 from dotenv import load_dotenv
+from fastapi import WebSocketDisconnect
 from fastapi.testclient import TestClient
-from sqlmodel import Session, SQLModel, StaticPool, create_engine
+from sqlalchemy import BigInteger, type_coerce
+from sqlmodel import Session, SQLModel, StaticPool, create_engine, select
 
-from .dependencies import get_password_hash, get_session
+from .catalog import Catalog, export_catalog
+from .dependencies import create_access_token, get_password_hash, get_session
+from .events import LocalEventHub, get_event_source
+from .invalidation import FOOD_ITEM, InvalidationBus, UnixSocketTransport, bus
+from .jobs import enqueue, handlers, run_next_job
 from .main import app
-from .models import User
+from .models import FoodItem, Meal, Tombstone, User
+from .purge import TOMBSTONE_RETENTION_DAYS, purge_soft_deleted
+from .routers.meals import load_meals
+from .statements import user_by_username
+from .stats import MEAL_STATS_DAYS, compute_meal_stats
 
 load_dotenv()
 admin_username = os.getenv("DEFAULT_ADMIN_LOGIN")
@@ -88,3 +109,998 @@ def test_auth_me_returns_200_and_current_user_data(client: TestClient):
     assert response.status_code == 200
     response_body = response.json()
     assert response_body["username"] == admin_username
+
+
+def test_meals_range_returns_meals_grouped_by_date(client: TestClient):
+    headers = {"Authorization": f"Bearer {access_token}"}
+    response = client.post(
+        "/fooditems/",
+        headers=headers,
+        json={"name": "Oats", "calories": 380, "fats": 7, "carbs": 60, "protein": 13},
+    )
+    assert response.status_code == 200
+    food_item_id = response.json()["id"]
+    response = client.post(
+        "/meals/create-many",
+        headers=headers,
+        json=[
+            {
+                "calories": 190,
+                "food_amount": 50,
+                "food_item_id": food_item_id,
+                "created_at": created_at,
+            }
+            for created_at in ["2025-01-01", "2025-01-01", "2025-01-03", "2025-02-01"]
+        ],
+    )
+    assert response.status_code == 200
+
+    response = client.get(
+        "/meals/range",
+        headers=headers,
+        params={"from": "2025-01-01", "to": "2025-01-31"},
+    )
+    assert response.status_code == 200
+    response_body = response.json()
+    assert list(response_body) == ["2025-01-01", "2025-01-03"]
+    assert len(response_body["2025-01-01"]) == 2
+    assert response_body["2025-01-03"][0]["food_item"]["name"] == "Oats"
+
+
+def test_meals_range_streams_one_line_per_day(client: TestClient, session: Session):
+    loaded = session.exec(select(User)).first()
+    response = client.get(
+        "/meals/range",
+        headers={"Authorization": f"Bearer {access_token}"},
+        params={"from": "2025-01-01", "to": "2025-12-31", "stream": True},
+    )
+    assert response.status_code == 200
+    days = [json.loads(line) for line in response.text.splitlines()]
+    assert [day["date"] for day in days] == ["2025-01-01", "2025-01-03", "2025-02-01"]
+    # The stream reads through its own session and leaves the shared one, as
+    # used by POST /batch, alone
+    assert loaded in session
+
+
+def test_meals_range_rejects_too_long_and_reversed_ranges(client: TestClient):
+    headers = {"Authorization": f"Bearer {access_token}"}
+    response = client.get(
+        "/meals/range",
+        headers=headers,
+        params={"from": "2025-01-01", "to": "2025-12-31"},
+    )
+    assert response.status_code == 400
+    response = client.get(
+        "/meals/range",
+        headers=headers,
+        params={"from": "2025-01-02", "to": "2025-01-01"},
+    )
+    assert response.status_code == 400
+
+
+def test_meals_summary_sums_calories_and_macros(client: TestClient):
+    response = client.get(
+        "/meals/summary",
+        headers={"Authorization": f"Bearer {access_token}"},
+        params={"from": "2025-01-01", "to": "2025-01-31"},
+    )
+    assert response.status_code == 200
+    response_body = response.json()
+    assert response_body["meal_count"] == 3
+    assert Decimal(response_body["calories"]) == Decimal("570")
+    assert Decimal(response_body["fats"]) == Decimal("10.5")
+    assert Decimal(response_body["carbs"]) == Decimal("90")
+    assert Decimal(response_body["protein"]) == Decimal("19.5")
+
+
+def test_nutrition_values_round_trip_through_integer_storage(session: Session):
+    food_item = FoodItem(
+        name="Precise", calories=Decimal("123.45"), fats=0.1, creator_id=1
+    )
+    session.add(food_item)
+    session.commit()
+    session.expire(food_item)
+    assert food_item.calories == Decimal("123.45")
+    assert food_item.fats == Decimal("0.10")
+    stored = session.exec(
+        select(type_coerce(FoodItem.calories, BigInteger)).where(
+            FoodItem.id == food_item.id
+        )
+    ).one()
+    assert stored == 12345
+
+
+def test_load_meals_skips_meals_deleted_in_the_meantime():
+    engine = create_engine("sqlite://")
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        meals = [Meal(calories=index, creator_id=1) for index in range(3)]
+        session.add_all(meals)
+        session.commit()
+        meal_ids = [meal.id for meal in meals]
+        session.delete(meals[1])
+        session.commit()
+        loaded = load_meals(session, meal_ids[::-1])
+    assert [meal.id for meal in loaded] == [meal_ids[2], meal_ids[0]]
+
+
+def test_meals_stats_returns_daily_weekly_and_mealtime_stats(client: TestClient):
+    headers = {"Authorization": f"Bearer {access_token}"}
+    response = client.get("/meals/stats", headers=headers)
+    assert response.status_code == 200
+    response_body = response.json()
+    assert response_body["first_date"] == "2025-01-01"
+    assert response_body["last_date"] == "2025-02-01"
+    assert response_body["days_logged"] == 3
+    assert response_body["longest_streak"] == 1
+    assert response_body["daily"]["calories"][:3] == [380.0, 0.0, 190.0]
+    assert response_body["daily"]["rolling_7_day_calories"][2] == 285.0
+    assert response_body["weekly"]["week_starts"][0] == "2024-12-30"
+    assert response_body["weekly"]["fats"][0] == 10.5
+    assert response_body["mealtimes"] == [
+        {"mealtime_id": 1, "meal_count": 4, "calories": 760.0, "calories_share": 1.0}
+    ]
+
+    # Creating a meal invalidates the cached stats
+    response = client.post(
+        "/meals/",
+        headers=headers,
+        json={"calories": 100, "created_at": "2025-02-02", "mealtime_id": 3},
+    )
+    assert response.status_code == 200
+    response_body = client.get("/meals/stats", headers=headers).json()
+    assert response_body["last_date"] == "2025-02-02"
+    assert response_body["longest_streak"] == 2
+    assert response_body["mealtimes"][1]["mealtime_id"] == 3
+    client.delete(f"/meals/{response.json()['id']}", headers=headers)
+
+
+def test_compute_meal_stats_finds_streaks():
+    days = [date(2025, 3, 1) + timedelta(days=day) for day in [0, 1, 2, 5, 6]]
+    columns = {
+        "created_at": np.array(days, dtype="datetime64[D]"),
+        "mealtime_id": np.ones(len(days), dtype=np.int64),
+        "calories": np.full(len(days), 100.0),
+        "fats": np.zeros(len(days)),
+        "carbs": np.zeros(len(days)),
+        "protein": np.zeros(len(days)),
+    }
+    stats = compute_meal_stats(columns, today=date(2025, 3, 8))
+    assert stats.longest_streak == 3
+    assert stats.current_streak == 2
+    assert compute_meal_stats(columns, today=date(2025, 3, 9)).current_streak == 0
+
+
+def test_meals_reject_unknown_mealtimes(client: TestClient):
+    headers = {"Authorization": f"Bearer {access_token}"}
+    response = client.post("/meals/", headers=headers, json={"mealtime_id": -1})
+    assert response.status_code == 422
+    meal_id = client.post("/meals/", headers=headers, json={}).json()["id"]
+    response = client.patch(
+        f"/meals/{meal_id}", headers=headers, json={"mealtime_id": 0}
+    )
+    assert response.status_code == 422
+    client.delete(f"/meals/{meal_id}", headers=headers)
+
+
+def test_compute_meal_stats_bounds_series_and_mealtimes():
+    # Client supplied dates far apart and a mealtime stored before validation
+    days = [date(1, 1, 1), date(2025, 3, 1), date(9999, 12, 31)]
+    columns = {
+        "created_at": np.array(days, dtype="datetime64[D]"),
+        "mealtime_id": np.array([1, -1, 2], dtype=np.int64),
+        "calories": np.full(len(days), 100.0),
+        "fats": np.zeros(len(days)),
+        "carbs": np.zeros(len(days)),
+        "protein": np.zeros(len(days)),
+    }
+    stats = compute_meal_stats(columns, today=date(2025, 3, 8))
+    assert stats.first_date == date(1, 1, 1)
+    assert stats.days_logged == 3
+    assert len(stats.daily.dates) == MEAL_STATS_DAYS
+    assert stats.daily.dates[-1] == date(2025, 3, 8)
+    assert sum(stats.daily.calories) == 100.0
+    assert len(stats.weekly.week_starts) <= MEAL_STATS_DAYS // 7 + 2
+    assert [mealtime.mealtime_id for mealtime in stats.mealtimes] == [1, 2]
+
+
+def test_shares_serve_a_revocable_snapshot_by_token(client: TestClient):
+    headers = {"Authorization": f"Bearer {access_token}"}
+    meals = client.get(
+        "/meals/", headers=headers, params={"selected_date": "2025-01-01"}
+    ).json()
+    response = client.post(
+        "/shares/", headers=headers, json={"meal_ids": [meal["id"] for meal in meals]}
+    )
+    assert response.status_code == 200
+    token = response.json()["token"]
+    assert len(token) >= 32
+
+    # Reading a share doesn't need authentication
+    response = client.get(f"/shares/{token}")
+    assert response.status_code == 200
+    assert response.headers["Cache-Control"] == "public, max-age=300, must-revalidate"
+    etag = response.headers["ETag"]
+    snapshot = response.json()
+    assert [meal["id"] for meal in snapshot["meals"]] == [meal["id"] for meal in meals]
+    assert snapshot["meals"][0]["food_item"]["name"] == "Oats"
+
+    # Later changes to the meals don't leak into the snapshot
+    client.patch(f"/meals/{meals[0]['id']}", headers=headers, json={"calories": 1})
+    response = client.get(f"/shares/{token}")
+    assert response.json() == snapshot
+    client.patch(f"/meals/{meals[0]['id']}", headers=headers, json={"calories": 190})
+
+    for if_none_match, status_code in (
+        (etag, 304),
+        (f'"other", W/{etag}', 304),
+        ("*", 304),
+        # Only whole entity-tags match, not a piece of one
+        (etag[:-2] + '"', 200),
+        (f'"x{etag[1:]}', 200),
+    ):
+        response = client.get(
+            f"/shares/{token}", headers={"If-None-Match": if_none_match}
+        )
+        assert response.status_code == status_code, if_none_match
+
+    response = client.delete(f"/shares/{token}", headers=headers)
+    assert response.status_code == 200
+    assert client.get(f"/shares/{token}").status_code == 404
+
+
+def test_shares_require_existing_meals(client: TestClient):
+    response = client.post(
+        "/shares/",
+        headers={"Authorization": f"Bearer {access_token}"},
+        json={"meal_ids": [999999]},
+    )
+    assert response.status_code == 404
+
+
+def create_food_item_with_meals(client: TestClient, headers: dict, meal_count: int):
+    food_item_id = client.post(
+        "/fooditems/", headers=headers, json={"name": "Popular", "calories": 100}
+    ).json()["id"]
+    client.post(
+        "/meals/create-many",
+        headers=headers,
+        json=[
+            {"calories": 10, "food_item_id": food_item_id, "created_at": "2024-06-01"}
+            for _ in range(meal_count)
+        ],
+    )
+    return food_item_id
+
+
+def test_food_items_negotiate_msgpack_and_compression(client: TestClient):
+    headers = {"Authorization": f"Bearer {access_token}"}
+    for i in range(20):
+        client.post(
+            "/fooditems/",
+            headers=headers,
+            json={"name": f"Compressible {i}", "calories": 123.45, "fats": 1.5},
+        )
+    plain = {**headers, "Accept-Encoding": "identity"}
+    as_json = client.get("/fooditems/?name=Compressible", headers=plain)
+    as_msgpack = client.get(
+        "/fooditems/?name=Compressible",
+        headers={**plain, "Accept": "application/msgpack"},
+    )
+    assert as_msgpack.headers["content-type"] == "application/msgpack"
+    assert "content-encoding" not in as_msgpack.headers
+    assert msgpack.unpackb(as_msgpack.content) == as_json.json()
+    assert len(as_msgpack.content) < len(as_json.content)
+
+    for encoding in ("gzip", "br"):
+        response = client.get(
+            "/fooditems/?name=Compressible",
+            headers={**headers, "Accept-Encoding": encoding},
+        )
+        assert response.headers["content-encoding"] == encoding
+        assert "Accept-Encoding" in response.headers["vary"]
+        assert response.json() == as_json.json()
+
+    # Too small to be worth compressing
+    response = client.get("/auth/me", headers={**headers, "Accept-Encoding": "gzip"})
+    assert "content-encoding" not in response.headers
+
+
+def test_batch_runs_sub_requests_in_order_for_one_user(
+    client: TestClient, monkeypatch: pytest.MonkeyPatch
+):
+    # The test database is a single in-memory connection
+    monkeypatch.setattr("app.routers.batch.BATCH_READ_CONCURRENCY", 1)
+    headers = {"Authorization": f"Bearer {access_token}"}
+    response = client.post(
+        "/batch/",
+        headers=headers,
+        json={
+            "requests": [
+                {"path": "/auth/me"},
+                {"method": "POST", "path": "/meals/", "body": {"calories": 42}},
+                {"path": "/meals/?selected_date=" + date.today().isoformat()},
+                {"path": "/fooditems/999999"},
+            ]
+        },
+    )
+    assert response.status_code == 200
+    me, created, meals, missing = response.json()
+    assert me["status"] == 200
+    assert me["body"]["username"] == admin_username
+    assert created["status"] == 200
+    assert created["body"]["id"] in [meal["id"] for meal in meals["body"]]
+    assert missing == {"status": 404, "body": {"detail": "Food item not found"}}
+
+    too_many = {"requests": [{"path": "/auth/me"}] * 21}
+    assert client.post("/batch/", headers=headers, json=too_many).status_code == 400
+    too_expensive = {"requests": [{"path": "/meals/stats"}] * 9}
+    assert (
+        client.post("/batch/", headers=headers, json=too_expensive).status_code == 400
+    )
+    nested = {"requests": [{"method": "POST", "path": "/batch/"}]}
+    assert client.post("/batch/", headers=headers, json=nested).status_code == 400
+    assert (
+        client.post("/batch/", json={"requests": [{"path": "/auth/me"}]}).status_code
+        == 401
+    )
+
+
+def test_batch_discards_changes_of_a_failed_sub_request(
+    client: TestClient, session: Session, monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setattr("app.routers.batch.BATCH_READ_CONCURRENCY", 1)
+    headers = {"Authorization": f"Bearer {access_token}"}
+    meal = client.post("/meals/", headers=headers, json={"calories": 10}).json()
+    response = client.post(
+        "/batch/",
+        headers=headers,
+        json={
+            "requests": [
+                {
+                    "method": "PATCH",
+                    "path": "/meals/update-many",
+                    "body": [
+                        {"id": meal["id"], "calories": 999},
+                        {"id": 12345, "calories": 1},
+                    ],
+                },
+                {"method": "POST", "path": "/meals/", "body": {"calories": 1}},
+            ]
+        },
+    )
+    assert [item["status"] for item in response.json()] == [404, 200]
+    session.expire_all()
+    assert session.get(Meal, meal["id"]).calories == Decimal(10)
+
+
+def test_batch_runs_reads_concurrently_with_their_own_sessions(
+    tmp_path, monkeypatch: pytest.MonkeyPatch
+):
+    # Concurrent reads need a database with more than one connection
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'batch.db'}",
+        connect_args={"check_same_thread": False},
+    )
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as file_session:
+        user = User(username="batcher")
+        file_session.add(user)
+        file_session.commit()
+        file_session.add_all(
+            Meal(calories=index, creator_id=user.id) for index in range(1, 4)
+        )
+        file_session.commit()
+    monkeypatch.setattr("app.dependencies.engine", engine)
+    monkeypatch.setattr("app.routers.batch.BATCH_READ_CONCURRENCY", 2)
+    monkeypatch.delitem(app.dependency_overrides, get_session, raising=False)
+    token = create_access_token({"sub": "batcher"})
+    today = date.today().isoformat()
+    response = TestClient(app).post(
+        "/batch/",
+        headers={"Authorization": f"Bearer {token}"},
+        json={
+            "requests": [
+                {"path": "/auth/me"},
+                {"path": f"/meals/?selected_date={today}"},
+                {"path": "/meals/summary?from={0}&to={0}".format(today)},
+                {"path": "/fooditems/999999"},
+            ]
+        },
+    )
+    me, meals, summary, missing = response.json()
+    assert me["body"]["username"] == "batcher"
+    assert len(meals["body"]) == 3
+    assert summary["body"]["meal_count"] == 3
+    assert missing["status"] == 404
+    engine.dispose()
+
+
+def test_cached_statements_bind_new_values_on_every_call(
+    client: TestClient, session: Session
+):
+    headers = {"Authorization": f"Bearer {access_token}"}
+    for barcode in ("5900000000017", "5900000000024"):
+        client.post(
+            "/fooditems/",
+            headers=headers,
+            json={"name": f"Scanned {barcode}", "barcode": barcode},
+        )
+    for barcode in ("5900000000017", "5900000000024"):
+        response = client.get(f"/fooditems/barcode/{barcode}", headers=headers)
+        assert response.json()["name"] == f"Scanned {barcode}"
+    response = client.get("/fooditems/barcode/0000000000000", headers=headers)
+    assert response.status_code == 404
+
+    assert session.scalars(user_by_username(admin_username)).one().is_admin
+    assert session.scalars(user_by_username("nobody")).first() is None
+
+
+def test_recipes_are_recomputed_when_nested_ingredients_change(client: TestClient):
+    headers = {"Authorization": f"Bearer {access_token}"}
+
+    def create_food_item(calories, fats):
+        response = client.post(
+            "/fooditems/",
+            headers=headers,
+            json={"name": "Ingredient", "calories": calories, "fats": fats},
+        )
+        return response.json()["id"]
+
+    def create_recipe(ingredients):
+        response = client.post(
+            "/recipes/",
+            headers=headers,
+            json={
+                "name": "Recipe",
+                "ingredients": [
+                    {"ingredient_id": ingredient_id, "amount": amount}
+                    for ingredient_id, amount in ingredients
+                ],
+            },
+        )
+        assert response.status_code == 200
+        return response.json()
+
+    first, second = create_food_item(100, 10), create_food_item(300, 0)
+    inner = create_recipe([(first, 100), (second, 300)])
+    assert (inner["calories"], inner["fats"]) == ("250.00", "2.50")
+    assert inner["is_recipe"]
+    outer = create_recipe([(inner["id"], 100), (first, 100)])
+    assert outer["calories"] == "175.00"
+
+    client.patch(f"/fooditems/{first}", headers=headers, json={"calories": 200})
+    inner = client.get(f"/fooditems/{inner['id']}", headers=headers).json()
+    outer = client.get(f"/fooditems/{outer['id']}", headers=headers).json()
+    assert (inner["calories"], outer["calories"]) == ("275.00", "237.50")
+
+    response = client.put(
+        f"/recipes/{inner['id']}/ingredients",
+        headers=headers,
+        json=[{"ingredient_id": outer["id"], "amount": 100}],
+    )
+    assert response.status_code == 400
+    response = client.patch(
+        f"/fooditems/{inner['id']}", headers=headers, json={"calories": 1}
+    )
+    assert response.status_code == 400
+    response = client.delete(f"/fooditems/{first}", headers=headers)
+    assert response.status_code == 400
+    assert "part of a recipe" in response.json()["detail"]
+
+    response = client.put(
+        f"/recipes/{inner['id']}/ingredients",
+        headers=headers,
+        json=[{"ingredient_id": second, "amount": 50}],
+    )
+    assert response.json()["ingredients"] == [
+        {"ingredient_id": second, "amount": "50.00"}
+    ]
+    outer = client.get(f"/recipes/{outer['id']}", headers=headers).json()
+    assert outer["calories"] == "250.00"
+
+
+def test_catalog_snapshot_serves_lookups_until_items_change(
+    client: TestClient, session: Session, tmp_path
+):
+    headers = {"Authorization": f"Bearer {access_token}"}
+    path = str(tmp_path / "catalog.bin")
+    catalog = Catalog(path, session.get_bind())
+    assert catalog.current() is None
+
+    ids = [
+        client.post(
+            "/fooditems/",
+            headers=headers,
+            json={
+                "name": name,
+                "brand": "Snapshot",
+                "calories": calories,
+                "protein": 10,
+                "barcode": "4000000000011",
+            },
+        ).json()["id"]
+        for name, calories in (("Oats", 380), ("Rye", 250.5))
+    ]
+    generation = export_catalog(session, path)
+    snapshot = catalog.current()
+    assert snapshot.generation == generation
+    for food_item_id in ids:
+        expected = client.get(f"/fooditems/{food_item_id}", headers=headers).json()
+        item = catalog.food_item(session, food_item_id)
+        assert item.model_dump(mode="json") == expected
+    assert catalog.food_item_by_barcode(session, "4000000000011").id == ids[0]
+    assert snapshot.barcode_row("0000000000000") is None
+
+    # A changed item is read from the database until a newer snapshot is in
+    client.patch(f"/fooditems/{ids[0]}", headers=headers, json={"barcode": "1"})
+    change_seq = session.get(FoodItem, ids[0]).change_seq
+    catalog.mark_outdated(ids[0], change_seq)
+    assert catalog.food_item(session, ids[0]).barcode == "1"
+    assert catalog.food_item_by_barcode(session, "4000000000011").id == ids[1]
+    assert snapshot.food_item(snapshot.row(ids[0])).barcode == "4000000000011"
+
+    # A worker started after the change never got the message about it
+    restarted = Catalog(path, session.get_bind())
+    assert restarted.current().generation == generation
+    assert restarted.outdated == {ids[0]: change_seq}
+    assert restarted.food_item_by_barcode(session, "1").id == ids[0]
+
+    export_catalog(session, path)
+    catalog.reload()
+    assert catalog.snapshot.generation > generation
+    assert catalog.outdated == {}
+    assert catalog.food_item_by_barcode(session, "1").id == ids[0]
+    # The replaced file stays mapped by the old snapshot
+    assert snapshot.string("name", snapshot.row(ids[1])) == "Rye"
+    assert [entry.name for entry in tmp_path.iterdir()] == ["catalog.bin"]
+
+
+def test_meal_summary_adds_up_macros_on_the_catalog_snapshot(
+    client: TestClient,
+    session: Session,
+    tmp_path,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    headers = {"Authorization": f"Bearer {access_token}"}
+    params = {"from": "2024-07-01", "to": "2024-07-01"}
+    ids = [
+        client.post(
+            "/fooditems/",
+            headers=headers,
+            json={
+                "name": name,
+                "calories": 370,
+                "fats": 1.5,
+                "carbs": 60.25,
+                "protein": protein,
+            },
+        ).json()["id"]
+        for name, protein in (("Muesli", 9.5), ("Quark", 12))
+    ]
+    client.post(
+        "/meals/create-many",
+        headers=headers,
+        json=[
+            {"calories": 100, "food_amount": amount, "food_item_id": food_item_id}
+            | {"created_at": params["from"]}
+            for food_item_id, amount in ((ids[0], 45.5), (ids[1], 250), (ids[0], 30))
+        ],
+    )
+    catalog = Catalog(str(tmp_path / "catalog.bin"), session.get_bind())
+    export_catalog(session, catalog.path)
+    expected = client.get("/meals/summary", headers=headers, params=params).json()
+    assert expected["protein"] == "37.17"
+
+    monkeypatch.setattr("app.routers.meals.catalog", catalog)
+    response = client.get("/meals/summary", headers=headers, params=params)
+    assert response.json() == expected
+    columns = catalog.snapshot.columns
+    assert set(columns["id"][catalog.snapshot.rows(np.array(ids))]) == set(ids)
+
+    # An item changed after the snapshot comes from the database
+    client.patch(f"/fooditems/{ids[1]}", headers=headers, json={"protein": 20})
+    catalog.mark_outdated(ids[1], session.get(FoodItem, ids[1]).change_seq)
+    response = client.get("/meals/summary", headers=headers, params=params)
+    assert response.json()["protein"] == "57.17"
+
+
+def test_deleting_food_item_deletes_its_meals(client: TestClient, session: Session):
+    headers = {"Authorization": f"Bearer {access_token}"}
+    food_item_id = create_food_item_with_meals(client, headers, 3)
+    response = client.delete(f"/fooditems/{food_item_id}", headers=headers)
+    assert response.status_code == 200
+    assert session.get(FoodItem, food_item_id) is None
+    assert (
+        session.exec(select(Meal).where(Meal.food_item_id == food_item_id)).all() == []
+    )
+
+
+def test_soft_deleting_food_item_hides_it_and_queues_a_purge(
+    client: TestClient, session: Session, monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setattr("app.routers.fooditems.SOFT_DELETE", True)
+    monkeypatch.setattr("app.purge.PURGE_BATCH_SIZE", 2)
+    headers = {"Authorization": f"Bearer {access_token}"}
+    food_item_id = create_food_item_with_meals(client, headers, 5)
+    response = client.delete(f"/fooditems/{food_item_id}", headers=headers)
+    assert response.status_code == 202
+    job_url = f"/jobs/{response.json()['job_id']}"
+    assert client.get(job_url, headers=headers).json()["status"] == "queued"
+    assert client.get(f"/fooditems/{food_item_id}", headers=headers).status_code == 404
+    assert session.get(FoodItem, food_item_id) is not None
+
+    assert run_next_job(session)
+    assert client.get(job_url, headers=headers).json()["status"] == "succeeded"
+    session.expire_all()
+    assert session.get(FoodItem, food_item_id) is None
+    assert (
+        session.exec(select(Meal).where(Meal.food_item_id == food_item_id)).all() == []
+    )
+
+
+def test_jobs_run_by_priority_and_retry_until_max_attempts(
+    session: Session, monkeypatch: pytest.MonkeyPatch
+):
+    calls = []
+
+    def flaky(session: Session, payload: dict):
+        calls.append(payload["name"])
+        if payload["name"] == "flaky":
+            raise ValueError("try again")
+
+    monkeypatch.setitem(handlers, "test", flaky)
+    monkeypatch.setattr("app.jobs.RETRY_BASE_SECONDS", 0)
+    low = enqueue(session, "test", {"name": "low"})
+    flaky_job = enqueue(session, "test", {"name": "flaky"}, priority=5, max_attempts=2)
+    high = enqueue(session, "test", {"name": "high"}, priority=10, idempotency_key="k")
+    assert (
+        enqueue(session, "test", {"name": "again"}, idempotency_key="k").id == high.id
+    )
+
+    while run_next_job(session):
+        pass
+    assert calls == ["high", "flaky", "flaky", "low"]
+    for job in (low, flaky_job, high):
+        session.refresh(job)
+    assert [low.status, high.status] == ["succeeded", "succeeded"]
+    assert flaky_job.status == "failed"
+    assert flaky_job.attempts == 2
+    assert "try again" in flaky_job.last_error
+
+
+def test_long_running_job_keeps_its_lease(tmp_path, monkeypatch: pytest.MonkeyPatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'jobs.db'}")
+    SQLModel.metadata.create_all(engine)
+    calls = []
+
+    def slow(session: Session, payload: dict):
+        calls.append(payload)
+        if len(calls) > 1:
+            return
+        # Runs past the lease, another worker must still not claim the job
+        time.sleep(1.5)
+        with Session(engine) as other_worker:
+            assert not run_next_job(other_worker)
+
+    monkeypatch.setitem(handlers, "slow", slow)
+    monkeypatch.setattr("app.jobs.JOB_LEASE_SECONDS", 1)
+    monkeypatch.setattr("app.jobs.JOB_HEARTBEAT_SECONDS", 0.1)
+    with Session(engine) as session:
+        job = enqueue(session, "slow")
+        assert run_next_job(session)
+        session.refresh(job)
+    assert len(calls) == 1
+    assert job.status == "succeeded"
+    assert job.attempts == 1
+
+
+def test_deleting_user_deletes_their_meals(client: TestClient, session: Session):
+    response = client.post("/users/", json={"username": "leaving", "password": "pw"})
+    user_id = response.json()["id"]
+    token = client.post(
+        "/auth/token", data={"username": "leaving", "password": "pw"}
+    ).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    client.post("/meals/", headers=headers, json={"calories": 10})
+    food_item_ids = [
+        client.post(
+            "/fooditems/", headers=headers, json={"name": f"Left behind {i}"}
+        ).json()["id"]
+        for i in range(2)
+    ]
+    admin_headers = {"Authorization": f"Bearer {access_token}"}
+    meal_id = client.post(
+        "/meals/", headers=admin_headers, json={"food_item_id": food_item_ids[0]}
+    ).json()["id"]
+    cursor = client.get("/sync/changes", headers=admin_headers).json()
+    while cursor["has_more"]:
+        cursor = client.get(
+            "/sync/changes",
+            headers=admin_headers,
+            params={"since": cursor["next_cursor"], "limit": 1000},
+        ).json()
+
+    response = client.delete(f"/users/{user_id}", headers=headers)
+    assert response.status_code == 200
+    assert session.exec(select(Meal).where(Meal.creator_id == user_id)).all() == []
+    assert client.get("/auth/me", headers=headers).status_code == 401
+    # Their food items stay for other users' meals, without a creator
+    session.expire_all()
+    assert session.get(Meal, meal_id) is not None
+    for food_item_id in food_item_ids:
+        assert session.get(FoodItem, food_item_id).creator_id is None
+    changes = client.get(
+        "/sync/changes",
+        headers=admin_headers,
+        params={"since": cursor["next_cursor"]},
+    ).json()
+    assert sorted(item["id"] for item in changes["food_items"]) == food_item_ids
+    assert {item["creator_id"] for item in changes["food_items"]} == {None}
+
+
+def test_sync_changes_returns_changed_rows_and_tombstones_in_pages(
+    client: TestClient,
+):
+    headers = {"Authorization": f"Bearer {access_token}"}
+    cursor = client.get("/sync/changes", headers=headers).json()
+    while cursor["has_more"]:
+        cursor = client.get(
+            "/sync/changes",
+            headers=headers,
+            params={"since": cursor["next_cursor"], "limit": 1000},
+        ).json()
+    since = cursor["next_cursor"]
+
+    food_item_id = client.post(
+        "/fooditems/", headers=headers, json={"name": "Synced", "calories": 50}
+    ).json()["id"]
+    meal_ids = [
+        meal["id"]
+        for meal in client.post(
+            "/meals/create-many",
+            headers=headers,
+            json=[{"calories": 5, "food_item_id": food_item_id}] * 2,
+        ).json()
+    ]
+    client.patch(f"/meals/{meal_ids[0]}", headers=headers, json={"calories": 6})
+    client.delete(f"/meals/{meal_ids[1]}", headers=headers)
+
+    response = client.get(
+        "/sync/changes", headers=headers, params={"since": since, "limit": 2}
+    )
+    assert response.status_code == 200
+    first_page = response.json()
+    assert first_page["has_more"] is True
+    assert [item["id"] for item in first_page["food_items"]] == [food_item_id]
+    # Only the latest state of the updated meal is returned
+    assert [meal["id"] for meal in first_page["meals"]] == [meal_ids[0]]
+    assert Decimal(first_page["meals"][0]["calories"]) == 6
+
+    second_page = client.get(
+        "/sync/changes",
+        headers=headers,
+        params={"since": first_page["next_cursor"], "limit": 10},
+    ).json()
+    assert second_page["has_more"] is False
+    assert second_page["meals"] == []
+    assert second_page["deleted"][0]["entity"] == "meal"
+    assert second_page["deleted"][0]["entity_id"] == meal_ids[1]
+
+    # Deleting a food item in bulk leaves tombstones for it and its meals
+    client.delete(f"/fooditems/{food_item_id}", headers=headers)
+    third_page = client.get(
+        "/sync/changes",
+        headers=headers,
+        params={"since": second_page["next_cursor"]},
+    ).json()
+    assert sorted(
+        (item["entity"], item["entity_id"]) for item in third_page["deleted"]
+    ) == [("fooditem", food_item_id), ("meal", meal_ids[0])]
+
+
+def test_pruned_tombstones_send_old_cursors_back_to_a_full_sync(
+    client: TestClient, session: Session
+):
+    headers = {"Authorization": f"Bearer {access_token}"}
+    since = client.get("/sync/changes", headers=headers).json()["next_cursor"]
+    meal = client.post("/meals/", headers=headers, json={"calories": 3}).json()
+    client.delete(f"/meals/{meal['id']}", headers=headers)
+    # Meal ids get reused on SQLite, the newest tombstone is this meal's
+    tombstone = session.exec(
+        select(Tombstone)
+        .where(Tombstone.entity == "meal", Tombstone.entity_id == meal["id"])
+        .order_by(Tombstone.change_seq.desc())
+    ).first()
+    tombstone.deleted_at = datetime.now() - timedelta(days=TOMBSTONE_RETENTION_DAYS)
+    session.add(tombstone)
+    session.commit()
+    tombstone_id, change_seq = tombstone.id, tombstone.change_seq
+
+    purge_soft_deleted(session.get_bind())
+    session.expire_all()
+    assert session.get(Tombstone, tombstone_id) is None
+    response = client.get("/sync/changes", headers=headers, params={"since": since})
+    assert response.status_code == 410
+    # Past the pruned tombstone, or from scratch, syncing goes on as before
+    for cursor in (change_seq, 0):
+        response = client.get(
+            "/sync/changes", headers=headers, params={"since": cursor}
+        )
+        assert response.status_code == 200
+
+
+def test_event_hub_fans_out_and_evicts_slow_subscribers():
+    async def scenario():
+        hub = LocalEventHub(queue_size=2)
+        fast = await hub.subscribe(1)
+        slow = await hub.subscribe(1)
+        other_user = await hub.subscribe(2)
+
+        # Publishing happens from handler threads
+        for number in range(3):
+            await asyncio.to_thread(hub.publish, 1, {"type": "test", "n": number})
+            if number < 2:
+                assert (await fast.get(timeout=1))["n"] == number
+        await asyncio.sleep(0)
+
+        assert (await fast.get(timeout=1))["n"] == 2
+        assert await slow.get(timeout=1) is None
+        assert other_user.queue.empty()
+        hub.unsubscribe(slow)
+        assert hub.subscriptions[1] == [fast]
+
+    asyncio.run(scenario())
+
+
+def test_websocket_receives_meal_events(client: TestClient):
+    headers = {"Authorization": f"Bearer {access_token}"}
+    with client.websocket_connect(f"/events/ws?token={access_token}") as websocket:
+        meal = client.post("/meals/", headers=headers, json={"calories": 42}).json()
+        event = websocket.receive_json()
+        assert event["type"] == "meal.created"
+        assert event["data"]["id"] == meal["id"]
+        client.delete(f"/meals/{meal['id']}", headers=headers)
+        event = websocket.receive_json()
+        assert event == {
+            "type": "meal.deleted",
+            "change_seq": None,
+            "data": {"id": meal["id"]},
+        }
+
+
+def test_server_sent_events_stream_meal_events(client: TestClient):
+    # The TestClient hands out a response only once the app has finished, so
+    # the endless stream is read by talking ASGI to the app directly
+    headers = {"Authorization": f"Bearer {access_token}"}
+
+    async def read_stream():
+        requested = False
+        disconnected = asyncio.Event()
+        chunks: asyncio.Queue[bytes] = asyncio.Queue()
+
+        async def receive():
+            nonlocal requested
+            if not requested:
+                requested = True
+                return {"type": "http.request", "body": b"", "more_body": False}
+            await disconnected.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                assert message["status"] == 200
+            elif message["type"] == "http.response.body":
+                await chunks.put(message.get("body", b""))
+
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": "GET",
+            "scheme": "http",
+            "path": "/events/stream",
+            "raw_path": b"/events/stream",
+            "root_path": "",
+            "query_string": b"",
+            "headers": [
+                (name.lower().encode(), value.encode())
+                for name, value in headers.items()
+            ],
+            "client": ("testclient", 50000),
+            "server": ("testserver", 80),
+        }
+        stream = asyncio.create_task(app(scope, receive, send))
+        try:
+            assert await asyncio.wait_for(chunks.get(), 5) == b": connected\n\n"
+            meal = await asyncio.to_thread(
+                client.post, "/meals/", headers=headers, json={"calories": 42}
+            )
+            event = (await asyncio.wait_for(chunks.get(), 5)).decode()
+        finally:
+            disconnected.set()
+            await asyncio.wait_for(stream, 5)
+        return meal.json(), event
+
+    meal, event = asyncio.run(read_stream())
+    event_type, data = event.removesuffix("\n\n").split("\n")
+    assert event_type == "event: meal.created"
+    assert json.loads(data.removeprefix("data: "))["data"]["id"] == meal["id"]
+    client.delete(f"/meals/{meal['id']}", headers=headers)
+
+
+def test_websocket_rejects_invalid_token(client: TestClient):
+    with pytest.raises(WebSocketDisconnect):
+        with client.websocket_connect("/events/ws?token=invalid") as websocket:
+            websocket.receive_json()
+
+
+def test_invalidation_bus_reaches_other_workers_over_unix_sockets(tmp_path):
+    # Two buses stand in for two worker processes on the same machine
+    first, second = InvalidationBus(), InvalidationBus()
+    received = []
+    delivered = threading.Event()
+
+    def on_food_item_changed(food_item_id):
+        received.append(food_item_id)
+        delivered.set()
+
+    second.subscribe(FOOD_ITEM, on_food_item_changed)
+    first.start(UnixSocketTransport(str(tmp_path)))
+    second.start(UnixSocketTransport(str(tmp_path)))
+    try:
+        # A socket left behind by a crashed worker is cleaned up on send
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        stale.bind(str(tmp_path / "stale.sock"))
+        stale.close()
+
+        first.publish(FOOD_ITEM, 7)
+        assert delivered.wait(timeout=5)
+        assert received == [7]
+        assert not (tmp_path / "stale.sock").exists()
+
+        # Publishing runs local handlers right away and isn't echoed back
+        second.publish(FOOD_ITEM, 8)
+        assert received == [7, 8]
+    finally:
+        first.stop()
+        second.stop()
+    assert list(tmp_path.iterdir()) == []
+
+
+PUBLISHING_WORKER = """
+import sys
+from app.events import publish_meal_event
+from app.invalidation import UnixSocketTransport, bus
+from app.models import Meal
+
+bus.start(UnixSocketTransport(sys.argv[1]))
+try:
+    publish_meal_event("deleted", Meal(id=5, creator_id=3))
+finally:
+    bus.stop()
+"""
+
+
+def test_meal_events_reach_subscribers_of_other_workers(tmp_path):
+    root = os.path.join(os.path.dirname(__file__), "..")
+
+    async def scenario():
+        subscription = await get_event_source().subscribe(3)
+        try:
+            await asyncio.to_thread(
+                subprocess.run,
+                [sys.executable, "-c", PUBLISHING_WORKER, str(tmp_path)],
+                cwd=root,
+                check=True,
+            )
+            return await subscription.get(timeout=5)
+        finally:
+            get_event_source().unsubscribe(subscription)
+
+    bus.start(UnixSocketTransport(str(tmp_path)))
+    try:
+        event = asyncio.run(scenario())
+    finally:
+        bus.stop()
+    assert event == {"type": "meal.deleted", "change_seq": None, "data": {"id": 5}}
@@ -0,0 +1,393 @@
+"""Per endpoint budgets for SQL statements, fetched rows and wall time.
+
+The `costs` fixture runs the scenario below once against a fresh database.
+Every request goes through a `BudgetClient`, which records what it cost
+under the path template of the route it matched. The tests compare the most
+expensive request of every route against app/query_budgets.json. The
+scenario works with several rows per table, so a query per row (N+1) or a
+commit per row shows up as a broken budget.
+
+After an intended change, rewrite the statement and row budgets with
+UPDATE_QUERY_BUDGETS=1 python -m pytest app/test_query_budgets.py
+and review the diff of the budget file. Wall time depends on the machine,
+WALL_TIME_SCALE=3 gives a slower one three times the time budgets.
+"""
+
+import json
+import os
+import sqlite3
+import time
+from dataclasses import dataclass, field
+from datetime import date
+from urllib.parse import urlsplit
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from sqlmodel import Session, SQLModel, StaticPool, create_engine
+from starlette.routing import Match
+
+from .dependencies import get_password_hash, get_session
+from .jobs import enqueue
+from .main import app
+from .models import User
+from .routers import health
+
+BUDGET_FILE = os.path.join(os.path.dirname(__file__), "query_budgets.json")
+UPDATE_BUDGETS = os.getenv("UPDATE_QUERY_BUDGETS") == "1"
+WALL_TIME_SCALE = float(os.getenv("WALL_TIME_SCALE", "1"))
+MEASURES = ("statements", "rows", "milliseconds")
+# Wall time is noisy, new budgets get plenty of headroom
+DEFAULT_MILLISECONDS = 250
+# Routes the scenario can't call through a plain request
+UNMEASURED_ROUTES = {
+    "GET /events/stream",  # never ends
+    "GET /openapi.json",
+    "GET /docs",
+    "GET /docs/oauth2-redirect",
+    "GET /redoc",
+}
+ITEM_COUNT = 10
+TODAY = date.today().isoformat()
+
+admin_username = "budget-admin"
+admin_password = "budget-password"
+
+
+## Measuring
+
+
+@dataclass
+class RequestCost:
+    statements: int = 0
+    rows: int = 0
+    milliseconds: float = 0.0
+
+
+@dataclass
+class CostRecorder:
+    current: RequestCost = field(default_factory=RequestCost)
+    routes: dict[str, RequestCost] = field(default_factory=dict)
+
+    def record(self, route: str, cost: RequestCost) -> None:
+        worst = self.routes.setdefault(route, RequestCost())
+        worst.statements = max(worst.statements, cost.statements)
+        worst.rows = max(worst.rows, cost.rows)
+        worst.milliseconds = max(worst.milliseconds, cost.milliseconds)
+
+
+class CountingCursor(sqlite3.Cursor):
+    """Counts the rows SQLAlchemy fetches from the driver."""
+
+    def count_rows(self, count: int) -> None:
+        self.connection.recorder.current.rows += count
+
+    def fetchone(self):
+        row = super().fetchone()
+        if row is not None:
+            self.count_rows(1)
+        return row
+
+    def fetchmany(self, size=None):
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self.count_rows(len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        self.count_rows(len(rows))
+        return rows
+
+
+class CountingConnection(sqlite3.Connection):
+    recorder: CostRecorder
+
+    def cursor(self, factory=CountingCursor):
+        return super().cursor(factory)
+
+
+def route_of(method: str, url: str) -> str:
+    scope = {"type": "http", "method": method, "path": urlsplit(url).path}
+    for route in app.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return f"{method} {route.path}"
+    return f"{method} {scope['path']}"
+
+
+class BudgetClient:
+    """Sends requests through the TestClient and records what each one cost."""
+
+    def __init__(self, client: TestClient, recorder: CostRecorder):
+        self.client = client
+        self.recorder = recorder
+        self.headers: dict[str, str] = {}
+
+    def request(self, method: str, url: str, **kwargs):
+        kwargs.setdefault("headers", self.headers)
+        cost = self.recorder.current = RequestCost()
+        start = time.perf_counter()
+        response = self.client.request(method, url, **kwargs)
+        cost.milliseconds = (time.perf_counter() - start) * 1000
+        assert response.status_code < 400, (method, url, response.text)
+        self.recorder.record(route_of(method, url), cost)
+        return response
+
+    def get(self, url: str, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def put(self, url: str, **kwargs):
+        return self.request("PUT", url, **kwargs)
+
+    def patch(self, url: str, **kwargs):
+        return self.request("PATCH", url, **kwargs)
+
+    def delete(self, url: str, **kwargs):
+        return self.request("DELETE", url, **kwargs)
+
+
+def counting_engine(recorder: CostRecorder):
+    engine = create_engine(
+        "sqlite://",
+        connect_args={"check_same_thread": False, "factory": CountingConnection},
+        poolclass=StaticPool,
+    )
+
+    def attach_recorder(dbapi_connection, connection_record):
+        dbapi_connection.recorder = recorder
+
+    def count_statement(*args):
+        recorder.current.statements += 1
+
+    # Ahead of the dialect's own first connect queries
+    event.listen(engine, "connect", attach_recorder, insert=True)
+    event.listen(engine, "before_cursor_execute", count_statement)
+    return engine
+
+
+## Scenario
+
+
+def users_and_auth(budget_client: BudgetClient):
+    response = budget_client.post(
+        "/auth/token", data={"username": admin_username, "password": admin_password}
+    )
+    token = response.json()["access_token"]
+    budget_client.headers = {"Authorization": f"Bearer {token}"}
+    me = budget_client.get("/auth/me").json()
+
+    for index in range(ITEM_COUNT):
+        budget_client.post(
+            "/users/", json={"username": f"user-{index}", "password": "password"}
+        )
+    admin = budget_client.post(
+        "/users/admin", json={"username": "second-admin", "password": "password"}
+    ).json()
+    assert len(budget_client.get("/users/").json()) == ITEM_COUNT + 2
+    budget_client.get(f"/users/{me['id']}")
+    budget_client.patch(f"/users/{admin['id']}", json={"is_active": False})
+    budget_client.delete(f"/users/{admin['id']}")
+
+
+def food_items_and_recipes(budget_client: BudgetClient):
+    ids = [
+        budget_client.post(
+            "/fooditems/",
+            json={
+                "name": f"Item {index}",
+                "calories": 100 + index,
+                "barcode": str(index),
+            },
+        ).json()["id"]
+        for index in range(ITEM_COUNT)
+    ]
+    assert len(budget_client.get("/fooditems/").json()) == ITEM_COUNT
+    budget_client.get(f"/fooditems/{ids[0]}")
+    budget_client.get("/fooditems/barcode/1")
+
+    recipe = budget_client.post(
+        "/recipes/",
+        json={
+            "name": "Recipe",
+            "ingredients": [
+                {"ingredient_id": food_item_id, "amount": 50}
+                for food_item_id in ids[:3]
+            ],
+        },
+    ).json()
+    budget_client.get(f"/recipes/{recipe['id']}")
+    budget_client.put(
+        f"/recipes/{recipe['id']}/ingredients",
+        json=[
+            {"ingredient_id": food_item_id, "amount": 25} for food_item_id in ids[:5]
+        ],
+    )
+    # Recomputes the recipe it is part of
+    budget_client.patch(f"/fooditems/{ids[0]}", json={"calories": 90})
+    budget_client.delete(f"/fooditems/{ids[-1]}")
+
+
+def meals(budget_client: BudgetClient):
+    food_items = budget_client.get("/fooditems/", params={"name": "Item"}).json()
+    meals = budget_client.post(
+        "/meals/create-many",
+        json=[
+            {
+                "calories": 150,
+                "food_amount": 150,
+                "food_item_id": food_item["id"],
+                "created_at": TODAY,
+            }
+            for food_item in food_items
+        ],
+    ).json()
+    meal = budget_client.post(
+        "/meals/", json={"calories": 42, "food_item_id": food_items[0]["id"]}
+    ).json()
+
+    assert len(budget_client.get("/meals/", params={"selected_date": TODAY}).json()) > 1
+    budget_client.get("/meals/", params={"ids": [meal["id"] for meal in meals]})
+    budget_client.get("/meals/range", params={"from": TODAY, "to": TODAY})
+    budget_client.get("/meals/summary", params={"from": TODAY, "to": TODAY})
+    budget_client.get("/meals/stats")
+    budget_client.get(f"/meals/{meal['id']}")
+    budget_client.patch(
+        "/meals/update-many",
+        json=[{"id": meal["id"], "calories": 160} for meal in meals],
+    )
+    budget_client.patch(f"/meals/{meal['id']}", json={"calories": 50})
+    budget_client.delete(f"/meals/{meal['id']}")
+
+
+def shares_sync_jobs_and_batch(
+    budget_client: BudgetClient, session: Session, monkeypatch: pytest.MonkeyPatch
+):
+    meals = budget_client.get("/meals/", params={"selected_date": TODAY}).json()
+    share = budget_client.post(
+        "/shares/", json={"meal_ids": [meal["id"] for meal in meals]}
+    ).json()
+    budget_client.get(f"/shares/{share['token']}")
+    budget_client.delete(f"/shares/{share['token']}")
+
+    budget_client.get("/sync/changes")
+
+    admin = budget_client.get("/auth/me").json()
+    job = enqueue(session, "budget", creator_id=admin["id"])
+    budget_client.get(f"/jobs/{job.id}")
+
+    # The test database is a single connection
+    monkeypatch.setattr("app.routers.batch.BATCH_READ_CONCURRENCY", 1)
+    budget_client.post(
+        "/batch/",
+        json={
+            "requests": [
+                {"path": "/auth/me"},
+                {"path": f"/meals/?selected_date={TODAY}"},
+                {"method": "POST", "path": "/meals/", "body": {"calories": 1}},
+            ]
+        },
+    )
+
+
+def health_probes(
+    budget_client: BudgetClient, session: Session, monkeypatch: pytest.MonkeyPatch
+):
+    budget_client.get("/health/live")
+    # Past the startup check, a probe only pings the database
+    monkeypatch.setattr(health.readiness, "engine", session.get_bind())
+    monkeypatch.setattr(health.readiness, "checked", True)
+    budget_client.get("/health/ready")
+
+
+@pytest.fixture(name="costs", scope="module")
+def costs_fixture() -> dict[str, RequestCost]:
+    """Runs the scenario and returns the most expensive request per route."""
+    recorder = CostRecorder()
+    engine = counting_engine(recorder)
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session, pytest.MonkeyPatch.context() as monkeypatch:
+        session.add(
+            User.model_validate(
+                {
+                    "username": admin_username,
+                    "hashed_password": get_password_hash(admin_password),
+                    "is_admin": True,
+                }
+            )
+        )
+        session.commit()
+        app.dependency_overrides[get_session] = lambda: session
+        try:
+            budget_client = BudgetClient(TestClient(app), recorder)
+            users_and_auth(budget_client)
+            food_items_and_recipes(budget_client)
+            meals(budget_client)
+            shares_sync_jobs_and_batch(budget_client, session, monkeypatch)
+            health_probes(budget_client, session, monkeypatch)
+        finally:
+            app.dependency_overrides.clear()
+    engine.dispose()
+    return recorder.routes
+
+
+## Budgets
+
+
+def http_routes() -> set[str]:
+    return {
+        f"{method} {route.path}"
+        for route in app.routes
+        for method in getattr(route, "methods", None) or ()
+        if method != "HEAD"
+    }
+
+
+def load_budgets() -> dict:
+    with open(BUDGET_FILE) as file:
+        return json.load(file)
+
+
+def write_budgets(costs: dict[str, RequestCost], budgets: dict) -> None:
+    updated = {}
+    for route, cost in sorted(costs.items()):
+        milliseconds = budgets.get(route, {}).get("milliseconds", DEFAULT_MILLISECONDS)
+        updated[route] = {
+            "statements": cost.statements,
+            "rows": cost.rows,
+            "milliseconds": max(milliseconds, int(cost.milliseconds * 2)),
+        }
+    with open(BUDGET_FILE, "w") as file:
+        json.dump(updated, file, indent=2)
+        file.write("\n")
+
+
+def test_scenario_calls_every_route(costs: dict[str, RequestCost]):
+    unmeasured = http_routes() - set(costs) - UNMEASURED_ROUTES
+    assert not unmeasured, f"Add these routes to the scenario: {sorted(unmeasured)}"
+
+
+def test_every_endpoint_stays_within_its_budget(costs: dict[str, RequestCost]):
+    budgets = load_budgets()
+    if UPDATE_BUDGETS:
+        write_budgets(costs, budgets)
+        pytest.skip(f"Rewrote {BUDGET_FILE}")
+
+    missing = set(costs) - set(budgets)
+    assert not missing, f"Add budgets for these routes: {sorted(missing)}"
+
+    over_budget = []
+    for route, cost in sorted(costs.items()):
+        budget = budgets[route]
+        for measure in MEASURES:
+            limit = budget[measure]
+            if measure == "milliseconds":
+                limit *= WALL_TIME_SCALE
+            if getattr(cost, measure) > limit:
+                over_budget.append(
+                    f"{route}: {getattr(cost, measure):g} {measure}, "
+                    f"budget {limit:g}"
+                )
+    assert not over_budget, "\n".join(over_budget)
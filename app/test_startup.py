@@ -0,0 +1,101 @@
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+from alembic import command
+from alembic.config import Config
+from alembic.script import ScriptDirectory
+from fastapi.testclient import TestClient
+from sqlmodel import create_engine
+
+from .baseline import create_baseline_schema
+from .health import ALEMBIC_DIRECTORY, Readiness
+from .main import app
+from .routers import health
+
+# Seconds from starting the interpreter until a worker answers its liveness
+# probe, and until it reports ready. Several times what it takes on a laptop,
+# WALL_TIME_SCALE stretches them on slower machines.
+WALL_TIME_SCALE = float(os.getenv("WALL_TIME_SCALE", "1"))
+LIVE_BUDGET_SECONDS = 5.0
+READY_BUDGET_SECONDS = 6.0
+
+COLD_START = """
+import time
+from fastapi.testclient import TestClient
+from app.main import app
+
+with TestClient(app) as client:
+    assert client.get("/health/live").status_code == 200
+    live = time.time()
+    while client.get("/health/ready").status_code != 200:
+        time.sleep(0.01)
+    ready = time.time()
+print(live, ready)
+"""
+
+
+@pytest.fixture(name="database_url")
+def database_url_fixture(tmp_path, monkeypatch: pytest.MonkeyPatch):
+    database_url = f"sqlite:///{tmp_path / 'startup.db'}"
+    monkeypatch.setenv("DATABASE_URL", database_url)
+    return database_url
+
+
+def alembic_config() -> Config:
+    config = Config(os.path.join(os.path.dirname(__file__), "..", "alembic.ini"))
+    config.set_main_option("script_location", ALEMBIC_DIRECTORY)
+    return config
+
+
+def test_readiness_waits_for_the_schema_at_head(
+    database_url: str, monkeypatch: pytest.MonkeyPatch
+):
+    readiness = Readiness(create_engine(database_url), warmup_connections=2)
+    monkeypatch.setattr(health, "readiness", readiness)
+    client = TestClient(app)
+    assert client.get("/health/live").json() == {"status": "ok"}
+
+    response = client.get("/health/ready")
+    assert response.status_code == 503
+    assert "no revision" in response.json()["detail"]
+
+    # Set up the way initialize_database.py sets up a fresh database
+    head = ScriptDirectory(ALEMBIC_DIRECTORY).get_revision("head")
+    create_baseline_schema(readiness.engine, alembic_config())
+    command.upgrade(alembic_config(), head.down_revision)
+    response = client.get("/health/ready")
+    assert response.status_code == 503
+    assert f"at {head.down_revision}, expected {head.revision}" in (
+        response.json()["detail"]
+    )
+
+    command.upgrade(alembic_config(), "head")
+    assert client.get("/health/ready").json() == {"status": "ok"}
+    assert readiness.engine.pool.checkedin() == 2
+
+
+def test_cold_start_stays_within_budget(database_url: str, tmp_path):
+    create_baseline_schema(create_engine(database_url), alembic_config())
+    command.upgrade(alembic_config(), "head")
+    root = os.path.join(os.path.dirname(__file__), "..")
+    environment = dict(
+        os.environ,
+        DATABASE_URL=database_url,
+        INVALIDATION_SOCKET_DIR=str(tmp_path / "sockets"),
+    )
+    start = time.time()
+    result = subprocess.run(
+        [sys.executable, "-c", COLD_START],
+        cwd=root,
+        env=environment,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    live, ready = (float(value) - start for value in result.stdout.split()[-2:])
+    assert live <= ready
+    assert live < LIVE_BUDGET_SECONDS * WALL_TIME_SCALE
+    assert ready < READY_BUDGET_SECONDS * WALL_TIME_SCALE
@@ -0,0 +1,122 @@
+"""Time /meals/stats computations on five years of synthetic meals.
+
+Run with `python -m benchmarks.meal_stats` from the repository root.
+"""
+
+import os
+import random
+import timeit
+from collections import defaultdict
+from datetime import date, timedelta
+from decimal import Decimal
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+os.environ.setdefault("SECRET_KEY", "benchmark")
+
+from sqlmodel import Session, SQLModel, StaticPool, create_engine, select
+
+from app.models import FoodItem, Meal, User
+from app.stats import (
+    compute_meal_stats,
+    get_meal_stats,
+    invalidate_meal_stats,
+    load_meal_stats_columns,
+)
+
+YEARS = 5
+MEALS_PER_DAY = 5
+REPEAT = 10
+
+
+def populate(session: Session, first_day: date) -> None:
+    rng = random.Random(42)
+    user = User(username="benchmark")
+    session.add(user)
+    session.commit()
+    food_items = [
+        FoodItem(
+            name=f"Food {i}",
+            calories=Decimal(rng.randint(0, 90000)) / 100,
+            fats=Decimal(rng.randint(0, 3000)) / 100,
+            carbs=Decimal(rng.randint(0, 8000)) / 100,
+            protein=Decimal(rng.randint(0, 3000)) / 100,
+            creator_id=user.id,
+        )
+        for i in range(500)
+    ]
+    session.add_all(food_items)
+    session.commit()
+    meals = []
+    for day in range(YEARS * 365):
+        # Leave some gaps so that streaks are not trivial
+        if rng.random() < 0.05:
+            continue
+        for mealtime_id in range(1, MEALS_PER_DAY + 1):
+            meals.append(
+                Meal(
+                    calories=Decimal(rng.randint(0, 100000)) / 100,
+                    food_amount=Decimal(rng.randint(100, 50000)) / 100,
+                    food_item_id=rng.choice(food_items).id,
+                    created_at=first_day + timedelta(days=day),
+                    mealtime_id=mealtime_id,
+                    creator_id=user.id,
+                )
+            )
+    session.add_all(meals)
+    session.commit()
+    print(f"{len(meals)} meals over {YEARS} years")
+
+
+def per_row_daily_rolling_average(session: Session):
+    # Baseline: only the daily totals and the 7 day rolling average, computed
+    # the straightforward way over ORM objects.
+    daily = defaultdict(Decimal)
+    for meal in session.exec(select(Meal).where(Meal.creator_id == 1)).all():
+        daily[meal.created_at] += meal.calories
+    day = min(daily)
+    averages = []
+    while day <= max(daily):
+        window = [
+            daily[day - timedelta(days=offset)]
+            for offset in range(7)
+            if day - timedelta(days=offset) in daily
+        ]
+        averages.append(sum(window) / len(window) if window else 0)
+        day += timedelta(days=1)
+    session.expunge_all()
+    return averages
+
+
+def main() -> None:
+    engine = create_engine(
+        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+    )
+    SQLModel.metadata.create_all(engine)
+    today = date(2025, 12, 31)
+    with Session(engine) as session:
+        populate(session, today - timedelta(days=YEARS * 365 - 1))
+        session.expunge_all()
+        columns = load_meal_stats_columns(session, 1)
+
+        def uncached():
+            invalidate_meal_stats(1)
+            get_meal_stats(session, 1, today)
+
+        for name, function in [
+            ("per-row ORM loop (daily + 7d only)", per_row_daily_rolling_average),
+            ("load columns", lambda s: load_meal_stats_columns(s, 1)),
+            (
+                "vectorized stats on columns",
+                lambda s: compute_meal_stats(columns, today),
+            ),
+            ("full request, cache miss", lambda s: uncached()),
+            ("full request, cache hit", lambda s: get_meal_stats(s, 1, today)),
+        ]:
+            seconds = min(
+                timeit.repeat(lambda: function(session), number=1, repeat=REPEAT)
+            )
+            print(f"{name:<36} {seconds * 1000:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
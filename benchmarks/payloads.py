@@ -0,0 +1,104 @@
+"""Compare size and encode time of JSON, MessagePack and their compressed forms.
+
+Run with `python -m benchmarks.payloads` from the repository root.
+"""
+
+import gzip
+import os
+import random
+import timeit
+from datetime import date, timedelta
+from decimal import Decimal
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+os.environ.setdefault("SECRET_KEY", "benchmark")
+
+import brotli
+import msgpack
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from app.compression import BROTLI_QUALITY, GZIP_LEVEL
+from app.models import FoodItemPublic, MealPublic
+
+REPEAT = 200
+
+
+def food_item_page() -> list:
+    # A full page of /fooditems/
+    rng = random.Random(42)
+    return [
+        FoodItemPublic(
+            id=i,
+            name=f"Food item number {i}",
+            brand=rng.choice(["", "Brand A", "Another brand"]),
+            calories=Decimal(rng.randint(0, 90000)) / 100,
+            fats=Decimal(rng.randint(0, 3000)) / 100,
+            carbs=Decimal(rng.randint(0, 8000)) / 100,
+            protein=Decimal(rng.randint(0, 3000)) / 100,
+            portion_weight=Decimal(rng.randint(0, 50000)) / 100,
+            barcode=str(rng.randint(10**12, 10**13)),
+            creator_id=1,
+        )
+        for i in range(100)
+    ]
+
+
+def meal_range(food_items: list[FoodItemPublic]) -> dict:
+    # A month of /meals/range/ with five meals a day
+    rng = random.Random(42)
+    first_day = date(2025, 1, 1)
+    return {
+        first_day
+        + timedelta(days=day): [
+            MealPublic(
+                id=day * 5 + mealtime_id,
+                calories=Decimal(rng.randint(0, 100000)) / 100,
+                food_amount=Decimal(rng.randint(100, 50000)) / 100,
+                food_item=(food_item := rng.choice(food_items)),
+                food_item_id=food_item.id,
+                created_at=first_day + timedelta(days=day),
+                mealtime_id=mealtime_id,
+            )
+            for mealtime_id in range(1, 6)
+        ]
+        for day in range(31)
+    }
+
+
+def encoders(content) -> dict:
+    # Compressed variants include the time spent encoding
+    def as_json():
+        return JSONResponse(content).body
+
+    def as_msgpack():
+        return msgpack.packb(content)
+
+    return {
+        "JSON": as_json,
+        "MessagePack": as_msgpack,
+        "JSON + gzip": lambda: gzip.compress(as_json(), GZIP_LEVEL, mtime=0),
+        "JSON + brotli": lambda: brotli.compress(as_json(), quality=BROTLI_QUALITY),
+        "MessagePack + gzip": lambda: gzip.compress(as_msgpack(), GZIP_LEVEL, mtime=0),
+        "MessagePack + brotli": lambda: brotli.compress(
+            as_msgpack(), quality=BROTLI_QUALITY
+        ),
+    }
+
+
+def main() -> None:
+    food_items = food_item_page()
+    for title, payload in [
+        ("100 food items", food_items),
+        ("31 days of meals", meal_range(food_items)),
+    ]:
+        content = jsonable_encoder(payload)
+        print(title)
+        for name, encode in encoders(content).items():
+            size = len(encode())
+            seconds = min(timeit.repeat(encode, number=1, repeat=REPEAT))
+            print(f"  {name:<22} {size:8d} bytes {seconds * 1e6:9.1f} us")
+
+
+if __name__ == "__main__":
+    main()
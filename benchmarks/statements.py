@@ -0,0 +1,117 @@
+"""Compare freshly built select() statements against the cached lambda statements.
+
+Run with `python -m benchmarks.statements` from the repository root.
+"""
+
+import os
+import timeit
+from datetime import date
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+os.environ.setdefault("SECRET_KEY", "benchmark")
+
+from sqlalchemy.orm import joinedload
+from sqlmodel import Session, SQLModel, StaticPool, col, create_engine, select
+
+from app.models import FoodItem, Meal, User
+from app.statements import (
+    food_item_by_barcode,
+    meals_by_creator_and_date,
+    user_by_username,
+)
+
+NUMBER = 2000
+REPEAT = 5
+
+
+def build_user_by_username(username: str):
+    return select(User).where(col(User.username) == username)
+
+
+def build_meals_by_creator_and_date(creator_id: int, created_at: date):
+    return (
+        select(Meal)
+        .options(joinedload(Meal.food_item))
+        .where(col(Meal.creator_id) == creator_id)
+        .where(col(Meal.created_at) == created_at)
+    )
+
+
+def build_food_item_by_barcode(barcode: str):
+    return (
+        select(FoodItem)
+        .where(col(FoodItem.barcode) == barcode)
+        .where(col(FoodItem.deleted_at).is_(None))
+        .order_by(col(FoodItem.id))
+        .limit(1)
+    )
+
+
+def populate(session: Session) -> None:
+    user = User(username="benchmark")
+    session.add(user)
+    session.commit()
+    food_item = FoodItem(name="Bread", barcode="5900000000017", creator_id=user.id)
+    session.add(food_item)
+    session.commit()
+    session.add_all(
+        Meal(food_item_id=food_item.id, creator_id=user.id, created_at=date.today())
+        for _ in range(5)
+    )
+    session.commit()
+
+
+def best_of(function) -> float:
+    return min(timeit.repeat(function, number=NUMBER, repeat=REPEAT)) / NUMBER
+
+
+def main() -> None:
+    engine = create_engine(
+        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+    )
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        populate(session)
+        today = date.today()
+        cases = [
+            (
+                "user by username",
+                lambda: build_user_by_username("benchmark"),
+                lambda: user_by_username("benchmark"),
+            ),
+            (
+                "meals by creator and date",
+                lambda: build_meals_by_creator_and_date(1, today),
+                lambda: meals_by_creator_and_date(1, today),
+            ),
+            (
+                "food item by barcode",
+                lambda: build_food_item_by_barcode("5900000000017"),
+                lambda: food_item_by_barcode("5900000000017"),
+            ),
+        ]
+        dialect = engine.dialect
+        print(f"{'':<36}{'select()':>12}{'lambda':>12}  (us per call)")
+        for name, built, cached in cases:
+            # Statement construction plus the cache key lookup that every
+            # execution does before it can reuse compiled SQL
+            prepare = [
+                best_of(lambda: make()._generate_cache_key()) * 1e6
+                for make in (built, cached)
+            ]
+            execute = [
+                best_of(lambda: session.scalars(make()).all()) * 1e6
+                for make in (built, cached)
+            ]
+            print(f"{name + ', build':<36}{prepare[0]:12.1f}{prepare[1]:12.1f}")
+            print(f"{name + ', execute':<36}{execute[0]:12.1f}{execute[1]:12.1f}")
+        # Both end up using the compiled cache, a cold compile is what every
+        # request would pay without it
+        compile_seconds = best_of(
+            lambda: build_user_by_username("benchmark").compile(dialect=dialect)
+        )
+        print(f"{'uncached compile':<36}{compile_seconds * 1e6:12.1f}")
+
+
+if __name__ == "__main__":
+    main()
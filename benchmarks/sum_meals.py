@@ -0,0 +1,104 @@
+"""Compare summing a year of meals in Python against the integer SQL aggregate.
+
+Run with `python -m benchmarks.sum_meals` from the repository root.
+"""
+
+import os
+import random
+import timeit
+from datetime import date, timedelta
+from decimal import Decimal
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+os.environ.setdefault("SECRET_KEY", "benchmark")
+
+from sqlmodel import Session, SQLModel, StaticPool, create_engine, select
+
+from app.models import FoodItem, Meal, User
+from app.routers.meals import meal_summary_query
+
+MEALS_PER_DAY = 5
+REPEAT = 20
+
+
+def populate(session: Session, first_day: date) -> None:
+    rng = random.Random(42)
+    user = User(username="benchmark")
+    session.add(user)
+    session.commit()
+    food_items = [
+        FoodItem(
+            name=f"Food {i}",
+            calories=Decimal(rng.randint(0, 90000)) / 100,
+            fats=Decimal(rng.randint(0, 3000)) / 100,
+            carbs=Decimal(rng.randint(0, 8000)) / 100,
+            protein=Decimal(rng.randint(0, 3000)) / 100,
+            creator_id=user.id,
+        )
+        for i in range(200)
+    ]
+    session.add_all(food_items)
+    session.commit()
+    for day in range(365):
+        for mealtime_id in range(1, MEALS_PER_DAY + 1):
+            food_item = rng.choice(food_items)
+            session.add(
+                Meal(
+                    calories=Decimal(rng.randint(0, 100000)) / 100,
+                    food_amount=Decimal(rng.randint(100, 50000)) / 100,
+                    food_item_id=food_item.id,
+                    created_at=first_day + timedelta(days=day),
+                    mealtime_id=mealtime_id,
+                    creator_id=user.id,
+                )
+            )
+    session.commit()
+
+
+def sum_in_python(session: Session, first_day: date, last_day: date):
+    meals = session.exec(
+        select(Meal)
+        .where(Meal.created_at >= first_day)
+        .where(Meal.created_at <= last_day)
+    ).all()
+    totals = [Decimal(0)] * 4
+    for meal in meals:
+        food_item = meal.food_item
+        totals[0] += meal.calories
+        totals[1] += food_item.fats * meal.food_amount / 100
+        totals[2] += food_item.carbs * meal.food_amount / 100
+        totals[3] += food_item.protein * meal.food_amount / 100
+    session.expunge_all()
+    return totals
+
+
+def sum_in_database(session: Session, first_day: date, last_day: date):
+    return session.exec(meal_summary_query(1, first_day, last_day)).one()
+
+
+def main() -> None:
+    engine = create_engine(
+        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+    )
+    SQLModel.metadata.create_all(engine)
+    first_day = date(2025, 1, 1)
+    last_day = first_day + timedelta(days=364)
+    with Session(engine) as session:
+        populate(session, first_day)
+        session.expunge_all()
+        for name, function in [
+            ("ORM rows + Decimal sum", sum_in_python),
+            ("integer SQL aggregate", sum_in_database),
+        ]:
+            seconds = min(
+                timeit.repeat(
+                    lambda: function(session, first_day, last_day),
+                    number=1,
+                    repeat=REPEAT,
+                )
+            )
+            print(f"{name:<24} {seconds * 1000:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,14 @@
 import os
 import sys
 
+from alembic import command
+from alembic.config import Config
 from dotenv import load_dotenv
-from psycopg2.errors import UniqueViolation
+from sqlalchemy import inspect
 from sqlalchemy.exc import IntegrityError
 from sqlmodel import Session, create_engine
 
+from app.baseline import create_baseline_schema
 from app.dependencies import get_password_hash
 from app.models import *
 
@@ -16,8 +19,22 @@ DEFAULT_ADMIN_PASSWORD = os.environ["DEFAULT_ADMIN_PASSWORD"]
 DATABASE_URL = os.environ["DATABASE_URL"]
 
 engine = create_engine(DATABASE_URL)
+alembic_config = Config(os.path.join(os.path.dirname(__file__), "alembic.ini"))
+
+# The workers don't touch the schema, it is created or migrated here
+tables = inspect(engine).get_table_names()
+if not tables:
+    # A fresh database runs the same migrations as an existing one, so it
+    # gets the meal partitions on Postgres too
+    create_baseline_schema(engine, alembic_config)
+    command.upgrade(alembic_config, "head")
+elif "alembic_version" in tables:
+    command.upgrade(alembic_config, "head")
+else:
+    print("The database has tables but no Alembic revision. Find the revision")
+    print("matching its schema, run `alembic stamp <revision>` and try again.")
+    sys.exit(1)
 
-SQLModel.metadata.create_all(engine)
 try:
     with Session(engine) as session:
         new_user = User.model_validate(
@@ -31,7 +48,8 @@ try:
         session.commit()
         session.refresh(new_user)
 except IntegrityError as e:
-    if isinstance(e.orig, UniqueViolation):
+    # UniqueViolation, raised by psycopg2 and psycopg 3 alike
+    if getattr(e.orig, "sqlstate", getattr(e.orig, "pgcode", None)) == "23505":
         print("No need to create default admin. It already exists!")
         sys.exit(0)
     print("Couldn't create default admin. Error details below:")